@@ -0,0 +1,162 @@
+"""
+Offline stand-ins for the HySDS, osaka and boto packages so that the PGE
+modules can be imported by the benchmarks on a machine without the HySDS
+stack. Real packages are always preferred when they are importable.
+"""
+
+import os
+import sys
+import types
+
+
+BASE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class _Conf(object):
+    GRQ_ES_URL = os.environ.get("GRQ_ES_URL", "http://127.0.0.1:9200")
+
+
+class _App(object):
+    conf = _Conf()
+
+
+def _not_available(*args, **kwargs):
+    raise RuntimeError("Not available in offline benchmark shim.")
+
+
+def _local_path(url):
+    if url.startswith("file://"):
+        return url[len("file://"):]
+    if "://" not in url:
+        return url
+    return None
+
+
+def _osaka_get(url, path, params=None, measure=False, output=None):
+    """Fetch http(s) or file URL to path over a single connection."""
+
+    import shutil
+    local = _local_path(url)
+    if local is not None:
+        shutil.copyfile(local, path)
+        return
+    import requests
+    with requests.get(url, stream=True, verify=False) as r:
+        r.raise_for_status()
+        with open(path, 'wb') as f:
+            for chunk in r.iter_content(1024 * 1024):
+                f.write(chunk)
+
+
+def _osaka_put(path, url, params=None, measure=False, output=None):
+    """Copy path to a file URL."""
+
+    import shutil
+    local = _local_path(url)
+    if local is None:
+        _not_available()
+    os.makedirs(os.path.dirname(os.path.abspath(local)), exist_ok=True)
+    shutil.copyfile(path, local)
+
+
+class _Recognizer(object):
+    """Match a product against a datasets JSON config of the form
+       [{"match": <regex>, "extractor": <extractor or null>}, ...]."""
+
+    def __init__(self, dsets_file, prod_path, objectid, version):
+        import re
+        import json
+        with open(dsets_file) as f:
+            dsets = json.load(f)
+        self.objectid = objectid
+        self.dataset = next((d for d in dsets
+                             if re.search(d.get("match", ".*"), objectid)), {})
+
+    def getId(self):
+        return self.objectid
+
+    def getMetadataExtractor(self):
+        return self.dataset.get("extractor")
+
+
+SHIMS = {
+    "boto": {},
+    "osaka": {},
+    "osaka.main": {"get": _osaka_get, "put": _osaka_put,
+                   "supported": lambda url: True},
+    "hysds": {},
+    "hysds.celery": {"app": _App()},
+    "hysds.orchestrator": {"submit_job": _not_available},
+    "hysds.dataset_ingest": {"ingest": _not_available},
+    "hysds.recognize": {"Recognizer": _Recognizer},
+    "hysds_commons": {},
+    "hysds_commons.job_rest_utils": {"single_process_and_submission": _not_available},
+    "hysds_commons.job_utils": {"resolve_hysds_job": _not_available},
+}
+
+
+def _importable(name):
+    try:
+        __import__(name)
+    except ImportError:
+        return False
+    return True
+
+
+def missing():
+    """Return names of the packages that need a stand-in."""
+
+    return sorted(name for name in SHIMS if not _importable(name))
+
+
+def install(names=None):
+    """Install stand-ins for missing packages (or only for names), put
+       the repo on sys.path and turn off spans unless PGE_METRICS_SPANS is
+       set, so that benchmarks neither time nor leave behind span output."""
+
+    if BASE_PATH not in sys.path:
+        sys.path.insert(0, BASE_PATH)
+    os.environ.setdefault("PGE_METRICS_SPANS", "0")
+    if "metrics" in sys.modules:
+        sys.modules["metrics"].enable_spans(os.environ["PGE_METRICS_SPANS"].lower()
+                                            not in ("0", "false", "no", "off"))
+    for name in sorted(SHIMS if names is None else names):
+        if name in sys.modules or _importable(name):
+            continue
+        mod = types.ModuleType(name)
+        mod.__dict__.update(SHIMS[name])
+        sys.modules[name] = mod
+        if "." in name:
+            parent, child = name.rsplit(".", 1)
+            setattr(sys.modules[parent], child, mod)
+
+    # urllib3 2.x dropped InsecurePlatformWarning which sling.py imports;
+    # patched once urllib3 is imported so that installing the stand-ins
+    # does not add requests to the import time of the PGE modules
+    if "urllib3.exceptions" in sys.modules:
+        _patch_urllib3(sys.modules["urllib3.exceptions"])
+    else:
+        sys.meta_path.insert(0, _Urllib3Patcher())
+
+
+def _patch_urllib3(exc):
+    if not hasattr(exc, "InsecurePlatformWarning"):
+        exc.InsecurePlatformWarning = exc.HTTPWarning
+
+
+class _Urllib3Patcher(object):
+    """Meta path finder patching urllib3.exceptions after it is loaded."""
+
+    def find_spec(self, name, path, target=None):
+        if name != "urllib3.exceptions":
+            return None
+        sys.meta_path.remove(self)
+        import importlib.util
+        spec = importlib.util.find_spec(name)
+        exec_module = spec.loader.exec_module
+
+        def patched(module):
+            exec_module(module)
+            _patch_urllib3(module)
+        spec.loader.exec_module = patched
+        return spec
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""
+Benchmark util.query_aoi_acquisitions() fetching full acquisition metadata
+with a full debug dump of the results against fetching only
+util.ACQ_FIELDS with the summary logged at info level.
+
+The stub ES runs in a child process so that only the memory of the client
+is traced.
+"""
+
+import os
+import json
+import time
+import logging
+import argparse
+import tracemalloc
+import multiprocessing
+
+import _shims
+_shims.install()
+
+import util
+from hysds.celery import app
+from stub_es import StubES
+from synthetic import make_acquisitions, make_aois, window, ACQ_INDEX, \
+    AOI_INDEX, PLATFORM
+
+
+# fields fetched before trimming
+FULL_FIELDS = ["id", "dataset_type", "dataset", "creation_timestamp", "metadata"]
+
+
+def serve(docs, aois, extra_metadata, latency, url_queue, stop):
+    indices = {
+        ACQ_INDEX: make_acquisitions(docs, extra_metadata=extra_metadata),
+        AOI_INDEX: make_aois(aois),
+    }
+    with StubES(indices, latency=latency) as es:
+        url_queue.put(es.url)
+        stop.wait()
+
+
+def run(fields, level, aoi_batch_size):
+    """Time query_aoi_acquisitions() and measure peak traced memory."""
+
+    util.ACQ_FIELDS = fields
+    util.logger.setLevel(level)
+    starttime, endtime = window()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    acq_info = util.query_aoi_acquisitions(starttime, endtime, PLATFORM,
+                                           aoi_batch_size=aoi_batch_size)
+    elapsed = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "acquisitions": len(acq_info),
+        "seconds": elapsed,
+        "peak_bytes": peak,
+        "result_bytes": len(json.dumps(acq_info)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--aois", type=int, default=50)
+    parser.add_argument("--extra_metadata", type=int, default=40,
+                        help="filler metadata keys per acquisition")
+    parser.add_argument("--latency", type=float, default=0.,
+                        help="seconds added to every ES request")
+    parser.add_argument("--aoi_batch_size", type=int, default=util.AOI_BATCH_SIZE)
+    args = parser.parse_args()
+
+    url_queue = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    server = multiprocessing.Process(target=serve, args=(
+        args.docs, args.aois, args.extra_metadata, args.latency, url_queue, stop))
+    server.start()
+    fields = util.ACQ_FIELDS
+    try:
+        app.conf.GRQ_ES_URL = url_queue.get(timeout=300)
+
+        # log records are formatted but discarded
+        handler = logging.StreamHandler(open(os.devnull, 'w'))
+        handler.setFormatter(logging.Formatter(util.log_format))
+        logging.getLogger().handlers = [handler]
+
+        results = {
+            "full_metadata_debug": run(FULL_FIELDS, logging.DEBUG,
+                                       args.aoi_batch_size),
+            "trimmed_info": run(fields, logging.INFO, args.aoi_batch_size),
+        }
+    finally:
+        stop.set()
+        server.join()
+    before, after = results["full_metadata_debug"], results["trimmed_info"]
+    results["speedup"] = before["seconds"] / after["seconds"]
+    results["peak_memory_reduction"] = 1 - after["peak_bytes"] / before["peak_bytes"]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""
+Benchmark util.iter_aoi_acquisitions() against a local stub ES as the
+number of concurrently scrolled time partitions grows.
+
+The real AOI and acquisition query bodies (filtered, partial_fields and
+named geo_shape filters) are sent to a stub claiming an ES 1.x version by
+default, so scrolls run in scan mode as on the production cluster. The
+acquisitions found with each number of slices are checked against those
+found with a single scroll.
+
+The stub runs in a child process but evaluates every query against every
+document in a single interpreter, so unlike ES its cost grows with the
+number of partitions; its request latency stands in for the cluster.
+"""
+
+import json
+import time
+import argparse
+import multiprocessing
+
+import _shims
+_shims.install()
+
+import util
+from hysds.celery import app
+from stub_es import StubES
+from synthetic import make_acquisitions, make_aois, window, ACQ_INDEX, \
+    AOI_INDEX, PLATFORM
+
+
+def serve(indices, es_version, latency, url_queue, stop, requests, scrolls):
+    """Run the stub ES, publishing its request and open scroll counts."""
+
+    with StubES(indices, es_version, latency) as es:
+        url_queue.put(es.url)
+        while not stop.wait(0.05):
+            requests.value = es.requests
+            scrolls.value = len(es.scrolls)
+
+
+def run(slices, page_size, match):
+    starttime, endtime = window()
+    found = {}
+    for acq, aois in util.iter_aoi_acquisitions(starttime, endtime, PLATFORM,
+                                                slices, page_size, match=match):
+        found.setdefault(acq['id'], set()).update(aoi['id'] for aoi in aois)
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--aois", type=int, default=50)
+    parser.add_argument("--page_size", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="seconds added to every ES request")
+    parser.add_argument("--slices", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--match", default="es", choices=["es", "local"])
+    parser.add_argument("--es_version", default="1.7.5")
+    args = parser.parse_args()
+
+    indices = {
+        ACQ_INDEX: make_acquisitions(args.docs, extra_metadata=0),
+        AOI_INDEX: make_aois(args.aois),
+    }
+    util.logger.setLevel("WARNING")
+    url_queue = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    requests = multiprocessing.Value('i', 0)
+    scrolls = multiprocessing.Value('i', 0)
+    server = multiprocessing.Process(target=serve, args=(
+        indices, args.es_version, args.latency, url_queue, stop, requests, scrolls))
+    server.start()
+    results = []
+    expected = None
+    try:
+        app.conf.GRQ_ES_URL = url_queue.get(timeout=300)
+        for slices in args.slices:
+            time.sleep(0.1)
+            start_requests = requests.value
+            t0 = time.perf_counter()
+            found = run(slices, args.page_size, args.match)
+            elapsed = time.perf_counter() - t0
+            time.sleep(0.1)
+            if expected is None:
+                expected = found
+            assert found == expected, "slices %d found different acquisitions" % slices
+            assert scrolls.value == 0, "scroll contexts left open"
+            results.append({
+                "slices": slices,
+                "acquisitions": len(found),
+                "seconds": elapsed,
+                "acquisitions_per_second": len(found) / elapsed,
+                "es_requests": requests.value - start_requests,
+            })
+    finally:
+        stop.set()
+        server.join()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""
+Measure the cold-start import cost of the PGE entry points with
+python -X importtime.
+
+Each entry point is imported in a fresh interpreter --repeats times; the
+median cumulative import time of the module, the median wall time of the
+interpreter against that of an empty one and the modules with the largest
+self import time are reported as JSON. Stand-ins are only installed for
+packages that are missing, and are set up before the import is measured,
+so without the HySDS stack the numbers cover this repo and its other
+dependencies only.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+
+import _shims
+
+
+BENCH_PATH = os.path.dirname(os.path.abspath(__file__))
+
+ENTRY_POINTS = ["sling", "sling_batch", "extract", "util", "run_sciflo"]
+
+# import time: self [us] | cumulative | imported package
+IMPORTTIME_RE = re.compile(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)$')
+
+
+def run(module, shims):
+    """Import module in a fresh interpreter. Return wall seconds and list
+       of (module, self us, cumulative us, depth) in import order."""
+
+    code = "import _shims; _shims.install({!r})".format(shims)
+    if module is not None:
+        code += "; import {}".format(module)
+    t0 = time.perf_counter()
+    p = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                       cwd=BENCH_PATH, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.PIPE, universal_newlines=True)
+    elapsed = time.perf_counter() - t0
+    if p.returncode != 0:
+        raise RuntimeError("Failed to import {}: {}".format(module, p.stderr[-2000:]))
+    imports = []
+    for line in p.stderr.splitlines():
+        m = IMPORTTIME_RE.match(line)
+        if m:
+            imports.append((m.group(4), int(m.group(1)), int(m.group(2)),
+                            len(m.group(3)) // 2))
+    return elapsed, imports
+
+
+def measure(module, shims, repeats, top):
+    """Return import time statistics of module over repeats runs."""
+
+    walls, cumulative, self_times = [], [], {}
+    for i in range(repeats):
+        elapsed, imports = run(module, shims)
+        walls.append(elapsed)
+
+        # modules imported by module show up before it, one level deeper
+        end = max(n for n, imp in enumerate(imports)
+                  if imp[0] == module and imp[3] == 0)
+        start = max([n + 1 for n, imp in enumerate(imports[:end])
+                     if imp[3] == 0] or [0])
+        cumulative.append(imports[end][2])
+        for name, self_us, cum_us, depth in imports[start:end + 1]:
+            self_times.setdefault(name, []).append(self_us)
+    heaviest = sorted(((statistics.median(v), k) for k, v in self_times.items()),
+                      reverse=True)[:top]
+    return {
+        "import_us": statistics.median(cumulative),
+        "import_us_min": min(cumulative),
+        "wall_seconds": statistics.median(walls),
+        "modules": len(self_times),
+        "heaviest": [{"module": k, "self_us": v} for v, k in heaviest],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=ENTRY_POINTS)
+    parser.add_argument("--repeats", type=int, default=15)
+    parser.add_argument("--top", type=int, default=10,
+                        help="number of heaviest imports to list")
+    parser.add_argument("--output", help="also write results JSON to file")
+    args = parser.parse_args()
+
+    shims = _shims.missing()
+    baseline = statistics.median(run(None, shims)[0] for i in range(args.repeats))
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "shims": shims,
+        "baseline_wall_seconds": baseline,
+        "results": {},
+    }
+    for module in args.modules:
+        result = measure(module, shims, args.repeats, args.top)
+        result["startup_seconds"] = result["wall_seconds"] - baseline
+        report["results"][module] = result
+        print("{}: {:.1f} ms import, {:.1f} ms over baseline".format(
+            module, result["import_us"] / 1000., result["startup_seconds"] * 1000.),
+            file=sys.stderr)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
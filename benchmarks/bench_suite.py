@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+"""
+Offline end-to-end benchmark of the spyddder-man hot paths at several
+data scales: util.query_es(), util.query_aoi_acquisitions(),
+util.resolve_aoi_acqs(), sling.sling(), sling.verify() and
+extract.run_extractor() with plugin and script extractors.
+
+A stub ES (benchmarks/stub_es.py) and a local HTTP file server
+(benchmarks/file_server.py) standing in for the ASF datapool and download
+sources run in this process; each stage runs in a fresh child process so
+that its peak RSS is measured on its own. Results are printed as JSON and
+optionally written to a file for comparison between versions.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+
+import _shims
+_shims.install()
+
+from stub_es import StubES
+from file_server import FileServer
+from synthetic import make_acquisitions, make_aois, make_archive, window, \
+    ACQ_INDEX, AOI_INDEX, SLC_INDEX, PLATFORM
+
+
+BENCH_PATH = os.path.dirname(os.path.abspath(__file__))
+
+SCALES = {
+    "small": {"acquisitions": 2000, "aois": 20, "files": 4,
+              "file_size": 4 * 1024 ** 2},
+    "medium": {"acquisitions": 10000, "aois": 50, "files": 8,
+               "file_size": 16 * 1024 ** 2},
+    "large": {"acquisitions": 40000, "aois": 100, "files": 16,
+              "file_size": 64 * 1024 ** 2},
+}
+
+STAGES = ["query_es", "query_aoi_acquisitions", "resolve_aoi_acqs", "sling",
+          "verify", "run_extractor", "run_extractor_script"]
+
+# one in EXISTING_EVERY acquisitions has an existing SLC dataset
+EXISTING_EVERY = 5
+
+# one in ASF_MISSING_EVERY SLCs is missing from the stand-in ASF datapool
+ASF_MISSING_EVERY = 3
+
+
+def asf_available(identifier):
+    return int(identifier.rsplit("_", 2)[1], 16) % ASF_MISSING_EVERY != 0
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return None
+
+    def pct(p):
+        return values[min(len(values) - 1, int(round(p / 100. * (len(values) - 1))))]
+    return {"p50": pct(50), "p90": pct(90), "p99": pct(99), "max": values[-1],
+            "mean": sum(values) / len(values), "count": len(values)}
+
+
+def rss(field="VmRSS"):
+    """Return current (VmRSS) or peak (VmHWM) resident set size in bytes.
+       Unlike ru_maxrss, the peak is not inherited from the parent across
+       fork and exec."""
+
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) * 1024
+    return None
+
+
+# stages, run in the child process; each returns the number of operations,
+# bytes processed and per-operation (or per-request) latencies
+
+def es_latencies():
+    """Record the latency of every ES request of util."""
+
+    import util
+    latencies = []
+    util.get_es_session().hooks['response'].append(
+        lambda r, *args, **kwargs: latencies.append(r.elapsed.total_seconds()))
+    return latencies
+
+
+def stage_query_es(env):
+    import util
+    latencies = es_latencies()
+    hits = util.query_es({"query": {"match_all": {}}}, "grq_*_*acquisition*")
+    return len(hits), None, latencies
+
+
+def stage_query_aoi_acquisitions(env):
+    import util
+    latencies = es_latencies()
+    starttime, endtime = window()
+    acq_info = util.query_aoi_acquisitions(starttime, endtime, PLATFORM)
+    return len(acq_info), None, latencies
+
+
+def stage_resolve_aoi_acqs(env):
+    import util
+    latencies = es_latencies()
+    starttime, endtime = window()
+    with open("_context.json", 'w') as f:
+        json.dump({"starttime": starttime, "endtime": endtime,
+                   "platform": PLATFORM, "project": "bench",
+                   "spyddder_extract_version": "bench"}, f)
+    args = util.resolve_aoi_acqs("_context.json")
+    return len(args[0]), None, latencies + util.get_slc_resolver().latencies
+
+
+def stage_sling(env):
+    import sling
+    latencies = []
+    size = 0
+    for name in env['files']:
+        t0 = time.perf_counter()
+        sling.sling("%s/files/%s" % (env['file_url'], name),
+                    "file://%s/repo/%s" % (os.getcwd(), name),
+                    os.path.splitext(name)[0], "zip", "2019-01-01", prod_met="{}",
+                    chunk_size=env['chunk_size'])
+        latencies.append(time.perf_counter() - t0)
+        size += env['file_size']
+    return len(env['files']), size, latencies
+
+
+def stage_verify(env):
+    import sling
+    latencies = []
+    for name in env['files']:
+        t0 = time.perf_counter()
+        sling.verify(os.path.join(env['files_dir'], name), "zip")
+        latencies.append(time.perf_counter() - t0)
+    return len(env['files']), env['file_size'] * len(env['files']), latencies
+
+
+def _run_extractor(env, dsets_file):
+    import extract
+    latencies = []
+    for name in env['files']:
+        prod_path = os.path.abspath(os.path.splitext(name)[0])
+        os.makedirs(prod_path)
+        os.link(os.path.join(env['files_dir'], name), os.path.join(prod_path, name))
+        t0 = time.perf_counter()
+        extract.run_extractor(dsets_file, prod_path, {})
+        latencies.append(time.perf_counter() - t0)
+    return len(env['files']), env['file_size'] * len(env['files']), latencies
+
+
+def stage_run_extractor(env):
+    return _run_extractor(env, env['plugin_datasets'])
+
+
+def stage_run_extractor_script(env):
+    return _run_extractor(env, env['script_datasets'])
+
+
+def run_stage(stage, env, results):
+    """Run stage in a child process and put its measurements on results."""
+
+    try:
+        import util
+        import resolver
+        import settings
+        from hysds.celery import app
+        logging.getLogger().setLevel(logging.ERROR)
+        util.logger.setLevel(logging.ERROR)
+        app.conf.GRQ_ES_URL = env['es_url']
+        resolver.ASF_SLC_URL = env['asf_slc_url']
+        with open(os.path.join(os.path.dirname(BENCH_PATH), "settings.json.tmpl")) as f:
+            settings._settings = json.load(f)
+        os.chdir(env['work_dir'])
+        rss_start = rss()
+        t0 = time.perf_counter()
+        ops, size, latencies = globals()["stage_" + stage](env)
+        elapsed = time.perf_counter() - t0
+        result = {
+            "ops": ops,
+            "seconds": elapsed,
+            "ops_per_second": ops / elapsed if elapsed > 0 else None,
+            "bytes": size,
+            "bytes_per_second": size / elapsed if size and elapsed > 0 else None,
+            "latency": percentiles(latencies),
+            "rss_start_bytes": rss_start,
+            "peak_rss_bytes": rss("VmHWM"),
+        }
+    except Exception as e:
+        logging.exception("Stage {} failed.".format(stage))
+        result = {"error": str(e)}
+    results.put(result)
+
+
+def prepare(scale, work_dir):
+    """Create synthetic archives and datasets configs for scale."""
+
+    files_dir = os.path.join(work_dir, "files")
+    os.makedirs(files_dir)
+    acqs = make_acquisitions(max(scale['files'], 1), seed=7, extra_metadata=0)
+    files = []
+    for i, acq in enumerate(acqs[:scale['files']]):
+        name = acq['metadata']['archive_filename']
+        make_archive(os.path.join(files_dir, name), 4, scale['file_size'] // 4, seed=i)
+        files.append(name)
+
+    script = os.path.join(work_dir, "extractor.sh")
+    with open(script, 'w') as f:
+        f.write('#!/bin/sh\nexec "%s" "%s" "$@"\n' % (
+            sys.executable, os.path.join(BENCH_PATH, "synthetic.py")))
+    os.chmod(script, 0o755)
+    configs = {}
+    for kind, extractor in (("plugin", "python:synthetic.extract_metadata"),
+                            ("script", "script:%s" % script)):
+        configs[kind] = os.path.join(work_dir, "datasets.%s.json" % kind)
+        with open(configs[kind], 'w') as f:
+            json.dump([{"match": ".*", "extractor": extractor}], f)
+    return files_dir, files, configs
+
+
+def git_version():
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"], cwd=BENCH_PATH,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", nargs="+", default=["small", "medium"],
+                        choices=sorted(SCALES))
+    parser.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES)
+    parser.add_argument("--es_latency", type=float, default=0.005,
+                        help="seconds added to every ES request")
+    parser.add_argument("--http_latency", type=float, default=0.01,
+                        help="seconds added to every HTTP request")
+    parser.add_argument("--bandwidth", type=int, default=200 * 1024 ** 2,
+                        help="bytes per second per HTTP connection")
+    parser.add_argument("--chunk_size", type=int, default=4 * 1024 ** 2,
+                        help="byte range size of sling downloads")
+    parser.add_argument("--output", help="also write results JSON to file")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    report = {
+        "version": git_version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": vars(args),
+        "results": [],
+    }
+    for scale_name in args.scales:
+        scale = SCALES[scale_name]
+        base_dir = tempfile.mkdtemp(prefix="bench_suite_")
+        try:
+            files_dir, files, configs = prepare(scale, base_dir)
+            acqs = make_acquisitions(scale['acquisitions'], extra_metadata=40)
+            indices = {
+                ACQ_INDEX: acqs,
+                AOI_INDEX: make_aois(scale['aois']),
+                SLC_INDEX: [{"id": a['metadata']['identifier'], "dataset": "S1-IW_SLC"}
+                            for a in acqs[::EXISTING_EVERY]],
+            }
+            with StubES(indices, latency=args.es_latency) as es, \
+                    FileServer(base_dir, args.http_latency, args.bandwidth,
+                               asf_available) as fs:
+                for stage in args.stages:
+                    work_dir = os.path.join(base_dir, stage)
+                    os.makedirs(work_dir)
+                    env = {
+                        "es_url": es.url,
+                        "file_url": fs.url,
+                        "asf_slc_url": fs.asf_slc_url,
+                        "work_dir": work_dir,
+                        "files_dir": files_dir,
+                        "files": files,
+                        "file_size": scale['file_size'],
+                        "chunk_size": args.chunk_size,
+                        "plugin_datasets": configs['plugin'],
+                        "script_datasets": configs['script'],
+                    }
+                    results = ctx.Queue()
+                    p = ctx.Process(target=run_stage, args=(stage, env, results))
+                    p.start()
+                    result = results.get()
+                    p.join()
+                    result.update({"scale": scale_name, "stage": stage})
+                    result.update({k: v for k, v in scale.items()})
+                    report['results'].append(result)
+                    print("{} {}: {}".format(scale_name, stage, json.dumps(
+                        {k: result.get(k) for k in ("ops", "seconds", "ops_per_second",
+                                                     "peak_rss_bytes", "error")})),
+                          file=sys.stderr)
+        finally:
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
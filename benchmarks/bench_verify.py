@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+Benchmark sling.verify() stream mode against the extract-and-delete mode
+on synthetic zip and tar.gz archives.
+"""
+
+import os
+import json
+import time
+import shutil
+import tarfile
+import zipfile
+import argparse
+import tempfile
+import tracemalloc
+
+import _shims
+_shims.install()
+
+import sling
+
+
+def make_archives(work_dir, members, member_size):
+    """Create synthetic zip and tgz archives of incompressible members."""
+
+    src_dir = os.path.join(work_dir, "src")
+    os.makedirs(src_dir)
+    names = []
+    for i in range(members):
+        name = "member_%04d.dat" % i
+        with open(os.path.join(src_dir, name), 'wb') as f:
+            remaining = member_size
+            while remaining > 0:
+                n = min(remaining, sling.VERIFY_CHUNK_SIZE)
+                f.write(os.urandom(n))
+                remaining -= n
+        names.append(name)
+    zip_path = os.path.join(work_dir, "bench.zip")
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as z:
+        for name in names:
+            z.write(os.path.join(src_dir, name), name)
+    tgz_path = os.path.join(work_dir, "bench.tgz")
+    with tarfile.open(tgz_path, 'w:gz', compresslevel=1) as t:
+        for name in names:
+            t.add(os.path.join(src_dir, name), name)
+    shutil.rmtree(src_dir)
+    return {"zip": zip_path, "tgz": tgz_path}
+
+
+def run(path, file_type, mode, repeat):
+    """Time verification and measure peak traced memory."""
+
+    durations = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        sling.verify(path, file_type, mode)
+        durations.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    sling.verify(path, file_type, mode)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "file_type": file_type,
+        "mode": mode,
+        "archive_bytes": os.path.getsize(path),
+        "min_seconds": min(durations),
+        "mean_seconds": sum(durations) / len(durations),
+        "peak_traced_bytes": peak,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--members", type=int, default=4)
+    parser.add_argument("--member_size", type=int, default=64 * 1024 * 1024)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_verify_")
+    cwd = os.getcwd()
+    try:
+        archives = make_archives(work_dir, args.members, args.member_size)
+        os.chdir(work_dir)
+        results = []
+        for file_type, path in sorted(archives.items()):
+            for mode in sling.VERIFY_MODES:
+                res = run(path, file_type, mode, args.repeat)
+                res["scratch_bytes"] = 0 if mode == "stream" else \
+                    args.members * args.member_size
+                results.append(res)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
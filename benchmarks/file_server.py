@@ -0,0 +1,154 @@
+"""
+Local HTTP file server for the offline benchmarks. Files under root are
+served with range support at a configurable per-request latency and
+per-connection bandwidth, and HEAD requests for ASF datapool SLC urls
+(/SLC/SA/<identifier>.zip) answer 403 for identifiers the datapool is
+taken to have and 404 otherwise, as resolver.SlcResolver expects.
+"""
+
+import os
+import re
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+RANGE_RE = re.compile(r'bytes=(\d+)-(\d*)$')
+
+# size of writes to the client, the granularity of bandwidth throttling
+WRITE_SIZE = 64 * 1024
+
+
+class FileServer(object):
+    """Serve root over HTTP on localhost."""
+
+    def __init__(self, root, latency=0., bandwidth=None, asf_available=None):
+        self.root = root
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.asf_available = asf_available or (lambda identifier: True)
+        self.requests = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self.server = None
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d" % self.server.server_port
+
+    @property
+    def asf_slc_url(self):
+        """Format string to use for resolver.ASF_SLC_URL."""
+
+        return self.url + "/SLC/SA/{}.zip"
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _begin(self):
+                with stub._lock:
+                    stub.requests += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+
+            def _empty(self, code):
+                self.send_response(code)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_HEAD(self):
+                self._begin()
+                m = re.match(r'/SLC/SA/(.+)\.zip$', self.path)
+                if m:
+                    return self._empty(403 if stub.asf_available(m.group(1)) else 404)
+                path = stub.path(self.path)
+                if path is None:
+                    return self._empty(404)
+                self.send_response(200)
+                self.send_header("Content-Length", str(os.path.getsize(path)))
+                self.send_header("Accept-Ranges", "bytes")
+                self.end_headers()
+
+            def do_GET(self):
+                self._begin()
+                path = stub.path(self.path)
+                if path is None:
+                    return self._empty(404)
+                size = os.path.getsize(path)
+                start, end = 0, size - 1
+                m = RANGE_RE.match(self.headers.get("Range", ""))
+                if m:
+                    start = int(m.group(1))
+                    end = min(int(m.group(2)) if m.group(2) else size - 1, size - 1)
+                    if start >= size:
+                        self.send_response(416)
+                        self.send_header("Content-Range", "bytes */%d" % size)
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end, size))
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Length", str(end - start + 1))
+                self.send_header("Accept-Ranges", "bytes")
+                self.end_headers()
+                try:
+                    stub.send(self.wfile, path, start, end)
+                except (BrokenPipeError, ConnectionResetError):
+                    # client only wanted the headers, e.g. a range probe
+                    pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def path(self, url_path):
+        """Return local path of url_path or None if it is not a file."""
+
+        rel = url_path.split("?", 1)[0].lstrip("/")
+        path = os.path.realpath(os.path.join(self.root, rel))
+        if not path.startswith(os.path.realpath(self.root) + os.sep) or \
+                not os.path.isfile(path):
+            return None
+        return path
+
+    def send(self, wfile, path, start, end):
+        """Write bytes start-end of path, paced to the bandwidth limit."""
+
+        t0 = time.time()
+        sent = 0
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(WRITE_SIZE, remaining))
+                if not chunk:
+                    break
+                wfile.write(chunk)
+                sent += len(chunk)
+                remaining -= len(chunk)
+                if self.bandwidth:
+                    wait = t0 + sent / float(self.bandwidth) - time.time()
+                    if wait > 0:
+                        time.sleep(wait)
+        with self._lock:
+            self.bytes_sent += sent
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
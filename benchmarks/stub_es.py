@@ -0,0 +1,354 @@
+"""
+Local stub of the subset of the Elasticsearch REST API used by util.py:
+search with scan or (sliced) scroll, scroll paging and clearing, multi
+search, and the query DSL clauses the GRQ queries use. Geo shapes are matched by bounding
+box; a shape spanning more than 180 degrees of longitude is taken to cross
+the antimeridian, as ES does. Responses can be delayed to emulate a remote
+cluster.
+"""
+
+import json
+import time
+import uuid
+import zlib
+import fnmatch
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+def _get(doc, path):
+    """Return value at dotted path of doc; ".raw" subfields map to the field."""
+
+    if path.endswith(".raw"):
+        path = path[:-4]
+    for key in path.split("."):
+        if not isinstance(doc, dict) or key not in doc:
+            return None
+        doc = doc[key]
+    return doc
+
+
+def _coords(shape):
+    """Yield all [lon, lat] positions of a GeoJSON-like shape."""
+
+    def walk(c):
+        if c and isinstance(c[0], (int, float)):
+            yield c
+        else:
+            for i in c:
+                for j in walk(i):
+                    yield j
+    return walk(shape.get("coordinates", []))
+
+
+def bbox(shape):
+    """Return (min_lon, min_lat, max_lon, max_lat) of a shape."""
+
+    pts = list(_coords(shape))
+    lons = [p[0] for p in pts]
+    lats = [p[1] for p in pts]
+    if max(lons) - min(lons) > 180:
+        # crosses the antimeridian: unwrap to longitudes beyond 180
+        lons = [lon + 360 if lon < 0 else lon for lon in lons]
+    return min(lons), min(lats), max(lons), max(lats)
+
+
+def bbox_intersects(a, b):
+    return any(a[0] <= b[2] + shift and b[0] + shift <= a[2] and
+               a[1] <= b[3] and b[1] <= a[3] for shift in (-360, 0, 360))
+
+
+class Matcher(object):
+    """Evaluate a query DSL clause against a document source. Names of
+       matched named clauses are collected in self.matched."""
+
+    def __init__(self, source):
+        self.source = source
+        self.matched = []
+
+    def __call__(self, clause):
+        if not clause:
+            return True
+        (kind, body), = [(k, v) for k, v in clause.items() if k != "_name"]
+        ok = getattr(self, "_" + kind)(body)
+        name = clause.get("_name") or (body.get("_name") if isinstance(body, dict) else None)
+        if ok and name:
+            self.matched.append(name)
+        return ok
+
+    def _match_all(self, body):
+        return True
+
+    def _bool(self, body):
+        def as_list(v):
+            return v if isinstance(v, list) else [v]
+        for c in as_list(body.get("must", [])) + as_list(body.get("filter", [])):
+            if not self(c):
+                return False
+        for c in as_list(body.get("must_not", [])):
+            if self(c):
+                return False
+        should = as_list(body.get("should", []))
+        if should:
+            # evaluate every should clause so all matching names are recorded
+            results = [self(c) for c in should]
+            return any(results)
+        return True
+
+    def _filtered(self, body):
+        # like ES, apply the filter before scoring the query
+        return self(body.get("filter", {})) and self(body.get("query", {}))
+
+    def _term(self, body):
+        (field, value), = [(k, v) for k, v in body.items() if k != "_name"]
+        if isinstance(value, dict):
+            value = value["value"]
+        if field == "_id":
+            return self.source.get("id") == value
+        return _get(self.source, field) == value
+
+    def _terms(self, body):
+        (field, values), = [(k, v) for k, v in body.items() if k != "_name"]
+        if field == "_id":
+            return self.source.get("id") in values
+        return _get(self.source, field) in values
+
+    def _ids(self, body):
+        return self.source.get("id") in body.get("values", [])
+
+    def _range(self, body):
+        (field, cond), = [(k, v) for k, v in body.items() if k != "_name"]
+        value = _get(self.source, field)
+        if value is None:
+            return False
+        ops = {"lte": lambda a, b: a <= b, "lt": lambda a, b: a < b,
+               "gte": lambda a, b: a >= b, "gt": lambda a, b: a > b}
+        return all(ops[op](value, bound) for op, bound in cond.items()
+                   if op in ops)
+
+    def _missing(self, body):
+        return _get(self.source, body["field"]) is None
+
+    def _exists(self, body):
+        return _get(self.source, body["field"]) is not None
+
+    def _geo_shape(self, body):
+        (field, spec), = [(k, v) for k, v in body.items() if k != "_name"]
+        value = _get(self.source, field)
+        if value is None:
+            return False
+        return bbox_intersects(bbox(value), bbox(spec["shape"]))
+
+
+def _partial(source, includes):
+    """Project source onto dotted include paths."""
+
+    out = {}
+    for path in includes:
+        value = _get(source, path)
+        if value is None:
+            continue
+        d = out
+        keys = path.split(".")
+        for key in keys[:-1]:
+            d = d.setdefault(key, {})
+        d[keys[-1]] = value
+    return out
+
+
+class StubES(object):
+    """In-memory ES stand-in served over HTTP on localhost."""
+
+    def __init__(self, indices, version="1.7.5", latency=0.):
+        self.indices = indices
+        self.version = version
+        self.latency = latency
+        self.scrolls = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.server = None
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d" % self.server.server_port
+
+    @property
+    def major(self):
+        return int(self.version.split(".")[0])
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, code, body):
+                data = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _handle(self, method):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length).decode() if length else ""
+                with stub._lock:
+                    stub.requests += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                try:
+                    code, res = stub.handle(method, self.path, body)
+                except Exception as e:
+                    code, res = 400, {"error": repr(e)}
+                self._reply(code, res)
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def do_DELETE(self):
+                self._handle("DELETE")
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # request handling
+
+    def handle(self, method, path, body):
+        parsed = urlparse(path)
+        params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        parts = [p for p in parsed.path.split("/") if p]
+        if not parts and method == "GET":
+            return 200, {"version": {"number": self.version}}
+        if parts == ["_search", "scroll"]:
+            if method == "DELETE":
+                return self.clear_scroll(body)
+            return self.scroll(body, params)
+        if len(parts) == 2 and parts[1] == "_search":
+            return self.search(parts[0], json.loads(body or "{}"), params)
+        if parts and parts[-1] == "_msearch":
+            return self.msearch(parts[0] if len(parts) == 2 else None, body)
+        return 404, {"error": "unsupported path %s" % path}
+
+    def _docs(self, pattern):
+        for name in sorted(self.indices):
+            if any(fnmatch.fnmatch(name, p) for p in pattern.split(",")):
+                for doc in self.indices[name]:
+                    yield name, doc
+
+    def _hit(self, index, source, query, matched):
+        hit = {"_index": index, "_type": source.get("dataset", "doc"),
+               "_id": source["id"], "_score": 1.0}
+        partial = query.get("partial_fields", {}).get("partial")
+        if partial is not None:
+            hit["fields"] = {"partial": [_partial(source, partial.get("include", []))]}
+        elif "fields" in query:
+            pass
+        elif query.get("_source") is False:
+            pass
+        elif "_source" in query and query["_source"] is not True:
+            includes = query["_source"]
+            if isinstance(includes, dict):
+                includes = includes.get("includes", [])
+            hit["_source"] = _partial(source, includes)
+        else:
+            hit["_source"] = source
+        if matched:
+            hit["matched_queries"] = matched
+        return hit
+
+    def run_query(self, pattern, query):
+        """Return all hits of query over indices matching pattern."""
+
+        sl = query.get("slice")
+        hits = []
+        for index, source in self._docs(pattern):
+            if sl is not None and \
+                    zlib.crc32(source["id"].encode()) % sl["max"] != sl["id"]:
+                continue
+            m = Matcher(source)
+            if m(query.get("query", {"match_all": {}})):
+                hits.append(self._hit(index, source, query, m.matched))
+        return hits
+
+    def _total(self, n):
+        return {"value": n, "relation": "eq"} if self.major >= 7 else n
+
+    def search(self, pattern, query, params):
+        hits = self.run_query(pattern, query)
+        size = int(params.get("size", query.get("size", 10)))
+        res = {"took": 1, "timed_out": False,
+               "hits": {"total": self._total(len(hits)), "hits": []}}
+        if "scroll" in params:
+            scroll_id = uuid.uuid4().hex
+            scan = params.get("search_type") == "scan"
+            with self._lock:
+                self.scrolls[scroll_id] = {"hits": hits, "pos": 0 if scan else size,
+                                           "size": size}
+            res["_scroll_id"] = scroll_id
+            if not scan:
+                res["hits"]["hits"] = hits[:size]
+        else:
+            start = int(params.get("from", query.get("from", 0)))
+            res["hits"]["hits"] = hits[start:start + size]
+        return 200, res
+
+    def msearch(self, pattern, body):
+        """Run the header/body pairs of a newline-delimited multi search."""
+
+        lines = [l for l in body.splitlines() if l.strip()]
+        responses = []
+        for header, query in zip(lines[::2], lines[1::2]):
+            header = json.loads(header)
+            index = header.get("index", pattern) or "*"
+            if isinstance(index, list):
+                index = ",".join(index)
+            code, res = self.search(index, json.loads(query), {})
+            responses.append(res)
+        return 200, {"responses": responses}
+
+    def _scroll_id(self, body):
+        try:
+            j = json.loads(body)
+        except ValueError:
+            return body.strip()
+        if isinstance(j, dict):
+            sid = j.get("scroll_id")
+            return sid[0] if isinstance(sid, list) else sid
+        return body.strip()
+
+    def scroll(self, body, params):
+        scroll_id = self._scroll_id(body)
+        with self._lock:
+            ctx = self.scrolls.get(scroll_id)
+            if ctx is None:
+                return 404, {"error": "No search context found for id [%s]" % scroll_id}
+            page = ctx["hits"][ctx["pos"]:ctx["pos"] + ctx["size"]]
+            ctx["pos"] += ctx["size"]
+        return 200, {"_scroll_id": scroll_id, "hits": {
+            "total": self._total(len(ctx["hits"])), "hits": page}}
+
+    def clear_scroll(self, body):
+        scroll_id = self._scroll_id(body)
+        with self._lock:
+            found = self.scrolls.pop(scroll_id, None) is not None
+        return 200, {"succeeded": found}
@@ -0,0 +1,131 @@
+"""
+Synthetic AOI and acquisition documents shaped like their GRQ
+counterparts for the offline benchmarks.
+"""
+
+import os
+import sys
+import json
+import random
+import zipfile
+from datetime import datetime, timedelta
+
+
+ACQ_INDEX = "grq_v2.0_acquisition-s1-iw_slc"
+AOI_INDEX = "grq_v1.0_area_of_interest"
+SLC_INDEX = "grq_v2.0_s1-iw_slc"
+
+PLATFORM = "Sentinel-1A"
+
+START = datetime(2019, 1, 1)
+
+
+def _box(lon, lat, width, height):
+    return {"type": "polygon", "coordinates": [[
+        [lon, lat], [lon + width, lat], [lon + width, lat + height],
+        [lon, lat + height], [lon, lat]]]}
+
+
+def _iso(dt):
+    return dt.strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def make_acquisitions(n, seed=0, days=30, extra_metadata=40):
+    """Return n acquisition documents spread over days and the globe.
+       extra_metadata adds filler keys to emulate the full metadata blob."""
+
+    rnd = random.Random(seed)
+    acqs = []
+    for i in range(n):
+        start = START + timedelta(seconds=rnd.randrange(days * 86400))
+        end = start + timedelta(seconds=25)
+        identifier = "S1A_IW_SLC__1SDV_{}_{}_{:06d}_{:06X}_{:04X}".format(
+            start.strftime("%Y%m%dT%H%M%S"), end.strftime("%Y%m%dT%H%M%S"),
+            i, i, rnd.randrange(0x10000))
+        lon = rnd.uniform(-180, 175)
+        lat = rnd.uniform(-80, 78)
+        metadata = {
+            "identifier": identifier,
+            "platform": PLATFORM,
+            "download_url": "https://scihub.copernicus.eu/apihub/odata/v1/Products('%s')/$value" % identifier,
+            "archive_filename": "%s.zip" % identifier,
+            "archive_size": rnd.randrange(3 * 1024 ** 3, 8 * 1024 ** 3),
+            "sensingStart": _iso(start),
+            "sensingStop": _iso(end),
+            "trackNumber": rnd.randrange(1, 176),
+        }
+        for k in range(extra_metadata):
+            metadata["filler_%02d" % k] = "x" * 64
+        acqs.append({
+            "id": "acquisition-%s" % identifier,
+            "dataset_type": "acquisition",
+            "dataset": "acquisition-S1-IW_SLC",
+            "starttime": _iso(start),
+            "endtime": _iso(end),
+            "creation_timestamp": _iso(start + timedelta(hours=rnd.randrange(1, 12))),
+            "location": _box(lon, lat, 2.5, 2.0),
+            "metadata": metadata,
+        })
+    return acqs
+
+
+def make_aois(n, seed=1, days=30, size=20., priorities=(0, 1, 5)):
+    """Return n active AOI documents covering the acquisition window."""
+
+    rnd = random.Random(seed)
+    aois = []
+    for i in range(n):
+        lon = rnd.uniform(-180, 180 - size)
+        lat = rnd.uniform(-80, 80 - size)
+        aois.append({
+            "id": "AOI_bench_%04d" % i,
+            "starttime": _iso(START),
+            "endtime": _iso(START + timedelta(days=days)),
+            "location": _box(lon, lat, size, size),
+            "metadata": {"priority": rnd.choice(priorities), "user_tags": []},
+        })
+    return aois
+
+
+def window(days=30):
+    """Return (starttime, endtime) spanning the synthetic data."""
+
+    return _iso(START), _iso(START + timedelta(days=days))
+
+
+def make_archive(path, members=4, member_size=1024 * 1024, seed=0):
+    """Write a zip archive of incompressible members to path."""
+
+    rnd = random.Random(seed)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as z:
+        for i in range(members):
+            z.writestr("measurement/%04d.tiff" % i,
+                       bytes(rnd.getrandbits(8) for j in range(256)) *
+                       (member_size // 256))
+
+
+def extract_metadata(prod_path):
+    """Metadata extractor plugin: list the archives of a product."""
+
+    archives = sorted(f for f in os.listdir(prod_path) if f.endswith(".zip"))
+    members = 0
+    for archive in archives:
+        with zipfile.ZipFile(os.path.join(prod_path, archive)) as z:
+            members += len(z.namelist())
+    name = os.path.basename(os.path.abspath(prod_path))
+    return {
+        "archives": archives,
+        "members": members,
+        "starttime": _iso(START),
+        "endtime": _iso(START + timedelta(seconds=25)),
+        "label": name,
+    }
+
+
+if __name__ == "__main__":
+    # script extractor: write the .met.json of the product
+    prod_path = sys.argv[1]
+    met_file = os.path.join(prod_path, "%s.met.json" % os.path.basename(
+        os.path.abspath(prod_path)))
+    with open(met_file, 'w') as f:
+        json.dump(extract_metadata(prod_path), f)
@@ -0,0 +1,199 @@
+"""
+Content-addressed download cache shared by sling jobs on a worker.
+
+Verified downloads are hard-linked into <cache_dir>/blobs/ under their
+SHA-256 digest and the index maps each download URL to the digest of the
+content it returned. A cache hit is hard-linked into the job directory
+instead of being downloaded again. When the cache grows beyond its size
+cap the least recently used blobs are evicted.
+
+The index is guarded by an exclusive lock on <cache_dir>/.lock so that
+concurrent jobs on the same worker can share the cache. Blobs are linked
+or copied in and out of the cache without the lock: a hit is held by a
+hard link under <cache_dir>/holds/ so that eviction cannot remove its
+content while it is being copied.
+"""
+
+import os
+import time
+import json
+import logging
+import threading
+from contextlib import contextmanager
+
+from staging import stage
+from fileio import write_json_atomic, locked
+
+
+# default size cap of the cache
+DEFAULT_MAX_BYTES = 200 * 1024 ** 3
+
+# age in seconds after which holds left behind by killed jobs are removed;
+# holds are named <digest>.<pid>.<thread>.<epoch seconds taken>
+HOLD_MAX_AGE = 24 * 3600
+
+
+def link_or_copy(src, dst):
+    """Hard link src to dst, falling back to a reflink or a copy if they
+       are on different filesystems."""
+
+    return stage(src, dst, move=False)
+
+
+class DownloadCache(object):
+    """LRU cache of verified downloads keyed by URL and content digest."""
+
+    def __init__(self, root, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.blob_dir = os.path.join(root, "blobs")
+        self.index_file = os.path.join(root, "index.json")
+        self.hold_dir = os.path.join(root, "holds")
+        self.lock_file = os.path.join(root, ".lock")
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0,
+                      "bytes_saved": 0, "bytes_evicted": 0}
+        self._stats_lock = threading.Lock()
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.hold_dir, exist_ok=True)
+
+    @contextmanager
+    def _locked_index(self):
+        """Yield the index under an exclusive lock and save it on exit."""
+
+        with locked(self.lock_file):
+            index = {"urls": {}, "blobs": {}}
+            if os.path.exists(self.index_file):
+                with open(self.index_file) as f:
+                    index = json.load(f)
+            yield index
+            write_json_atomic(self.index_file, index)
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def _private_path(self, dir, digest):
+        """Return a path for digest in dir private to this thread."""
+
+        return os.path.join(dir, "%s.%d.%d" % (digest, os.getpid(),
+                                               threading.get_ident()))
+
+    def lookup(self, url, path):
+        """Link the cached content of url to path. Return the checksums of
+           the content on a hit, None on a miss."""
+
+        with self._locked_index() as index:
+            digest = index["urls"].get(url)
+            blob = index["blobs"].get(digest) if digest else None
+            blob_path = self.blob_path(digest) if blob else None
+            if blob is None or not os.path.exists(blob_path) or \
+                    os.path.getsize(blob_path) != blob["size"]:
+                if digest is not None:
+                    logging.warning("Dropping stale cache entry for {}.".format(url))
+                    self._remove(index, digest)
+                with self._stats_lock:
+                    self.stats["misses"] += 1
+                return None
+
+            # hold the content so that it survives eviction by other jobs
+            # while it is linked or copied without the lock
+            hold_path = "%s.%d" % (self._private_path(self.hold_dir, digest),
+                                   time.time())
+            os.link(blob_path, hold_path)
+            blob["atime"] = time.time()
+
+        # link to a private path first, so that a partial download left at
+        # path is replaced like the ranged and osaka downloads would
+        tmp_path = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+        try:
+            link_or_copy(hold_path, tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            os.unlink(hold_path)
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        with self._stats_lock:
+            self.stats["hits"] += 1
+            self.stats["bytes_saved"] += blob["size"]
+        logging.info("Cache hit for {}: linked {} to {}.".format(
+            url, blob_path, path))
+        return blob["checksums"]
+
+    def insert(self, url, path, checksums):
+        """Add verified download at path with its checksums to the cache."""
+
+        digest = checksums["sha256"]
+        size = os.path.getsize(path)
+        if size > self.max_bytes:
+            logging.info("Not caching {}: {} bytes exceeds cache size.".format(
+                path, size))
+            return
+
+        # stage the content into the cache before taking the lock
+        blob_path = self.blob_path(digest)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        tmp_path = self._private_path(os.path.dirname(blob_path), digest) + ".tmp"
+        link_or_copy(path, tmp_path)
+        try:
+            with self._locked_index() as index:
+                if digest not in index["blobs"] or not os.path.exists(blob_path):
+                    os.replace(tmp_path, blob_path)
+                    index["blobs"][digest] = {"size": size, "checksums": checksums}
+                index["blobs"][digest]["atime"] = time.time()
+                index["urls"][url] = digest
+                self._evict(index, keep=digest)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def _remove(self, index, digest):
+        blob = index["blobs"].pop(digest, None)
+        for url in [u for u, d in index["urls"].items() if d == digest]:
+            del index["urls"][url]
+        blob_path = self.blob_path(digest)
+        if os.path.exists(blob_path):
+            os.unlink(blob_path)
+        return blob
+
+    def _remove_stale_holds(self):
+        # a hold shares the inode of its blob, whose times change with every
+        # link, so its age is taken from its name
+        now = time.time()
+        for name in os.listdir(self.hold_dir):
+            try:
+                taken = int(name.rsplit(".", 1)[-1])
+            except ValueError:
+                taken = 0
+            if now - taken > HOLD_MAX_AGE:
+                try:
+                    os.unlink(os.path.join(self.hold_dir, name))
+                    logging.info("Removed stale cache hold {}.".format(name))
+                except FileNotFoundError:
+                    pass
+
+    def _evict(self, index, keep=None):
+        """Evict least recently used blobs until under the size cap."""
+
+        self._remove_stale_holds()
+        total = sum(b["size"] for b in index["blobs"].values())
+        for digest in sorted(index["blobs"], key=lambda d: index["blobs"][d]["atime"]):
+            if total <= self.max_bytes:
+                break
+            if digest == keep:
+                continue
+            blob = self._remove(index, digest)
+            total -= blob["size"]
+            self.stats["evictions"] += 1
+            self.stats["bytes_evicted"] += blob["size"]
+            logging.info("Evicted {} ({} bytes) from cache.".format(
+                digest, blob["size"]))
+
+
+def open_cache(settings):
+    """Return the download cache configured in settings or None if the
+       cache is disabled."""
+
+    cache_dir = settings.get("DOWNLOAD_CACHE_DIR")
+    if not cache_dir:
+        return None
+    return DownloadCache(cache_dir, settings.get("DOWNLOAD_CACHE_MAX_BYTES",
+                                                 DEFAULT_MAX_BYTES))
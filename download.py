@@ -0,0 +1,266 @@
+"""
+Parallel ranged downloads for HTTP/HTTPS sources.
+
+The file is split into fixed-size byte ranges which are fetched
+concurrently over a pooled requests session. Progress is kept in a
+sidecar state file next to the partial download so that an interrupted
+transfer only fetches the ranges that are still missing when rerun.
+
+Credentials are read from .netrc by requests, including for hosts that
+are only reached through redirects (e.g. Earthdata Login), and an OAuth
+URL can be visited first to establish session cookies.
+
+An optional throttle.Scheduler bounds the connections opened to, and the
+bandwidth drawn from, the source host across all downloads of a process.
+"""
+
+import os
+import json
+import logging
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from fileio import write_json_atomic
+from metrics import append_pge_metrics, transfer_metrics, utcnow, \
+    PGE_METRICS_FILE
+
+
+# default number of concurrent connections per download
+DEFAULT_CONNECTIONS = 4
+
+# default size of each byte range
+DEFAULT_CHUNK_SIZE = 32 * 1024 * 1024
+
+# size of reads from the response stream
+READ_SIZE = 1024 * 1024
+
+# attempts per byte range before giving up
+MAX_RANGE_ATTEMPTS = 3
+
+# schemes handled by the ranged download engine
+SUPPORTED_SCHEMES = ('http', 'https')
+
+
+class RangesNotSupported(Exception):
+    """Exception class for sources that cannot be downloaded by range."""
+    pass
+
+
+def supported(url):
+    """Return True if url can be handled by the ranged download engine."""
+
+    return urlparse(url).scheme in SUPPORTED_SCHEMES
+
+
+def state_file(path):
+    """Return path of the sidecar state file for a download."""
+
+    return "%s.ranges.json" % path
+
+
+def part_file(path):
+    """Return path of the partial download."""
+
+    return "%s.part" % path
+
+
+def open_session(connections=DEFAULT_CONNECTIONS, oauth_url=None):
+    """Create a pooled session, authenticating against oauth_url if set."""
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=connections,
+                          pool_maxsize=connections)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.verify = False
+    if oauth_url is not None:
+        r = session.get(oauth_url)
+        r.raise_for_status()
+    return session
+
+
+def probe(session, url):
+    """Resolve redirects for url and return the final url and file size.
+       Raise RangesNotSupported if the server does not honor range
+       requests."""
+
+    r = session.get(url, headers={"Range": "bytes=0-0"}, stream=True)
+    try:
+        if r.status_code == 416:
+            raise RangesNotSupported("Range not satisfiable for %s." % url)
+        r.raise_for_status()
+        content_range = r.headers.get("Content-Range", "")
+        if r.status_code != 206 or "/" not in content_range:
+            raise RangesNotSupported(
+                "Server does not support range requests for %s." % url)
+        size = content_range.rsplit("/", 1)[1]
+        if size == "*":
+            raise RangesNotSupported("Unknown content length for %s." % url)
+        return r.url, int(size)
+    finally:
+        r.close()
+
+
+def make_ranges(size, chunk_size):
+    """Split size bytes into inclusive (start, end) byte ranges."""
+
+    return [(start, min(start + chunk_size, size) - 1)
+            for start in range(0, size, chunk_size)]
+
+
+class RangedDownload(object):
+    """Download of one URL to a local path by concurrent byte ranges."""
+
+    def __init__(self, url, path, connections=DEFAULT_CONNECTIONS,
+                 chunk_size=DEFAULT_CHUNK_SIZE, oauth_url=None, scheduler=None):
+        self.url = url
+        self.path = path
+        self.connections = max(1, connections)
+        self.chunk_size = chunk_size
+        self.oauth_url = oauth_url
+        self.scheduler = scheduler
+        self.session = None
+        self.final_url = None
+        self.size = None
+        self.done = set()
+        self._lock = threading.Lock()
+
+    def _load_state(self):
+        """Load completed ranges of a previous attempt if it matches."""
+
+        sf = state_file(self.path)
+        pf = part_file(self.path)
+        if not (os.path.exists(sf) and os.path.exists(pf)):
+            return set()
+        try:
+            with open(sf) as f:
+                state = json.load(f)
+        except ValueError:
+            logging.warning("Ignoring corrupt state file {}.".format(sf))
+            return set()
+        if (state.get("url") != self.url or state.get("size") != self.size or
+                state.get("chunk_size") != self.chunk_size or
+                os.path.getsize(pf) != self.size):
+            logging.info("State file {} does not match; restarting.".format(sf))
+            return set()
+        return set(state.get("done", []))
+
+    def _save_state(self):
+        write_json_atomic(state_file(self.path),
+                          {"url": self.url, "size": self.size,
+                           "chunk_size": self.chunk_size,
+                           "done": sorted(self.done)})
+
+    def _connection(self):
+        """Hold a connection slot to the source host while requesting."""
+
+        if self.scheduler is None:
+            return nullcontext()
+        return self.scheduler.connection(self.url)
+
+    def _throttle(self, nbytes):
+        if self.scheduler is not None:
+            self.scheduler.throttle(self.url, nbytes)
+
+    def _fetch_range(self, fd, index, start, end):
+        """Fetch one byte range and write it at its offset."""
+
+        for attempt in range(1, MAX_RANGE_ATTEMPTS + 1):
+            offset = start
+            try:
+                headers = {"Range": "bytes=%d-%d" % (start, end)}
+                with self._connection(), \
+                        self.session.get(self.final_url, headers=headers,
+                                         stream=True) as r:
+                    if r.status_code in (401, 403):
+                        # signed redirect targets expire; resolve again
+                        self.final_url = probe(self.session, self.url)[0]
+                    r.raise_for_status()
+                    if r.status_code != 206:
+                        raise RangesNotSupported(
+                            "Got status %d for range request to %s." %
+                            (r.status_code, self.final_url))
+                    for chunk in r.iter_content(READ_SIZE):
+                        os.pwrite(fd, chunk, offset)
+                        offset += len(chunk)
+                        self._throttle(len(chunk))
+                if offset != end + 1:
+                    raise IOError("Short read for bytes %d-%d: got %d bytes." %
+                                  (start, end, offset - start))
+                break
+            except RangesNotSupported:
+                raise
+            except Exception as e:
+                if attempt == MAX_RANGE_ATTEMPTS:
+                    raise
+                logging.warning("Retrying bytes {}-{} of {} (attempt {}): {}".format(
+                    start, end, self.url, attempt, e))
+        with self._lock:
+            self.done.add(index)
+            self._save_state()
+
+    def run(self):
+        """Run the download and return the number of bytes fetched."""
+
+        self.session = open_session(self.connections, self.oauth_url)
+        try:
+            return self._run()
+        except RangesNotSupported:
+            for f in (part_file(self.path), state_file(self.path)):
+                if os.path.exists(f):
+                    os.unlink(f)
+            raise
+        finally:
+            self.session.close()
+
+    def _run(self):
+        with self._connection():
+            self.final_url, self.size = probe(self.session, self.url)
+        ranges = make_ranges(self.size, self.chunk_size)
+        self.done = self._load_state()
+        missing = [i for i in range(len(ranges)) if i not in self.done]
+        logging.info("Downloading {} of {} ranges of {} ({} bytes) with {} connections.".format(
+            len(missing), len(ranges), self.url, self.size, self.connections))
+
+        pf = part_file(self.path)
+        if not self.done:
+            with open(pf, 'wb') as f:
+                f.truncate(self.size)
+            self._save_state()
+        fd = os.open(pf, os.O_WRONLY)
+        try:
+            with ThreadPoolExecutor(max_workers=self.connections) as executor:
+                futures = [executor.submit(self._fetch_range, fd, i, *ranges[i])
+                           for i in missing]
+                try:
+                    for future in as_completed(futures):
+                        future.result()
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        finally:
+            os.close(fd)
+        os.replace(pf, self.path)
+        os.unlink(state_file(self.path))
+        return sum(ranges[i][1] - ranges[i][0] + 1 for i in missing)
+
+
+def get(url, path, connections=DEFAULT_CONNECTIONS, chunk_size=DEFAULT_CHUNK_SIZE,
+        oauth_url=None, scheduler=None, measure=True, output=PGE_METRICS_FILE):
+    """Download url to path using parallel byte ranges."""
+
+    time_start = utcnow()
+    dl = RangedDownload(url, path, connections, chunk_size, oauth_url,
+                        scheduler)
+    fetched = dl.run()
+    time_end = utcnow()
+    if measure:
+        append_pge_metrics("download", transfer_metrics(
+            url, path, time_start, time_end, fetched), output)
+    return fetched
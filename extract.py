@@ -14,27 +14,87 @@ import shutil
 import logging
 import traceback
 import argparse
+import importlib
 from subprocess import check_output
 
-from hysds.recognize import Recognizer
+from staging import stage
+from metrics import span
+from settings import get_settings
 
 
 SCRIPT_RE = re.compile(r'script:(.*)$')
+PYTHON_RE = re.compile(r'python:(.*)$')
+ENTRY_POINT_RE = re.compile(r'entry_point:(.*)$')
+
+# entry point group of metadata extractor plugins
+EXTRACTOR_GROUP = "spyddder_man.extractors"
+
+# loaded extractor plugins by reference
+_extractors = {}
 
 
 log_format = "[%(asctime)s: %(levelname)s/%(funcName)s] %(message)s"
 logging.basicConfig(format=log_format, level=logging.INFO)
 
 
+def load_extractor(extractor):
+    """Return callable of a Python extractor reference, either
+       python:<module>.<func> (or python:<module>:<func>) or
+       entry_point:<name> in the spyddder_man.extractors group, or None if
+       extractor is not a Python reference. Loaded extractors are cached.
+
+       A plugin is called with the product path and returns the extracted
+       metadata as a dict, or None if it wrote the .met.json itself."""
+
+    if extractor in _extractors:
+        return _extractors[extractor]
+    match = PYTHON_RE.search(extractor)
+    if match:
+        ref = match.group(1)
+        if ":" in ref:
+            mod_name, func_name = ref.split(":", 1)
+        else:
+            mod_name, func_name = ref.rsplit(".", 1)
+        func = getattr(importlib.import_module(mod_name), func_name)
+    else:
+        match = ENTRY_POINT_RE.search(extractor)
+        if not match:
+            return None
+        from importlib.metadata import entry_points
+        eps = entry_points()
+        if hasattr(eps, 'select'):
+            eps = eps.select(group=EXTRACTOR_GROUP)
+        else:
+            eps = eps.get(EXTRACTOR_GROUP, [])
+        matches = [ep for ep in eps if ep.name == match.group(1)]
+        if not matches:
+            raise RuntimeError("No %s entry point named %s." %
+                               (EXTRACTOR_GROUP, match.group(1)))
+        func = matches[0].load()
+    _extractors[extractor] = func
+    return func
+
+
+def parse_extractor_output(output):
+    """Return metadata printed by a script extractor as JSON, or an empty
+       dict if it printed anything else."""
+
+    try:
+        m = json.loads(output.decode())
+    except (UnicodeDecodeError, ValueError):
+        return {}
+    return m if isinstance(m, dict) else {}
+
+
 def run_extractor(dsets_file, prod_path, ctx):
     """Run extractor configured in datasets JSON config."""
 
+    from hysds.recognize import Recognizer
+
     logging.info("datasets: %s" % dsets_file)
     logging.info("prod_path: %s" % prod_path)
     # get settings
-    settings_file = os.path.join(os.path.dirname(os.path.realpath(__file__)),
-                                 'settings.json')
-    settings = json.load(open(settings_file))
+    settings = get_settings()
 
     # recognize
     r = Recognizer(dsets_file, prod_path, os.path.basename(
@@ -43,10 +103,13 @@ def run_extractor(dsets_file, prod_path, ctx):
 
     # get extractor
     extractor = r.getMetadataExtractor()
+    plugin = None
     if extractor is not None:
         match = SCRIPT_RE.search(extractor)
         if match:
             extractor = match.group(1)
+        else:
+            plugin = load_extractor(extractor)
     logging.info("Configured metadata extractor: %s" % extractor)
 
     # metadata file
@@ -61,17 +124,32 @@ def run_extractor(dsets_file, prod_path, ctx):
         with open(metadata_file) as f:
             metadata = json.load(f)
 
-    m = {}
     # run extractor
-    if extractor is None:
-        logging.info("No metadata extraction configured.")
-    else:
-        logging.info("Running metadata extractor %s on %s" %
-                     (extractor, prod_path))
-        m = check_output([extractor, prod_path])
-        if os.path.exists(metadata_file):
-            with open(metadata_file) as f:
-                metadata.update(json.load(f))
+    m = {}
+    kind = "none" if extractor is None else "plugin" if plugin is not None else "script"
+    with span("extract_metadata", path=prod_path, extractor=extractor,
+              kind=kind) as s:
+        if extractor is None:
+            logging.info("No metadata extraction configured.")
+        elif plugin is not None:
+            logging.info("Running metadata extractor plugin %s on %s" %
+                         (extractor, prod_path))
+            m = plugin(prod_path)
+            if m is None:
+                m = {}
+                if os.path.exists(metadata_file):
+                    with open(metadata_file) as f:
+                        metadata.update(json.load(f))
+            else:
+                metadata.update(m)
+        else:
+            logging.info("Running metadata extractor %s on %s" %
+                         (extractor, prod_path))
+            m = parse_extractor_output(check_output([extractor, prod_path]))
+            if os.path.exists(metadata_file):
+                with open(metadata_file) as f:
+                    metadata.update(json.load(f))
+        s.add(items=len(metadata))
 
     # set data_product_name
     metadata['data_product_name'] = objectid
@@ -103,14 +181,14 @@ def create_product(file, prod_name, prod_date):
        metadata extractor."""
 
     # get settings
-    settings_file = os.path.join(os.path.dirname(os.path.realpath(__file__)),
-                                 'settings.json')
-    settings = json.load(open(settings_file))
+    settings = get_settings()
 
     # create product directory and move product file in it
     prod_path = os.path.abspath(prod_name)
-    os.makedirs(prod_path, 0o775)
-    shutil.move(file, os.path.join(prod_path, file))
+    with span("stage_product", path=prod_path) as s:
+        s.add(bytes=os.path.getsize(file), items=1)
+        os.makedirs(prod_path, 0o775)
+        stage(file, os.path.join(prod_path, file))
 
     # copy _context.json if it exists
     ctx = {}
@@ -139,9 +217,9 @@ if __name__ == "__main__":
     try:
         # Corrects input dataset to input file, if supplied input dataset
         if os.path.isdir(args.file):
-            shutil.move(os.path.join(args.file, args.file), "./tmp")
+            stage(os.path.join(args.file, args.file), "./tmp")
             shutil.rmtree(args.file)
-            shutil.move("./tmp", args.file)
+            stage("./tmp", args.file)
         create_product(args.file, args.prod_name, args.prod_date)
     except Exception as e:
         with open('_alt_error.txt', 'a') as f:
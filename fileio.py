@@ -0,0 +1,42 @@
+"""
+File helpers shared by the localizer modules: atomic JSON writes and
+exclusive lock files.
+
+JSON files read by other jobs (watermarks, caches, metrics) are written
+to a temporary file next to them and renamed into place, so readers see
+either the previous or the new content. Read-modify-write updates are
+serialized across processes with an flock on a separate lock file.
+"""
+
+import os
+import json
+import fcntl
+import threading
+from contextlib import contextmanager
+
+
+def write_json_atomic(path, obj, **kwargs):
+    """Write obj as JSON to path by renaming a temporary file into place.
+       Keyword arguments are passed to json.dump."""
+
+    tmp_file = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+    try:
+        with open(tmp_file, 'w') as f:
+            json.dump(obj, f, **kwargs)
+        os.replace(tmp_file, path)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.unlink(tmp_file)
+        raise
+
+
+@contextmanager
+def locked(lock_file):
+    """Hold an exclusive lock on lock_file, creating it if needed."""
+
+    with open(lock_file, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
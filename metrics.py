@@ -0,0 +1,237 @@
+"""
+Helpers for recording PGE metrics in the pge_metrics.json file that HySDS
+merges into job metrics. The file uses the same layout osaka writes for
+measured transfers, i.e. {"download": [...], "upload": [...]}.
+
+Stages of sling, extract and util are timed with span(), which records
+duration, bytes, item count and outcome of each stage in the "spans"
+section. Spans are kept in memory and written by flush_spans(), once per
+process at exit or explicitly at the end of a batch. Spans are disabled
+by setting PGE_METRICS_SPANS=0 in the environment or calling
+enable_spans(False), in which case span() returns a shared no-op span.
+"""
+
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from fileio import write_json_atomic, locked
+
+
+PGE_METRICS_FILE = "./pge_metrics.json"
+
+# section of pge_metrics.json holding stage spans
+SPANS_SECTION = "spans"
+
+# environment variable disabling spans when set to 0, false, no or off
+SPANS_ENV = "PGE_METRICS_SPANS"
+
+_spans_enabled = os.environ.get(SPANS_ENV, "true").lower() not in \
+    ("0", "false", "no", "off")
+
+
+# serialize updates from concurrent transfers within a process
+_lock = threading.Lock()
+
+# spans waiting for flush_spans() by output file
+_spans = {}
+
+
+def _load(output):
+    if not os.path.exists(output):
+        return {}
+    with open(output) as f:
+        return json.load(f)
+
+
+def _dump(metrics, output):
+    write_json_atomic(output, metrics, indent=2, sort_keys=True)
+
+
+@contextmanager
+def _locked(output):
+    """Hold the lock of output against other threads and processes."""
+
+    with _lock, locked("%s.lock" % output):
+        yield
+
+
+def append_pge_metrics(section, entry, output=PGE_METRICS_FILE):
+    """Append entry to a list section of pge_metrics.json."""
+
+    extend_pge_metrics(section, [entry], output)
+
+
+def extend_pge_metrics(section, entries, output=PGE_METRICS_FILE):
+    """Append entries to a list section of pge_metrics.json."""
+
+    with _locked(output):
+        metrics = _load(output)
+        metrics.setdefault(section, []).extend(entries)
+        _dump(metrics, output)
+
+
+def transfer_metrics(url, path, time_start, time_end, size=None):
+    """Build a transfer metrics entry in the format osaka records."""
+
+    if size is None:
+        size = os.path.getsize(path)
+    duration = (time_end - time_start).total_seconds()
+    return {
+        "url": url,
+        "path": path,
+        "disk_usage": size,
+        "time_start": time_start.isoformat() + 'Z',
+        "time_end": time_end.isoformat() + 'Z',
+        "duration": duration,
+        "transfer_rate": size / duration if duration > 0 else 0.,
+    }
+
+
+def utcnow():
+    """Return current UTC time as a naive datetime."""
+
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def increment_pge_metrics(section, counters, output=PGE_METRICS_FILE):
+    """Add counters to a counter section of pge_metrics.json."""
+
+    with _locked(output):
+        metrics = _load(output)
+        totals = metrics.setdefault(section, {})
+        for k, v in counters.items():
+            totals[k] = totals.get(k, 0) + v
+        _dump(metrics, output)
+
+
+def enable_spans(enabled=True):
+    """Enable or disable recording of spans in this process."""
+
+    global _spans_enabled
+    _spans_enabled = enabled
+
+
+def _record_span(entry, output):
+    with _lock:
+        _spans.setdefault(os.path.abspath(output), []).append(entry)
+
+
+def flush_spans():
+    """Write the spans recorded in this process to their pge_metrics.json
+       files in a single update per file. Called at exit; processes that
+       exit without running atexit handlers, e.g. multiprocessing workers,
+       need to call it themselves."""
+
+    with _lock:
+        pending = dict(_spans)
+        _spans.clear()
+    for output, entries in pending.items():
+        # failing to record spans must not fail the job
+        try:
+            extend_pge_metrics(SPANS_SECTION, entries, output)
+        except (OSError, ValueError) as e:
+            logging.warning("Failed to record {} spans to {}: {}".format(
+                len(entries), output, e))
+
+
+atexit.register(flush_spans)
+
+# forked children must not flush the spans of their parent again
+os.register_at_fork(after_in_child=_spans.clear)
+
+
+class Span(object):
+    """Timing of a stage, recorded in the spans section of pge_metrics.json
+       by flush_spans() after the with block exits. The outcome is "error",
+       with the exception type, if the block raised and otherwise "ok"
+       unless set by the stage."""
+
+    def __init__(self, stage, output=PGE_METRICS_FILE, **attrs):
+        self.stage = stage
+        self.output = output
+        self.attrs = attrs
+        self.outcome = "ok"
+        self.bytes = None
+        self.items = None
+        self.time_start = None
+        self._t0 = None
+
+    def add(self, bytes=0, items=0):
+        """Count bytes and items processed by the stage."""
+
+        if bytes:
+            self.bytes = (self.bytes or 0) + bytes
+        if items:
+            self.items = (self.items or 0) + items
+
+    def set(self, outcome=None, **attrs):
+        """Set outcome and attributes of the span."""
+
+        if outcome is not None:
+            self.outcome = outcome
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.time_start = utcnow()
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        duration = time.perf_counter() - self._t0
+        entry = dict(self.attrs)
+        entry.update({
+            "stage": self.stage,
+            "time_start": self.time_start.isoformat() + 'Z',
+            "time_end": (self.time_start + timedelta(seconds=duration)).isoformat() + 'Z',
+            "duration": duration,
+            "outcome": self.outcome,
+        })
+        if exc_type is not None:
+            entry['outcome'] = "error"
+            entry['error'] = exc_type.__name__
+        if self.bytes is not None:
+            entry['bytes'] = self.bytes
+            entry['transfer_rate'] = self.bytes / duration if duration > 0 else 0.
+        if self.items is not None:
+            entry['items'] = self.items
+        _record_span(entry, self.output)
+        return False
+
+
+class _NullSpan(object):
+    """Span recording nothing, returned by span() when spans are disabled."""
+
+    def add(self, bytes=0, items=0):
+        pass
+
+    def set(self, outcome=None, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+_null_span = _NullSpan()
+
+
+def span(stage, output=PGE_METRICS_FILE, **attrs):
+    """Return a span timing stage in a with block, e.g.
+
+         with span("verify", path=path) as s:
+             ...
+             s.add(bytes=size)
+
+       Attributes are recorded with the span."""
+
+    if not _spans_enabled:
+        return _null_span
+    return Span(stage, output, **attrs)
@@ -0,0 +1,163 @@
+"""
+Resolution of S1 SLC download urls against the ASF datapool.
+
+An SLC the datapool has (a HEAD request answered with 403) is downloaded
+from ASF, one it does not have (404) falls back to the ESA url of the
+acquisition on a throttled queue. Answers are cached in memory and optionally in a JSON
+file shared by the runs on a worker, guarded by <cache file>.lock.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fileio import write_json_atomic, locked
+from metrics import span
+
+
+# queue for downloads falling back to ESA
+ESA_FALLBACK_QUEUE = "factotum-job_worker-scihub_throttled"
+
+
+# ASF datapool url of S1 SLCs
+ASF_SLC_URL = "https://datapool.asf.alaska.edu/SLC/SA/{}.zip"
+
+# number of concurrent ASF datapool requests
+RESOLVE_WORKERS = 8
+
+# seconds S1 SLCs resolved to ASF stay cached
+RESOLVE_CACHE_TTL = 86400
+
+# seconds S1 SLCs missing from ASF stay cached
+RESOLVE_CACHE_MISS_TTL = 3600
+
+
+def _percentile(values, p):
+    """Return p-th percentile of values by nearest rank."""
+
+    if not values:
+        return 0.
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100. * (len(values) - 1))))]
+
+
+class SlcResolver(object):
+    """Resolve S1 SLCs against the ASF datapool.
+
+       HEAD requests go through one pooled session and can be issued
+       concurrently by resolve_many(). Results are kept in memory and, if
+       cache_file is set, persisted there so that later runs on the same
+       worker skip the network until an entry expires."""
+
+    def __init__(self, cache_file=None, ttl=RESOLVE_CACHE_TTL,
+                 miss_ttl=RESOLVE_CACHE_MISS_TTL, workers=RESOLVE_WORKERS):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self.workers = workers
+        self.hits = 0
+        self.misses = 0
+        self.latencies = []
+        self._lock = threading.Lock()
+        import requests
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=workers,
+                                                pool_maxsize=workers)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._cache = self._load()
+
+    def _expired(self, entry, now):
+        ttl = self.ttl if entry['source'] == "asf" else self.miss_ttl
+        return now - entry['time'] > ttl
+
+    def _load(self):
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return {}
+        try:
+            with open(self.cache_file) as f:
+                cache = json.load(f)
+        except ValueError:
+            logging.warning("Ignoring corrupt resolve cache {}.".format(
+                self.cache_file))
+            return {}
+        now = time.time()
+        return {k: v for k, v in cache.items() if not self._expired(v, now)}
+
+    def save(self):
+        """Merge resolved entries into the cache file."""
+
+        if not self.cache_file:
+            return
+        cache_dir = os.path.dirname(os.path.abspath(self.cache_file))
+        os.makedirs(cache_dir, exist_ok=True)
+        with locked("%s.lock" % self.cache_file):
+            cache = self._load()
+            with self._lock:
+                cache.update(self._cache)
+            write_json_atomic(self.cache_file, cache)
+
+    def _lookup(self, identifier):
+        """Return source and ASF url of identifier."""
+
+        with self._lock:
+            entry = self._cache.get(identifier)
+            if entry is not None and not self._expired(entry, time.time()):
+                self.hits += 1
+                return entry
+        vertex_url = ASF_SLC_URL.format(identifier)
+        t0 = time.time()
+        r = self._session.head(vertex_url, allow_redirects=True)
+        latency = time.time() - t0
+        if r.status_code == 403:
+            entry = {"source": "asf", "url": r.url}
+        elif r.status_code == 404:
+            entry = {"source": "esa", "url": None}
+        else:
+            raise RuntimeError("Got status code {} from {}: {}".format(
+                r.status_code, vertex_url, r.url))
+        entry['time'] = time.time()
+        with self._lock:
+            self.misses += 1
+            self.latencies.append(latency)
+            self._cache[identifier] = entry
+        return entry
+
+    def resolve(self, identifier, download_url, project,
+                esa_queue=ESA_FALLBACK_QUEUE):
+        """Resolve S1 SLC using ASF datapool (ASF or NGAP). Fallback to ESA."""
+
+        entry = self._lookup(identifier)
+        if entry['source'] == "asf":
+            return entry['url'], f"{project}-job_worker-small"
+        return download_url, esa_queue
+
+    def resolve_many(self, identifiers):
+        """Resolve identifiers concurrently, warming the cache."""
+
+        identifiers = list(dict.fromkeys(identifiers))
+        hits, misses = self.hits, self.misses
+        t0 = time.time()
+        with span("url_resolution") as s:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                list(executor.map(self._lookup, identifiers))
+            s.add(items=len(identifiers))
+            s.set(cache_hits=self.hits - hits, cache_misses=self.misses - misses)
+        self.log_stats(hits, misses, time.time() - t0)
+
+    def log_stats(self, hits=0, misses=0, elapsed=None):
+        """Log cache hit rate and request latency since the given counts."""
+
+        hits = self.hits - hits
+        misses = self.misses - misses
+        total = hits + misses
+        latencies = self.latencies[len(self.latencies) - misses:] if misses else []
+        logging.info("Resolved {} S1 SLCs{}: cache hit rate {:.1%} ({} hits, {} misses); ".format(
+            total, "" if elapsed is None else " in {:.2f}s".format(elapsed),
+            hits / total if total else 0., hits, misses) +
+            "HEAD latency p50 {:.3f}s, p95 {:.3f}s, max {:.3f}s.".format(
+            _percentile(latencies, 50), _percentile(latencies, 95),
+            max(latencies) if latencies else 0.))
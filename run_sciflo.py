@@ -4,7 +4,8 @@ import sys
 import logging
 import argparse
 
-from sciflo_util import run_sciflo
+from sciflo_util import run_sciflo, HARVEST_WORKERS
+from metrics import flush_spans
 
 
 log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
@@ -15,19 +16,45 @@ logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
 BASE_PATH = os.path.dirname(__file__)
 
 
-def main(sfl_file, context_file):
+def main(sfl_file, context_file, harvest_skip=None,
+         harvest_workers=HARVEST_WORKERS, harvest_keep_links=False):
     """Main."""
 
     sfl_file = os.path.abspath(sfl_file)
     context_file = os.path.abspath(context_file)
     logger.info("sfl_file: %s" % sfl_file)
     logger.info("context_file: %s" % context_file)
-    return run_sciflo(sfl_file, ["context_file=%s" % context_file])
+    status = run_sciflo(sfl_file, ["context_file=%s" % context_file],
+                        harvest_skip, harvest_workers,
+                        harvest_keep_links=harvest_keep_links)
+
+    # advance AOI watermarks of an incremental localizer run
+    import util
+    pending_file = os.path.join(os.path.dirname(context_file),
+                                util.PENDING_WATERMARKS_FILE)
+    if os.path.exists(pending_file):
+        try:
+            util.commit_aoi_watermarks(pending_file)
+        except Exception as e:
+            logger.error("Failed to advance AOI watermarks; the next run " +
+                         "queries the same window again: {}".format(e),
+                         exc_info=True)
+    flush_spans()
+    return status
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument("sfl_file", help="SciFlo workflow")
     parser.add_argument("context_file", help="HySDS context file")
+    parser.add_argument("--harvest_skip", action="append", default=[],
+                        help="glob of sciflo work dir files not to harvest " +
+                             "(may be repeated)")
+    parser.add_argument("--harvest_workers", type=int, default=HARVEST_WORKERS,
+                        help="number of threads harvesting sciflo work dirs")
+    parser.add_argument("--harvest_keep_links", action="store_true",
+                        help="recreate symlinks in sciflo work dirs instead " +
+                             "of harvesting the files they point to")
     args = parser.parse_args()
-    sys.exit(main(args.sfl_file, args.context_file))
+    sys.exit(main(args.sfl_file, args.context_file, args.harvest_skip,
+                  args.harvest_workers, args.harvest_keep_links))
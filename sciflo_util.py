@@ -3,28 +3,127 @@ import os
 import sys
 import json
 import re
+import time
 import shutil
-from subprocess import check_call
+import fnmatch
+import logging
+from datetime import datetime, timezone
+from subprocess import check_call, Popen, PIPE, STDOUT
+from xml.etree import ElementTree
+from concurrent.futures import ThreadPoolExecutor
+
+from staging import link
+from metrics import increment_pge_metrics
+
+
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
 
 
 WORK_RE = re.compile(r'\d{5}-.+')
 
+# number of threads harvesting files of sciflo work dirs
+HARVEST_WORKERS = 8
+
+# SciFlo workflow XML namespace
+SF_NS = "http://sciflo.jpl.nasa.gov/2006v1/sf"
+
+# timing report written to the job dir
+TIMING_FILE = "sciflo_timing.json"
+
 
-def copy_sciflo_work(output_dir):
-    """Move over sciflo work dirs."""
+def _harvest_file(src, dst):
+    """Link or copy file and return (strategy, size)."""
+
+    return link(src, dst), os.path.getsize(dst)
+
+
+def _harvest_tree(real_path, new_path, skip, executor, stats, keep_links=False):
+    """Recreate tree of real_path at new_path and submit its files to
+       executor. Symlinks are followed and the files they point to are
+       harvested, unless keep_links is set. Return the list of futures."""
+
+    futures = []
+    for root, dirs, files in os.walk(real_path, followlinks=not keep_links):
+        rel_root = os.path.relpath(root, real_path)
+        dst_root = os.path.normpath(os.path.join(new_path, rel_root))
+        os.makedirs(dst_root, exist_ok=True)
+        shutil.copystat(root, dst_root)
+        for name in dirs + files:
+            src = os.path.join(root, name)
+            dst = os.path.join(dst_root, name)
+            if os.path.islink(src):
+                if keep_links:
+                    os.symlink(os.readlink(src), dst)
+                    continue
+                if not os.path.exists(src):
+                    logger.warning("Skipping dangling symlink {}.".format(src))
+                    stats['dangling_links'] += 1
+                    continue
+                # hard links to a symlink would link the symlink itself
+                src = os.path.realpath(src)
+            if name in dirs:
+                continue
+            rel_path = os.path.normpath(os.path.join(rel_root, name))
+            if any(fnmatch.fnmatch(name, g) or fnmatch.fnmatch(rel_path, g)
+                   for g in skip):
+                stats['skipped_files'] += 1
+                stats['skipped_bytes'] += os.path.getsize(src)
+                continue
+            futures.append(executor.submit(_harvest_file, src, dst))
+    return futures
 
+
+def copy_sciflo_work(output_dir, skip=None, workers=HARVEST_WORKERS,
+                     keep_links=False):
+    """Move over sciflo work dirs.
+
+       Files are hard linked or reflinked where the filesystem allows it
+       and otherwise copied by a pool of worker threads. Symlinks in the
+       work dirs, e.g. into per-job cache dirs, are followed and the files
+       they point to harvested, unless keep_links is set. Files whose name
+       or path relative to the work dir matches a glob in skip are left
+       out. Return harvest stats, which are also added to the sciflo_work
+       section of pge_metrics.json."""
+
+    skip = skip or []
+    stats = {"dirs": 0, "files": 0, "bytes": 0, "skipped_files": 0,
+             "skipped_bytes": 0, "dangling_links": 0, "hardlink": 0,
+             "reflink": 0, "copy": 0}
+    t0 = time.time()
+    work_dirs = []
     for root, dirs, files in os.walk(output_dir):
         for d in dirs:
             if not WORK_RE.search(d):
                 continue
             path = os.path.join(root, d)
             if os.path.islink(path) and os.path.exists(path):
-                real_path = os.path.realpath(path)
-                base_name = os.path.basename(real_path)
-                new_path = os.path.join(root, base_name)
-                shutil.copytree(real_path, new_path)
-                os.unlink(path)
-                os.symlink(base_name, path)
+                work_dirs.append((root, path))
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        harvests = []
+        for root, path in work_dirs:
+            real_path = os.path.realpath(path)
+            base_name = os.path.basename(real_path)
+            new_path = os.path.join(root, base_name)
+            harvests.append((path, base_name, _harvest_tree(
+                real_path, new_path, skip, executor, stats, keep_links)))
+        for path, base_name, futures in harvests:
+            for future in futures:
+                strategy, size = future.result()
+                stats[strategy] += 1
+                stats['files'] += 1
+                stats['bytes'] += size
+            os.unlink(path)
+            os.symlink(base_name, path)
+            stats['dirs'] += 1
+
+    stats['elapsed'] = time.time() - t0
+    logger.info("Harvested {dirs} sciflo work dirs: {files} files, {bytes} bytes ".format(**stats) +
+                "({hardlink} hard linked, {reflink} reflinked, {copy} copied), ".format(**stats) +
+                "skipped {skipped_files} files, {skipped_bytes} bytes ".format(**stats) +
+                "and {dangling_links} dangling links in {elapsed:.2f}s.".format(**stats))
+    increment_pge_metrics("sciflo_work", stats)
+    return stats
 
 
 def extract_error(sfl_json):
@@ -66,8 +165,109 @@ def extract_error(sfl_json):
                     f.write("%s\n" % tb)
 
 
-def run_sciflo(sfl_file, sfl_args):
-    """Run sciflo."""
+def sciflo_process_ids(sfl_file):
+    """Return ids of the processes of a SciFlo workflow in document order."""
+
+    root = ElementTree.parse(sfl_file).getroot()
+    return [e.get('id') for e in root.iter("{%s}process" % SF_NS)
+            if e.get('id')]
+
+
+class ProcessTimer(object):
+    """Track SciFlo processes from the lines of sflExec output that
+       mention them: a process is taken to start at its first mention and
+       end at its last."""
+
+    def __init__(self, process_ids):
+        self.process_ids = process_ids
+        self.processes = {}
+        self.regex = re.compile(r'\b(%s)\b' % '|'.join(
+            re.escape(i) for i in process_ids)) if process_ids else None
+
+    def feed(self, line, now=None):
+        if self.regex is None:
+            return
+        now = time.time() if now is None else now
+        for proc_id in set(self.regex.findall(line)):
+            if proc_id not in self.processes:
+                logger.info("SciFlo process {} started.".format(proc_id))
+                self.processes[proc_id] = {"start": now, "end": now, "lines": 0}
+            self.processes[proc_id]['end'] = now
+            self.processes[proc_id]['lines'] += 1
+
+    def report(self):
+        return {i: dict(self.processes[i], duration=self.processes[i]['end'] -
+                        self.processes[i]['start'])
+                for i in self.process_ids if i in self.processes}
+
+
+def _parse_time(ts):
+    """Parse an ISO 8601 UTC timestamp of a job to epoch seconds."""
+
+    ts = ts.rstrip('Z')
+    fmt = "%Y-%m-%dT%H:%M:%S.%f" if '.' in ts else "%Y-%m-%dT%H:%M:%S"
+    return datetime.strptime(ts, fmt).replace(tzinfo=timezone.utc).timestamp()
+
+
+def _summary(values):
+    values = sorted(values)
+    if not values:
+        return None
+    return {
+        "min": values[0],
+        "p50": values[len(values) // 2],
+        "max": values[-1],
+        "mean": sum(values) / len(values),
+    }
+
+
+def job_timing(output_dir, process_ids=()):
+    """Return fan-out width, queue wait and run time of the jobs whose
+       work dirs are linked under output_dir, grouped by the process in
+       their path or else by their parent directory."""
+
+    groups = {}
+    for root, dirs, files in os.walk(output_dir):
+        for d in dirs:
+            if not WORK_RE.search(d):
+                continue
+            path = os.path.join(root, d)
+            job_file = os.path.join(path, "_job.json")
+            if not os.path.islink(path) or not os.path.exists(job_file):
+                continue
+            parts = os.path.relpath(root, output_dir).split(os.sep)
+            group = next((p for p in parts if p in process_ids),
+                         os.path.relpath(root, output_dir))
+            try:
+                with open(job_file) as f:
+                    job_info = json.load(f).get('job_info', {})
+                queued = _parse_time(job_info['time_queued'])
+                start = _parse_time(job_info['time_start'])
+                end = _parse_time(job_info['time_end'])
+            except (KeyError, ValueError) as e:
+                logger.warning("No timing in {}: {}".format(job_file, e))
+                continue
+            groups.setdefault(group, []).append((queued, start, end))
+    timing = {}
+    for group, jobs in groups.items():
+        timing[group] = {
+            "jobs": len(jobs),
+            "queue_wait": _summary([s - q for q, s, e in jobs]),
+            "run_time": _summary([e - s for q, s, e in jobs]),
+            "span": max(e for q, s, e in jobs) - min(q for q, s, e in jobs),
+        }
+    return timing
+
+
+def run_sciflo(sfl_file, sfl_args, harvest_skip=None,
+               harvest_workers=HARVEST_WORKERS, timing_file=TIMING_FILE,
+               harvest_keep_links=False):
+    """Run sciflo.
+
+       sflExec output is streamed to stdout while the time each workflow
+       process is active is tracked. Stage durations and fan-out width,
+       queue wait and run time of the jobs of each process are written to
+       timing_file."""
 
     # build paths to executables
     sflexec_path = os.path.join(
@@ -75,10 +275,23 @@ def run_sciflo(sfl_file, sfl_args):
 
     # execute sciflo
     cmd = [sflexec_path, "-s", "-f", "-o", "output",
-           "--args", '"%s"' % ','.join(sfl_args), sfl_file]
+           "--args", ','.join(sfl_args), sfl_file]
     print("Running sflExec.py command:\n%s" % ' '.join(cmd))
-    #check_call(cmd, shell)
-    status = os.system(' '.join(cmd))
+    try:
+        process_ids = sciflo_process_ids(sfl_file)
+    except Exception as e:
+        logger.warning("Failed to parse process ids from {}: {}".format(sfl_file, e))
+        process_ids = []
+    timer = ProcessTimer(process_ids)
+    t0 = time.time()
+    proc = Popen(cmd, stdout=PIPE, stderr=STDOUT, universal_newlines=True,
+                 bufsize=1)
+    for line in proc.stdout:
+        sys.stdout.write(line)
+        sys.stdout.flush()
+        timer.feed(line)
+    status = proc.wait()
+    t1 = time.time()
     print("Exit status is: %d" % status)
     if status != 0:
         extract_error('output/sciflo.json')
@@ -86,8 +299,32 @@ def run_sciflo(sfl_file, sfl_args):
 
     # copy sciflo work and exec dir
     try:
-        copy_sciflo_work("output")
-    except:
-        pass
+        copy_sciflo_work("output", harvest_skip, harvest_workers,
+                         harvest_keep_links)
+    except Exception as e:
+        logger.error("Failed to harvest sciflo work dirs: {}".format(e),
+                     exc_info=True)
+
+    # write timing report
+    try:
+        report = {
+            "command": cmd,
+            "exit_status": proc.returncode,
+            "time_start": t0,
+            "time_end": t1,
+            "duration": t1 - t0,
+            "processes": timer.report(),
+            "jobs": job_timing("output", process_ids),
+        }
+        with open(timing_file, 'w') as f:
+            json.dump(report, f, indent=2)
+        for proc_id, p in report['processes'].items():
+            logger.info("SciFlo process {} took {:.2f}s.".format(proc_id, p['duration']))
+        for group, j in report['jobs'].items():
+            logger.info("{} jobs of {}: median queue wait {:.2f}s, median run time {:.2f}s.".format(
+                j['jobs'], group, j['queue_wait']['p50'], j['run_time']['p50']))
+    except Exception as e:
+        logger.error("Failed to write timing report {}: {}".format(timing_file, e),
+                     exc_info=True)
 
     return status
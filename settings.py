@@ -0,0 +1,30 @@
+"""
+settings.json shared by the localizer scripts, loaded once per process.
+
+This module has no import-time side effects (in particular it does not
+configure logging) so that each script keeps its own log format.
+"""
+
+import os
+import json
+
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+
+
+# settings loaded once per process
+_settings = None
+
+
+def get_settings():
+    """Return settings.json, falling back to the template, loading it on
+       first use."""
+
+    global _settings
+    if _settings is None:
+        settings_file = os.path.join(BASE_PATH, 'settings.json')
+        if not os.path.exists(settings_file):
+            settings_file = os.path.join(BASE_PATH, 'settings.json.tmpl')
+        with open(settings_file) as f:
+            _settings = json.load(f)
+    return _settings
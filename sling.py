@@ -18,21 +18,24 @@ import logging
 import traceback
 import argparse
 import shutil
+import hashlib
 import tarfile
+import tempfile
 import zipfile
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 from requests.packages.urllib3.exceptions import InsecurePlatformWarning
 
-import boto
-
-import osaka.main
-
-from hysds.orchestrator import submit_job
-import hysds.orchestrator
-from hysds.celery import app
-from hysds.dataset_ingest import ingest
-from hysds_commons.job_rest_utils import single_process_and_submission
+import download
+from cache import open_cache
+from throttle import get_scheduler
+from metrics import append_pge_metrics, increment_pge_metrics, span, \
+    transfer_metrics, utcnow
+from staging import stage
+from settings import get_settings
 
 # disable warnings for SSL verification
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
@@ -55,11 +58,134 @@ TAR_TYPE = ["tbz2", "tgz", "bz2", "gz"]
 ALL_TYPES.extend(TAR_TYPE)
 
 
-def verify(path, file_type):
-    """Verify downloaded file is okay by checking that it can
-       be unzipped/untarred."""
+# verification modes
+VERIFY_MODES = ["stream", "extract"]
+
+# read size used when streaming archive members during verification
+VERIFY_CHUNK_SIZE = 1024 * 1024
+
+# digests computed for downloaded files and written to the .met.json
+DIGEST_ALGORITHMS = ["md5", "sha256"]
+
+
+class DigestReader(object):
+    """Read-only file object that computes digests of a file as it is read.
+
+       Only bytes read contiguously from the start of the file are hashed.
+       finish() hashes whatever the consumer skipped, so the digests always
+       cover the whole file while each byte is normally read only once."""
+
+    def __init__(self, path, algorithms=DIGEST_ALGORITHMS):
+        self.name = path
+        self.bytes_read = 0
+        self._f = open(path, 'rb')
+        self._hashes = {a: hashlib.new(a) for a in algorithms}
+        self._hashed = 0
+
+    def _update(self, pos, data):
+        end = pos + len(data)
+        if pos <= self._hashed < end:
+            chunk = memoryview(data)[self._hashed - pos:]
+            for h in self._hashes.values():
+                h.update(chunk)
+            self._hashed = end
+
+    def read(self, size=-1):
+        pos = self._f.tell()
+        data = self._f.read(size)
+        self.bytes_read += len(data)
+        self._update(pos, data)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self._f.seek(offset, whence)
+
+    def tell(self):
+        return self._f.tell()
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def finish(self, chunk_size=VERIFY_CHUNK_SIZE):
+        """Hash the rest of the file and return hex digests by algorithm."""
+
+        self.seek(self._hashed)
+        _drain(self, chunk_size)
+        return {a: h.hexdigest() for a, h in self._hashes.items()}
+
+
+def file_digests(path, algorithms=DIGEST_ALGORITHMS):
+    """Compute digests of a file in a single read."""
 
-    test_dir = "./extract_test"
+    with DigestReader(path, algorithms) as f:
+        return f.finish()
+
+
+def _drain(f, chunk_size=VERIFY_CHUNK_SIZE):
+    """Read file object to EOF in fixed-size chunks and discard the data.
+       Return number of bytes read."""
+
+    total = 0
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        total += len(chunk)
+    return total
+
+
+def verify_zip_stream(path, chunk_size=VERIFY_CHUNK_SIZE):
+    """Verify zipfile by decompressing every member in memory; the CRC of
+       each member is checked by zipfile once its stream is exhausted.
+       path may also be a seekable file object."""
+
+    if not zipfile.is_zipfile(path):
+        raise RuntimeError("%s is not a zipfile." % getattr(path, 'name', path))
+    with zipfile.ZipFile(path, 'r') as f:
+        for info in f.infolist():
+            if info.is_dir():
+                continue
+            with f.open(info) as m:
+                _drain(m, chunk_size)
+
+
+def verify_tar_stream(path, chunk_size=VERIFY_CHUNK_SIZE):
+    """Verify tarfile by reading through every member stream in memory.
+       path may also be a seekable file object."""
+
+    if not tarfile.is_tarfile(path):
+        raise RuntimeError("%s is not a tarfile." % getattr(path, 'name', path))
+    if isinstance(path, str):
+        f = tarfile.open(path)
+    else:
+        f = tarfile.open(fileobj=path)
+    with f:
+        for member in f:
+            if not member.isfile():
+                continue
+            _drain(f.extractfile(member), chunk_size)
+
+        # read to end of the compressed stream so that gzip/bz2 trailers
+        # (CRC and length) are checked as well
+        _drain(f.fileobj, chunk_size)
+
+
+def verify_extract(path, file_type):
+    """Verify downloaded file by extracting it to disk."""
+
+    test_dir = tempfile.mkdtemp(prefix="extract_test_", dir=".")
     if file_type in ZIP_TYPE:
         if not zipfile.is_zipfile(path):
             raise RuntimeError("%s is not a zipfile." % path)
@@ -77,117 +203,294 @@ def verify(path, file_type):
                                   (path, file_type))
 
 
+def verify(path, file_type, mode="stream"):
+    """Verify downloaded file is okay by checking that it can
+       be unzipped/untarred. Return digests of the file by algorithm.
+
+       In "stream" mode archive members are read in fixed-size chunks
+       and never written to disk; the digests are computed from the same
+       reads. In "extract" mode the archive is extracted to a scratch
+       directory which is then removed."""
+
+    if mode == "extract":
+        verify_extract(path, file_type)
+        return file_digests(path)
+    elif mode != "stream":
+        raise RuntimeError("Invalid verification mode: %s" % mode)
+    if file_type not in ALL_TYPES:
+        raise NotImplementedError("Failed to verify %s is file type %s." %
+                                  (path, file_type))
+    with DigestReader(path) as f:
+        if file_type in ZIP_TYPE:
+            verify_zip_stream(f)
+        else:
+            verify_tar_stream(f)
+        digests = f.finish()
+        logging.info("Read {} bytes of {} byte file {}.".format(
+            f.bytes_read, os.path.getsize(path), path))
+    return digests
+
+
 def upload(url, path):
     """Upload file to repository location."""
 
+    import osaka.main
+
     logging.info("Uploading {} to {}".format(path, url))
-    parsed_url = urlparse(url)
     if not osaka.main.supported(url):
         raise RuntimeError("Invalid url: %s" % url)
-    osaka.main.put(path, url, measure=True, output="./pge_metrics.json")
+    # measured here rather than by osaka, which writes pge_metrics.json
+    # without the lock held by concurrent slings of a batch
+    time_start = utcnow()
+    osaka.main.put(path, url)
+    append_pge_metrics("upload", transfer_metrics(url, path, time_start, utcnow()))
+
+
+# default number of concurrent existence checks in exists_many()
+EXISTS_WORKERS = 8
+
+
+class ExistenceChecker(object):
+    """Check existence of repository urls, reusing connections across checks.
+
+       The S3 endpoint to region map is built once per process, S3
+       connections are pooled per thread and region and buckets are looked
+       up without validation so that each check is a single HEAD on the
+       key. HTTP/HTTPS checks share one pooled requests session."""
+
+    _s3_regions = None
+    _s3_regions_lock = threading.Lock()
+
+    def __init__(self, workers=EXISTS_WORKERS):
+        self.workers = workers
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=workers,
+                                                pool_maxsize=workers)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._session.verify = False
+        self._local = threading.local()
+
+    @classmethod
+    def s3_region(cls, host):
+        """Return S3 region of endpoint host."""
+
+        with cls._s3_regions_lock:
+            if cls._s3_regions is None:
+                import boto.regioninfo
+                cls._s3_regions = [(r, re.compile(e)) for r, e in
+                                   boto.regioninfo.load_regions()['s3'].items()]
+        for region, regex in cls._s3_regions:
+            if regex.search(host):
+                return region
+        raise RuntimeError("Failed to find region for endpoint %s." % host)
+
+    def _bucket(self, parsed_url, bn):
+        """Return unvalidated bucket using this thread's pooled connection."""
+
+        region = self.s3_region(parsed_url.hostname)
+        conns = getattr(self._local, 'conns', None)
+        if conns is None:
+            conns = self._local.conns = {}
+        conn_key = (region, parsed_url.username)
+        if conn_key not in conns:
+            import boto.s3
+            conns[conn_key] = boto.s3.connect_to_region(
+                region, aws_access_key_id=parsed_url.username,
+                aws_secret_access_key=parsed_url.password)
+        return conns[conn_key].get_bucket(bn, validate=False)
+
+    def exists(self, url):
+        """Check based on protocol if url exists."""
+
+        parsed_url = urlparse(url)
+        if parsed_url.scheme == "":
+            raise RuntimeError("Invalid url: %s" % url)
+        if parsed_url.scheme in ('http', 'https'):
+            r = self._session.head(url)
+            if r.status_code == 200:
+                return True
+            elif r.status_code == 404:
+                return False
+            else:
+                r.raise_for_status()
+        elif parsed_url.scheme in ('s3', 's3s'):
+            import boto.exception
+            match = re.search(r'/(.*?)/(.*)$', parsed_url.path)
+            if not match:
+                raise RuntimeError("Failed to parse bucket & key from %s." %
+                                   parsed_url.path)
+            bn, kn = match.groups()
+            try:
+                key = self._bucket(parsed_url, bn).get_key(kn)
+            except boto.exception.S3ResponseError as e:
+                if e.status == 404:
+                    return False
+                else:
+                    raise
+            return key is not None
+        else:
+            raise NotImplementedError("Failed to check existence of %s url." %
+                                      parsed_url.scheme)
+
+    def _exists_or_false(self, url):
+        try:
+            return self.exists(url)
+        except Exception as e:
+            logging.warning("Failed to check existence of {}; ".format(url) +
+                            "treating it as not present: {}".format(e))
+            return False
+
+    def exists_many(self, urls):
+        """Check existence of urls concurrently. Return dict of url to
+           existence. A url whose check fails is treated as not present,
+           so one failed check does not abort the others."""
+
+        urls = list(dict.fromkeys(urls))
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return dict(zip(urls, executor.map(self._exists_or_false, urls)))
+
+
+# existence checker shared within the process
+_checker = None
+
+
+def get_checker():
+    """Return the process-wide existence checker."""
+
+    global _checker
+    if _checker is None:
+        _checker = ExistenceChecker()
+    return _checker
 
 
 def exists(url):
     """Check based on protocol if url exists."""
 
-    parsed_url = urlparse(url)
-    if parsed_url.scheme == "":
-        raise RuntimeError("Invalid url: %s" % url)
-    if parsed_url.scheme in ('http', 'https'):
-        r = requests.head(url, verify=False)
-        if r.status_code == 200:
-            return True
-        elif r.status_code == 404:
-            return False
-        else:
-            r.raise_for_status()
-    elif parsed_url.scheme in ('s3', 's3s'):
-        s3_eps = boto.regioninfo.load_regions()['s3']
-        region = None
-        for r, e in list(s3_eps.items()):
-            if re.search(e, parsed_url.netloc):
-                region = r
-                break
-        if region is None:
-            raise RuntimeError("Failed to find region for endpoint %s." %
-                               parsed_url.netloc)
-        conn = boto.s3.connect_to_region(region,
-                                         aws_access_key_id=parsed_url.username,
-                                         aws_secret_access_key=parsed_url.password)
-        match = re.search(r'/(.*?)/(.*)$', parsed_url.path)
-        if not match:
-            raise RuntimeError("Failed to parse bucket & key from %s." %
-                               parsed_url.path)
-        bn, kn = match.groups()
+    return get_checker().exists(url)
+
+
+def exists_many(urls):
+    """Check existence of urls concurrently."""
+
+    return get_checker().exists_many(urls)
+
+
+def get_localize_url(repo_url):
+    """Return url to localize repo_url from."""
+
+    if repo_url.startswith('dav'):
+        return "http%s" % repo_url[3:]
+    return repo_url
+
+
+def fetch(download_url, path, oauth_url=None, connections=download.DEFAULT_CONNECTIONS,
+          chunk_size=download.DEFAULT_CHUNK_SIZE, scheduler=None):
+    """Download file using parallel byte ranges when the source supports
+       them, otherwise using osaka. Connections to the source host are
+       bounded by scheduler; bandwidth is only limited for ranged
+       downloads."""
+
+    if connections > 1 and download.supported(download_url):
         try:
-            bucket = conn.get_bucket(bn)
-        except boto.exception.S3ResponseError as e:
-            if e.status == 404:
-                return False
-            else:
-                raise
-        key = bucket.get_key(kn)
-        if key is None:
-            return False
-        else:
-            return True
-    else:
-        raise NotImplementedError("Failed to check existence of %s url." %
-                                  parsed_url.scheme)
+            download.get(download_url, path, connections, chunk_size, oauth_url,
+                         scheduler)
+            return
+        except download.RangesNotSupported as e:
+            logging.warning("{}; falling back to osaka.".format(e))
+    import osaka.main
+    with nullcontext() if scheduler is None else scheduler.connection(download_url):
+        time_start = utcnow()
+        osaka.main.get(download_url, path, params={"oauth": oauth_url})
+        append_pge_metrics("download", transfer_metrics(
+            download_url, path, time_start, utcnow()))
 
 
 def sling(download_url, repo_url, prod_name, file_type, prod_date, prod_met=None,
-          oauth_url=None, force=False, force_extract=False):
+          oauth_url=None, force=False, force_extract=False, verify_mode="stream",
+          check_exists=False,
+          connections=download.DEFAULT_CONNECTIONS,
+          chunk_size=download.DEFAULT_CHUNK_SIZE):
     """Download file, push to repo and submit job for extraction."""
 
     # log force flags
     logging.info("force: {}; force_extract: {}".format(force, force_extract))
 
+    # get settings
+    settings = get_settings()
+
     # get localize_url
-    if repo_url.startswith('dav'):
-        localize_url = "http%s" % repo_url[3:]
-    else:
-        localize_url = repo_url
+    localize_url = get_localize_url(repo_url)
 
     # get filename
     path = os.path.basename(repo_url)
 
     # check if localize_url already exists
-#    is_here = exists(localize_url)
     is_here = False
-#   logging.info("%s existence: %s" % (localize_url, is_here))
+    if check_exists:
+        with span("exists", url=localize_url) as s:
+            is_here = exists(localize_url)
+            s.set(exists=is_here)
+        logging.info("%s existence: %s" % (localize_url, is_here))
 
     # do nothing if not being forced
-#    if is_here and not force and not force_extract: return
+    if is_here and not force and not force_extract:
+        return
 
     # download from source if not here or forced
     if not is_here or force:
 
-        # download
-        logging.info("Downloading {} to {}.".format(download_url, path))
-        try:
-            osaka.main.get(download_url, path, params={
-                           "oauth": oauth_url}, measure=True, output="./pge_metrics.json")
-        except Exception as e:
-            tb = traceback.format_exc()
-            logging.error("Failed to download {} to {}: {}".format(download_url,
-                                                               path, tb))
-            raise
+        # link verified download from worker cache if available
+        cache = open_cache(settings)
+        checksums = None
+        if cache is not None:
+            with span("cache_lookup", url=download_url) as s:
+                checksums = cache.lookup(download_url, path)
+                s.set(outcome="miss" if checksums is None else "hit")
+
+        if checksums is None:
+
+            # download
+            logging.info("Downloading {} to {}.".format(download_url, path))
+            try:
+                with span("download", url=download_url,
+                          host=urlparse(download_url).hostname) as s:
+                    fetch(download_url, path, oauth_url, connections, chunk_size,
+                          get_scheduler(settings))
+                    s.add(bytes=os.path.getsize(path))
+            except Exception as e:
+                tb = traceback.format_exc()
+                logging.error("Failed to download {} to {}: {}".format(download_url,
+                                                                   path, tb))
+                raise
 
-        # verify downloaded file was not corrupted
-        logging.info("Verifying {} is file type {}.".format(path, file_type))
-        try:
-            verify(path, file_type)
-        except Exception as e:
-            tb = traceback.format_exc()
-            logging.error("Failed to verify %s is file type %s: %s" %
-                          (path, file_type, tb))
-            raise
+            # verify downloaded file was not corrupted
+            logging.info("Verifying {} is file type {} ({} mode).".format(
+                path, file_type, verify_mode))
+            try:
+                with span("verify", path=path, file_type=file_type,
+                          mode=verify_mode) as s:
+                    checksums = verify(path, file_type, verify_mode)
+                    s.add(bytes=os.path.getsize(path))
+            except Exception as e:
+                tb = traceback.format_exc()
+                logging.error("Failed to verify %s is file type %s: %s" %
+                              (path, file_type, tb))
+                raise
+
+            # share verified download with later jobs on this worker
+            if cache is not None:
+                cache.insert(download_url, path, checksums)
+
+        if cache is not None:
+            increment_pge_metrics("download_cache", cache.stats)
         # Make a product here
         dataset_name = "incoming-" + prod_date + "-" + os.path.basename(path)
         proddir = os.path.join(".", dataset_name)
-        os.makedirs(proddir)
-        shutil.move(path, proddir)
+        with span("stage_product", path=proddir) as s:
+            s.add(bytes=os.path.getsize(path), items=1)
+            os.makedirs(proddir)
+            stage(path, os.path.join(proddir, os.path.basename(path)))
         metadata = {
             "download_url": download_url,
             "prod_name": prod_name,
@@ -195,6 +498,7 @@ def sling(download_url, repo_url, prod_name, file_type, prod_date, prod_met=None
             "file": os.path.basename(localize_url),
             "data_product_name": os.path.basename(path),
             "dataset": "incoming",
+            "checksums": checksums,
         }
 
         # Add metadata from context.json
@@ -208,14 +512,6 @@ def sling(download_url, repo_url, prod_name, file_type, prod_date, prod_met=None
             json.dump(metadata, f)
             f.close()
 
-        # get settings
-        settings_file = os.path.join(os.path.dirname(os.path.realpath(__file__)),
-                                     'settings.json')
-        if not os.path.exists(settings_file):
-            settings_file = os.path.join(os.path.dirname(os.path.realpath(__file__)),
-                                         'settings.json.tmpl')
-        settings = json.load(open(settings_file))
-
         # dump dataset
         with open(os.path.join(proddir, dataset_name + ".dataset.json"), "w") as f:
             dataset_json = {"version": settings["INCOMING_VERSION"]}
@@ -256,6 +552,19 @@ if __name__ == "__main__":
                        "exists, skip download from " +
                        "source and use whatever is " +
                        "at repo_url", action='store_true')
+    parser.add_argument("--verify_mode", help="archive verification mode; " +
+                        "stream reads members in memory, extract " +
+                        "extracts them to a scratch directory",
+                        choices=VERIFY_MODES, default="stream")
+    parser.add_argument("--check_exists", help="skip download if repo_url " +
+                        "already exists unless forced", action='store_true')
+    parser.add_argument("--connections", help="number of concurrent " +
+                        "connections for HTTP/HTTPS downloads; 1 " +
+                        "downloads with osaka over a single connection",
+                        type=int, default=download.DEFAULT_CONNECTIONS)
+    parser.add_argument("--chunk_size", help="size in bytes of each " +
+                        "byte range of a parallel download",
+                        type=int, default=download.DEFAULT_CHUNK_SIZE)
     args = parser.parse_args()
     # load prod_met as string
     j = json.loads(open("_context.json").read())
@@ -263,7 +572,9 @@ if __name__ == "__main__":
 
     try:
         sling(args.download_url, args.repo_url, args.prod_name, args.file_type,
-              args.prod_date, prod_met, args.oauth_url, args.force, args.force_extract)
+              args.prod_date, prod_met, args.oauth_url, args.force, args.force_extract,
+              args.verify_mode, args.check_exists, args.connections,
+              args.chunk_size)
     except Exception as e:
         with open('_alt_error.txt', 'a') as f:
             f.write("%s\n" % str(e))
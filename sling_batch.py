@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""
+Sling a batch of acquisitions listed in the job context: download and
+verify them concurrently and create an incoming product directory for
+each one.
+
+Failures are reported per acquisition in batch_results.json; the job
+only fails if none of the acquisitions could be slung.
+"""
+
+import sys
+import json
+import time
+import logging
+import argparse
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import download
+from sling import sling, exists_many, get_localize_url, VERIFY_MODES
+from settings import get_settings
+from throttle import get_scheduler
+from metrics import increment_pge_metrics, flush_spans
+
+
+log_format = "[%(asctime)s: %(levelname)s/%(threadName)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO, force=True)
+
+
+# default number of acquisitions slung concurrently
+DEFAULT_WORKERS = 4
+
+# file to report per acquisition results to
+RESULTS_FILE = "batch_results.json"
+
+# job context params overriding the command line options of the same name
+CONTEXT_OPTIONS = {
+    "workers": int,
+    "verify_mode": str,
+    "check_exists": lambda v: v.lower() == "true" if isinstance(v, str) else bool(v),
+    "connections": int,
+    "chunk_size": int,
+}
+
+
+def sling_one(acq, verify_mode, connections, chunk_size):
+    """Sling one acquisition and return its result. Its downloads take
+       connection slots of the process-wide throttle scheduler."""
+
+    result = {
+        "prod_name": acq.get("prod_name"),
+        "download_url": acq.get("download_url"),
+        "status": "success",
+    }
+    t0 = time.time()
+    try:
+        sling(acq["download_url"], acq["repo_url"], acq["prod_name"],
+              acq["file_type"], acq["prod_date"],
+              json.dumps(acq.get("prod_met") or {}),
+              acq.get("oauth_url"), acq.get("force", False),
+              acq.get("force_extract", False), verify_mode,
+              connections=connections, chunk_size=chunk_size)
+    except Exception as e:
+        tb = traceback.format_exc()
+        logging.error("Failed to sling {}: {}".format(result["prod_name"], tb))
+        result.update({
+            "status": "failed",
+            "error": str(e),
+            "traceback": tb,
+        })
+    result["duration"] = time.time() - t0
+    return result
+
+
+def sling_batch(acqs, workers=DEFAULT_WORKERS, verify_mode="stream",
+                connections=download.DEFAULT_CONNECTIONS,
+                chunk_size=download.DEFAULT_CHUNK_SIZE, check_exists=False):
+    """Sling acquisitions concurrently and return per acquisition results.
+       Connections per source host are bounded by HOST_LIMITS in
+       settings.json, shared by all acquisitions of the batch."""
+
+    results = []
+    if check_exists:
+        # skip acquisitions already in the repository unless forced
+        is_here = exists_many([get_localize_url(acq["repo_url"]) for acq in acqs])
+        todo = []
+        for acq in acqs:
+            if is_here[get_localize_url(acq["repo_url"])] and \
+                    not acq.get("force", False) and not acq.get("force_extract", False):
+                logging.info("Skipping {}: {} exists.".format(
+                    acq["prod_name"], acq["repo_url"]))
+                results.append({
+                    "prod_name": acq["prod_name"],
+                    "download_url": acq["download_url"],
+                    "status": "skipped",
+                })
+            else:
+                todo.append(acq)
+        acqs = todo
+
+    scheduler = get_scheduler(get_settings())
+    logging.info("Slinging {} acquisitions with {} workers (host limits: {}).".format(
+        len(acqs), workers, scheduler.config))
+    with ThreadPoolExecutor(max_workers=workers,
+                            thread_name_prefix="sling") as executor:
+        results.extend(executor.map(
+            lambda acq: sling_one(acq, verify_mode, connections, chunk_size),
+            acqs))
+    failed = [r for r in results if r["status"] == "failed"]
+    increment_pge_metrics("sling_batch", {
+        "succeeded": len([r for r in results if r["status"] == "success"]),
+        "skipped": len([r for r in results if r["status"] == "skipped"]),
+        "failed": len(failed),
+    })
+    flush_spans()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--context_file", help="job context with " +
+                        "acquisitions to sling", default="_context.json")
+    parser.add_argument("--workers", help="number of acquisitions slung " +
+                        "concurrently", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--verify_mode", help="archive verification mode",
+                        choices=VERIFY_MODES, default="stream")
+    parser.add_argument("--check_exists", help="skip acquisitions whose " +
+                        "repo_url already exists unless forced",
+                        action='store_true')
+    parser.add_argument("--connections", help="number of concurrent " +
+                        "connections per HTTP/HTTPS download", type=int,
+                        default=download.DEFAULT_CONNECTIONS)
+    parser.add_argument("--chunk_size", help="size in bytes of each " +
+                        "byte range of a parallel download", type=int,
+                        default=download.DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+    with open(args.context_file) as f:
+        ctx = json.load(f)
+    acqs = ctx["acquisitions"]
+    for name, convert in CONTEXT_OPTIONS.items():
+        if ctx.get(name) not in (None, ""):
+            setattr(args, name, convert(ctx[name]))
+    if args.verify_mode not in VERIFY_MODES:
+        parser.error("invalid verify_mode in context: {}".format(args.verify_mode))
+
+    try:
+        results = sling_batch(acqs, args.workers, args.verify_mode,
+                              args.connections, args.chunk_size,
+                              args.check_exists)
+        with open(RESULTS_FILE, 'w') as f:
+            json.dump(results, f, indent=2)
+        failed = [r for r in results if r["status"] == "failed"]
+        for r in failed:
+            logging.warning("{} failed: {}".format(r["prod_name"], r["error"]))
+        logging.info("Slung {} of {} acquisitions ({} failed).".format(
+            len([r for r in results if r["status"] == "success"]),
+            len(results), len(failed)))
+        if results and len(failed) == len(results):
+            raise RuntimeError("Failed to sling all {} acquisitions.".format(
+                len(results)))
+    except Exception as e:
+        with open('_alt_error.txt', 'a') as f:
+            f.write("%s\n" % str(e))
+        with open('_alt_traceback.txt', 'a') as f:
+            f.write("%s\n" % traceback.format_exc())
+        sys.exit(1)
@@ -0,0 +1,173 @@
+"""
+In-memory spatial matching of GeoJSON footprints, used to match
+acquisitions against AOIs without sending a geo_shape filter per AOI to
+ES.
+
+Shapes are indexed by bounding box in a regular lon/lat grid; candidates
+sharing a grid cell are refined by bounding box and then by exact polygon
+intersection. Polygon, MultiPolygon and envelope shapes are supported.
+Coordinates are treated as planar, so shapes spanning more than 180
+degrees of longitude, which cross the antimeridian (e.g. from 170 to
+-170), are rejected like unsupported shape types.
+"""
+
+import math
+
+
+# default size of grid cells in degrees
+DEFAULT_CELL_SIZE = 5.
+
+# widest longitude span of a shape taken as not crossing the antimeridian
+MAX_LON_SPAN = 180.
+
+
+def polygons(shape):
+    """Return list of polygons of shape, each a list of rings of (lon, lat)
+       points with the exterior ring first."""
+
+    shape_type = shape.get('type', '').lower()
+    coords = shape['coordinates']
+    if shape_type == "polygon":
+        polys = [coords]
+    elif shape_type == "multipolygon":
+        polys = coords
+    elif shape_type == "envelope":
+        (min_lon, max_lat), (max_lon, min_lat) = coords
+        polys = [[[[min_lon, max_lat], [max_lon, max_lat], [max_lon, min_lat],
+                   [min_lon, min_lat], [min_lon, max_lat]]]]
+    else:
+        raise NotImplementedError(
+            "Unsupported shape type for local matching: {}".format(shape.get('type')))
+    polys = [[[(float(p[0]), float(p[1])) for p in ring] for ring in poly]
+             for poly in polys]
+    box = bbox(polys)
+    if box[2] - box[0] > MAX_LON_SPAN:
+        raise NotImplementedError(
+            "Shape crossing the antimeridian unsupported for local matching: " +
+            "longitudes {} to {}".format(box[0], box[2]))
+    return polys
+
+
+def bbox(polys):
+    """Return (min_lon, min_lat, max_lon, max_lat) of polygons."""
+
+    lons = [p[0] for poly in polys for p in poly[0]]
+    lats = [p[1] for poly in polys for p in poly[0]]
+    return min(lons), min(lats), max(lons), max(lats)
+
+
+def bbox_intersects(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def _orient(a, b, c):
+    return (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+
+
+def _on_segment(a, b, c):
+    return (min(a[0], b[0]) <= c[0] <= max(a[0], b[0]) and
+            min(a[1], b[1]) <= c[1] <= max(a[1], b[1]))
+
+
+def segments_intersect(p1, p2, q1, q2):
+    """Return True if segments p1-p2 and q1-q2 touch or cross."""
+
+    d1 = _orient(q1, q2, p1)
+    d2 = _orient(q1, q2, p2)
+    d3 = _orient(p1, p2, q1)
+    d4 = _orient(p1, p2, q2)
+    if ((d1 > 0 > d2) or (d1 < 0 < d2)) and ((d3 > 0 > d4) or (d3 < 0 < d4)):
+        return True
+    return ((d1 == 0 and _on_segment(q1, q2, p1)) or
+            (d2 == 0 and _on_segment(q1, q2, p2)) or
+            (d3 == 0 and _on_segment(p1, p2, q1)) or
+            (d4 == 0 and _on_segment(p1, p2, q2)))
+
+
+def _in_ring(pt, ring):
+    """Even-odd test of point in ring."""
+
+    x, y = pt
+    inside = False
+    j = len(ring) - 1
+    for i in range(len(ring)):
+        xi, yi = ring[i]
+        xj, yj = ring[j]
+        if (yi > y) != (yj > y) and x < (xj - xi) * (y - yi) / (yj - yi) + xi:
+            inside = not inside
+        j = i
+    return inside
+
+
+def point_in_polygon(pt, poly):
+    """Return True if point is inside exterior ring and outside holes."""
+
+    if not _in_ring(pt, poly[0]):
+        return False
+    return not any(_in_ring(pt, hole) for hole in poly[1:])
+
+
+def _edges(poly):
+    for ring in poly:
+        for i in range(len(ring) - 1):
+            yield ring[i], ring[i + 1]
+
+
+def polygon_intersects(a, b):
+    """Return True if polygons a and b share any point."""
+
+    b_edges = list(_edges(b))
+    for p1, p2 in _edges(a):
+        for q1, q2 in b_edges:
+            if segments_intersect(p1, p2, q1, q2):
+                return True
+    # no boundaries cross, so either one polygon contains the other or
+    # they are disjoint
+    return point_in_polygon(a[0][0], b) or point_in_polygon(b[0][0], a)
+
+
+def shapes_intersect(a, b):
+    """Return True if any polygon of a intersects any polygon of b."""
+
+    return any(polygon_intersects(pa, pb) for pa in a for pb in b)
+
+
+class GridIndex(object):
+    """Index of shapes by bounding box over a regular lon/lat grid."""
+
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE):
+        self.cell_size = float(cell_size)
+        self.items = []
+        self.cells = {}
+
+    def _cells(self, box):
+        c = self.cell_size
+        for i in range(int(math.floor(box[0] / c)), int(math.floor(box[2] / c)) + 1):
+            for j in range(int(math.floor(box[1] / c)), int(math.floor(box[3] / c)) + 1):
+                yield i, j
+
+    def insert(self, key, shape):
+        """Index shape under key."""
+
+        polys = polygons(shape)
+        box = bbox(polys)
+        n = len(self.items)
+        self.items.append((key, polys, box))
+        for cell in self._cells(box):
+            self.cells.setdefault(cell, []).append(n)
+
+    def query(self, shape):
+        """Return keys of indexed shapes intersecting shape in insertion
+           order."""
+
+        polys = polygons(shape)
+        box = bbox(polys)
+        candidates = set()
+        for cell in self._cells(box):
+            candidates.update(self.cells.get(cell, ()))
+        matched = []
+        for n in sorted(candidates):
+            key, item_polys, item_box = self.items[n]
+            if bbox_intersects(box, item_box) and shapes_intersect(polys, item_polys):
+                matched.append(key)
+        return matched
@@ -0,0 +1,115 @@
+"""
+Zero-copy staging of localized files into product directories.
+
+A file is moved by rename when source and destination are on the same
+mount, otherwise by hard link or by reflink (FICLONE, e.g. on XFS or
+btrfs) and only byte-copied as a last resort. The strategy used for each
+file is recorded in the "staging" section of pge_metrics.json.
+"""
+
+import os
+import time
+import errno
+import fcntl
+import shutil
+import logging
+
+from metrics import append_pge_metrics, PGE_METRICS_FILE
+
+
+# ioctl to share the extents of one file with another (linux/fs.h)
+FICLONE = 0x40049409
+
+# errors of link and clone calls that mean the strategy is not available
+UNSUPPORTED_ERRNOS = (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EOPNOTSUPP,
+                      errno.ENOTTY, errno.EINVAL, errno.ENOSYS)
+
+
+def reflink(src, dst):
+    """Clone src to a new file dst sharing its data blocks."""
+
+    with open(src, 'rb') as s, open(dst, 'xb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            os.unlink(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def link(src, dst):
+    """Hard link, reflink or copy src to dst; return the strategy used."""
+
+    for strategy, func in (("hardlink", os.link), ("reflink", reflink)):
+        try:
+            func(src, dst)
+            return strategy
+        except OSError as e:
+            if e.errno not in UNSUPPORTED_ERRNOS:
+                raise
+            logging.debug("Cannot {} {} to {}: {}".format(strategy, src, dst, e))
+    shutil.copy2(src, dst)
+    return "copy"
+
+
+def _stage_tree(src, dst, move):
+    """Stage directory tree file by file; return the strategies used."""
+
+    strategies = set()
+    os.makedirs(dst)
+    shutil.copystat(src, dst)
+    for name in os.listdir(src):
+        s = os.path.join(src, name)
+        d = os.path.join(dst, name)
+        if os.path.isdir(s) and not os.path.islink(s):
+            strategies.update(_stage_tree(s, d, move))
+        elif os.path.islink(s):
+            os.symlink(os.readlink(s), d)
+        else:
+            strategies.add(link(s, d))
+    if move:
+        shutil.rmtree(src)
+    return strategies
+
+
+def _size(path):
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, f))
+               for root, dirs, files in os.walk(path) for f in files)
+
+
+def stage(src, dst, move=True, measure=True, output=PGE_METRICS_FILE):
+    """Stage file or directory src at dst, removing src if move is set, and
+       return the strategy used: rename, hardlink, reflink or copy."""
+
+    t0 = time.time()
+    strategy = None
+    if move:
+        try:
+            os.rename(src, dst)
+            strategy = "rename"
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+    if strategy is None:
+        if os.path.isdir(src):
+            # worst strategy used for any file of the tree
+            strategies = _stage_tree(src, dst, move)
+            strategy = "copy" if "copy" in strategies else \
+                "reflink" if "reflink" in strategies else "hardlink"
+        else:
+            strategy = link(src, dst)
+            if move:
+                os.unlink(src)
+    duration = time.time() - t0
+    logging.info("Staged {} to {} by {}.".format(src, dst, strategy))
+    if measure:
+        append_pge_metrics("staging", {
+            "src": src,
+            "path": dst,
+            "strategy": strategy,
+            "disk_usage": _size(dst),
+            "duration": duration,
+        }, output)
+    return strategy
@@ -0,0 +1,56 @@
+import os
+import sys
+
+import pytest
+
+# keep test runs from writing spans to pge_metrics.json in the cwd
+os.environ.setdefault("PGE_METRICS_SPANS", "0")
+
+BASE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_PATH = os.path.join(BASE_PATH, "benchmarks")
+
+sys.path.insert(0, BASE_PATH)
+
+
+@pytest.fixture
+def bench_path(monkeypatch):
+    """Put the benchmark stand-ins on sys.path and install the offline
+       HySDS, osaka and boto shims for packages that are not installed."""
+
+    monkeypatch.syspath_prepend(BENCH_PATH)
+    import _shims
+    _shims.install()
+    return BENCH_PATH
+
+
+@pytest.fixture
+def grq(bench_path, tmp_path, monkeypatch):
+    """Serve synthetic acquisitions, AOIs and SLC datasets from a stub ES,
+       with the ASF datapool answered by a local file server, and point
+       util at them. Yields the stub ES."""
+
+    import json
+    import util
+    from hysds.celery import app
+    from stub_es import StubES
+    from file_server import FileServer
+    from synthetic import make_acquisitions, make_aois, ACQ_INDEX, AOI_INDEX, \
+        SLC_INDEX
+
+    acqs = make_acquisitions(600, extra_metadata=4)
+    indices = {
+        ACQ_INDEX: acqs,
+        AOI_INDEX: make_aois(12, size=40.),
+        SLC_INDEX: [{"id": a['metadata']['identifier'], "dataset": "S1-IW_SLC"}
+                    for a in acqs[::5]],
+    }
+    with open(os.path.join(BASE_PATH, "settings.json.tmpl")) as f:
+        settings = json.load(f)
+    with StubES(indices) as es, FileServer(str(tmp_path), asf_available=lambda
+                                           identifier: int(identifier[-4:], 16) % 3) as fs:
+        monkeypatch.setattr(app.conf, "GRQ_ES_URL", es.url)
+        monkeypatch.setattr("resolver.ASF_SLC_URL", fs.asf_slc_url)
+        monkeypatch.setattr("settings._settings", settings)
+        monkeypatch.setattr(util, "_slc_resolver", None)
+        monkeypatch.chdir(tmp_path)
+        yield es
@@ -0,0 +1,29 @@
+import json
+
+import util
+
+
+# fields fetched before the payload was trimmed to ACQ_FIELDS
+FULL_FIELDS = ["id", "dataset_type", "dataset", "creation_timestamp", "metadata"]
+
+
+def resolve(ctx, **params):
+    ctx = dict(ctx, **params)
+    with open("_context.json", 'w') as f:
+        json.dump(ctx, f)
+    util._slc_resolver = None
+    return util.resolve_aoi_acqs("_context.json")
+
+
+def test_acq_fields_cover_resolution(grq, monkeypatch):
+    from synthetic import window, PLATFORM
+
+    starttime, endtime = window()
+    ctx = {"starttime": starttime, "endtime": endtime, "platform": PLATFORM,
+           "project": "grfn", "spyddder_extract_version": "v1.0",
+           "resolve_pipeline": "serial", "es_page_size": "50"}
+    args = resolve(ctx)
+    assert len(args[0]) > 100
+
+    monkeypatch.setattr(util, "ACQ_FIELDS", FULL_FIELDS)
+    assert resolve(ctx) == args
@@ -0,0 +1,103 @@
+import util
+from watermarks import AoiWatermarks, format_timestamp
+
+
+PLATFORM = "Sentinel-1A"
+
+T0 = 1546300800  # 2019-01-01T00:00:00Z
+
+SQUARE = {"type": "polygon",
+          "coordinates": [[[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]]}
+
+
+def test_watermarked_aois_skip_acqs_without_creation_time(tmp_path, monkeypatch):
+    aois = [{"id": "marked", "location": SQUARE},
+            {"id": "unmarked", "location": SQUARE}]
+    acqs = [{"id": "old", "creation_timestamp": format_timestamp(T0 - 3600)},
+            {"id": "new", "creation_timestamp": format_timestamp(T0 + 3600)},
+            {"id": "undated"}]
+    monkeypatch.setattr(util, "query_aois", lambda starttime, endtime: aois)
+    monkeypatch.setattr(util, "iter_query_es_sliced", lambda *args, **kwargs: (
+        {"fields": {"partial": [dict(acq, location=SQUARE)]}} for acq in acqs))
+
+    watermarks = AoiWatermarks(str(tmp_path / "aoi_watermarks.json"), PLATFORM,
+                               overlap=0)
+    watermarks._marks = {"marked/%s" % PLATFORM: {"time": T0, "ids": {}}}
+    matched = {acq['id']: [aoi['id'] for aoi in matched_aois]
+               for acq, matched_aois in util.iter_aoi_acquisitions_local(
+                   "2018-12-01T00:00:00", "2019-02-01T00:00:00", PLATFORM,
+                   watermarks=watermarks)}
+    assert matched == {"old": ["unmarked"],
+                       "new": ["marked", "unmarked"],
+                       "undated": ["unmarked"]}
+
+
+def test_unsupported_aoi_shapes_matched_in_es(grq, caplog):
+    from synthetic import window, AOI_INDEX, ACQ_INDEX, PLATFORM
+
+    acq = grq.indices[ACQ_INDEX][0]
+    lon, lat = acq['location']['coordinates'][0][2]
+    aoi = grq.indices[AOI_INDEX][0]
+    grq.indices[AOI_INDEX] += [
+        dict(aoi, id="AOI_circle", location={
+            "type": "circle", "coordinates": [lon - 1, lat - 1], "radius": "10km"},
+            metadata={"priority": 5, "user_tags": []}),
+        dict(aoi, id="AOI_line", location={
+            "type": "linestring", "coordinates": [[lon - 2, lat - 1], [lon, lat]]})]
+
+    starttime, endtime = window()
+    expected = util.query_aoi_acquisitions(starttime, endtime, PLATFORM, match="es")
+    assert expected[acq['id']]['aoi'] == "AOI_circle"
+    assert util.query_aoi_acquisitions(starttime, endtime, PLATFORM,
+                                       match="local") == expected
+    assert "Matching AOI_circle in ES" in caplog.text
+    assert "Matching AOI_line in ES" in caplog.text
+
+
+def test_unsupported_acq_shapes_matched_in_es(grq, caplog):
+    from synthetic import window, AOI_INDEX, ACQ_INDEX, PLATFORM
+
+    starttime, endtime = window()
+    before = util.query_aoi_acquisitions(starttime, endtime, PLATFORM, match="es")
+    aois = {aoi['id']: aoi for aoi in grq.indices[AOI_INDEX]}
+    acqs = {acq['id']: acq for acq in grq.indices[ACQ_INDEX]}
+    point_id, line_id = sorted(before)[:2]
+    lons, lats = zip(*aois[before[point_id]['aoi']]['location']['coordinates'][0])
+    center = [(min(lons) + max(lons)) / 2, (min(lats) + max(lats)) / 2]
+    acqs[point_id]['location'] = {"type": "point", "coordinates": center}
+    acqs[line_id]['location'] = {"type": "linestring", "coordinates": [
+        [center[0] - 1, center[1]], [center[0] + 1, center[1]]]}
+
+    expected = util.query_aoi_acquisitions(starttime, endtime, PLATFORM, match="es")
+    assert point_id in expected and line_id in expected
+    for slices in (1, 3):
+        assert util.query_aoi_acquisitions(starttime, endtime, PLATFORM, slices,
+                                           match="local") == expected
+    assert "Matching {} in ES".format(point_id) in caplog.text
+    assert "Matching {} in ES".format(line_id) in caplog.text
+
+
+def test_dateline_shapes_matched_in_es(grq, caplog):
+    from synthetic import window, AOI_INDEX, ACQ_INDEX, PLATFORM
+
+    acqs = grq.indices[ACQ_INDEX]
+    aoi = grq.indices[AOI_INDEX][0]
+    # footprint from 170 to -170 across the antimeridian, which a planar
+    # bounding box would stretch over the square at lon 0 to 10
+    acqs[0]['location'] = {"type": "polygon", "coordinates": [[
+        [170, 0], [-170, 0], [-170, 10], [170, 10], [170, 0]]]}
+    grq.indices[AOI_INDEX] += [
+        dict(aoi, id="AOI_square", location={"type": "polygon", "coordinates": [[
+            [0, 0], [10, 0], [10, 10], [0, 10], [0, 0]]]},
+            metadata={"priority": 10, "user_tags": []}),
+        dict(aoi, id="AOI_dateline", location={"type": "polygon", "coordinates": [[
+            [175, 5], [-175, 5], [-175, 8], [175, 8], [175, 5]]]},
+            metadata={"priority": 9, "user_tags": []})]
+
+    starttime, endtime = window()
+    expected = util.query_aoi_acquisitions(starttime, endtime, PLATFORM, match="es")
+    assert expected[acqs[0]['id']]['aoi'] == "AOI_dateline"
+    assert util.query_aoi_acquisitions(starttime, endtime, PLATFORM,
+                                       match="local") == expected
+    assert "Matching {} in ES".format(acqs[0]['id']) in caplog.text
+    assert "Matching AOI_dateline in ES" in caplog.text
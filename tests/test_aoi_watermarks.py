@@ -0,0 +1,162 @@
+import json
+
+import pytest
+
+import util
+from watermarks import AoiWatermarks, format_timestamp, parse_timestamp
+
+
+PLATFORM = "Sentinel-1A"
+
+T0 = 1546300800  # 2019-01-01T00:00:00Z
+
+
+def acq(id, t, identifier=None):
+    return {"id": id, "identifier": identifier or id,
+            "dataset": "acquisition-S1-IW_SLC",
+            "creation_timestamp": format_timestamp(t)}
+
+
+@pytest.fixture
+def watermark_file(tmp_path):
+    return str(tmp_path / "aoi_watermarks.json")
+
+
+def test_advance_to_latest_seen(watermark_file):
+    w = AoiWatermarks(watermark_file, PLATFORM, overlap=60)
+    assert w.since("aoi") is None
+    for a in [acq("a", T0), acq("b", T0 + 100), acq("c", T0 + 200)]:
+        assert w.is_new("aoi", a)
+    w.save()
+
+    w = AoiWatermarks(watermark_file, PLATFORM, overlap=60)
+    assert w.since("aoi") == T0 + 200 - 60
+    # only ids within the overlap of the watermark are kept
+    with open(watermark_file) as f:
+        marks = json.load(f)
+    assert marks["aoi/%s" % PLATFORM]["ids"] == {"c": T0 + 200}
+    assert not w.is_new("aoi", acq("c", T0 + 200))
+    assert w.is_new("aoi", acq("d", T0 + 190))
+
+
+def test_excluded_hold_back_watermark(watermark_file):
+    w = AoiWatermarks(watermark_file, PLATFORM, overlap=60)
+    for a in [acq("a", T0), acq("b", T0 + 100), acq("c", T0 + 200)]:
+        w.is_new("aoi", a)
+    w.save(exclude=["b"])
+
+    w = AoiWatermarks(watermark_file, PLATFORM, overlap=60)
+    assert w.since("aoi") == T0 + 99 - 60
+    assert w.is_new("aoi", acq("b", T0 + 100))
+    assert not w.is_new("aoi", acq("c", T0 + 200))
+
+
+def test_load_ids_list(watermark_file):
+    with open(watermark_file, 'w') as f:
+        json.dump({"aoi/%s" % PLATFORM: {"time": T0, "ids": ["a", "b"]}}, f)
+
+    w = AoiWatermarks(watermark_file, PLATFORM, overlap=60)
+    assert w.since("aoi") == T0 - 60
+    assert not w.is_new("aoi", acq("a", T0))
+    w.is_new("aoi", acq("c", T0 + 10))
+    w.save()
+    with open(watermark_file) as f:
+        marks = json.load(f)
+    assert marks["aoi/%s" % PLATFORM] == {
+        "time": T0 + 10, "ids": {"a": T0, "b": T0, "c": T0 + 10}}
+
+
+def test_commit_holds_back_missing_datasets(watermark_file, tmp_path, monkeypatch):
+    monkeypatch.setattr(util, "get_settings", lambda: {
+        "ACQ_TO_DSET_MAP": {"acquisition-S1-IW_SLC": "S1-IW_SLC"}})
+    monkeypatch.setattr(util, "filter_existing",
+                        lambda acqs: {"A", "C"} & {a['identifier'] for a in acqs})
+
+    acqs = {a['id']: a for a in [acq("a", T0, "A"), acq("b", T0 + 100, "B"),
+                                 acq("c", T0 + 200, "C")]}
+    w = AoiWatermarks(watermark_file, PLATFORM, overlap=60)
+    for a in acqs.values():
+        w.is_new("aoi", a)
+    pending_file = str(tmp_path / util.PENDING_WATERMARKS_FILE)
+    w.save_pending(pending_file, acq_info=acqs)
+    assert w.since("aoi") is None
+
+    util.commit_aoi_watermarks(pending_file)
+    w = AoiWatermarks(watermark_file, PLATFORM, overlap=60)
+    assert w.since("aoi") == T0 + 99 - 60
+    assert w.is_new("aoi", acqs["b"])
+    assert not w.is_new("aoi", acqs["c"])
+
+
+def test_failed_acquisition_stops_holding_back(watermark_file, tmp_path, monkeypatch):
+    monkeypatch.setattr(util, "get_settings", lambda: {
+        "ACQ_TO_DSET_MAP": {"acquisition-S1-IW_SLC": "S1-IW_SLC"}})
+    monkeypatch.setattr(util, "filter_existing",
+                        lambda acqs: {a['identifier'] for a in acqs} - {"B"})
+    pending_file = str(tmp_path / util.PENDING_WATERMARKS_FILE)
+
+    def run(acqs):
+        w = AoiWatermarks(watermark_file, PLATFORM, overlap=60, max_holds=3)
+        since = w.since("aoi")
+        acqs = {a['id']: a for a in acqs if since is None or
+                parse_timestamp(a['creation_timestamp']) >= since}
+        for a in acqs.values():
+            w.is_new("aoi", a)
+        w.save_pending(pending_file, acq_info=acqs)
+        util.commit_aoi_watermarks(pending_file)
+        with open(watermark_file) as f:
+            return json.load(f)["aoi/%s" % PLATFORM]
+
+    # b never gets a dataset and holds the watermark back while later
+    # acquisitions keep arriving
+    acqs = [acq("a", T0, "A"), acq("b", T0 + 100, "B"), acq("c", T0 + 200, "C")]
+    mark = run(acqs)
+    assert mark["time"] == T0 + 99
+    assert mark["held"] == {"b": {"time": T0 + 100, "holds": 1}}
+
+    acqs.append(acq("d", T0 + 1000, "D"))
+    mark = run(acqs)
+    assert mark["time"] == T0 + 99
+    assert mark["held"]["b"]["holds"] == 2
+    assert set(mark["ids"]) == {"c", "d"}
+
+    # the third hold gives up on b, which no longer pins the watermark
+    acqs.append(acq("e", T0 + 2000, "E"))
+    mark = run(acqs)
+    assert mark["time"] == T0 + 2000
+    assert "held" not in mark
+    assert mark["failed"] == {"b": T0 + 100}
+    assert set(mark["ids"]) == {"e"}
+
+    acqs.append(acq("f", T0 + 3000, "F"))
+    mark = run(acqs)
+    assert mark["time"] == T0 + 3000
+    assert mark["failed"] == {"b": T0 + 100}
+    assert set(mark["ids"]) == {"f"}
+
+
+def test_deferred_acquisition_never_fails(watermark_file, tmp_path, monkeypatch):
+    monkeypatch.setattr(util, "get_settings", lambda: {
+        "ACQ_TO_DSET_MAP": {"acquisition-S1-IW_SLC": "S1-IW_SLC"}})
+    monkeypatch.setattr(util, "filter_existing",
+                        lambda acqs: {a['identifier'] for a in acqs})
+    pending_file = str(tmp_path / util.PENDING_WATERMARKS_FILE)
+
+    # b is deferred by QUEUE_CAPS on every run, so it never gets a dataset
+    acqs = [acq("a", T0, "A"), acq("b", T0 + 100, "B"), acq("c", T0 + 200, "C")]
+    for run in range(6):
+        w = AoiWatermarks(watermark_file, PLATFORM, overlap=60, max_holds=3)
+        since = w.since("aoi")
+        offered = {a['id']: a for a in acqs if (since is None or
+                   parse_timestamp(a['creation_timestamp']) >= since) and
+                   w.is_new("aoi", a)}
+        assert "b" in offered
+        w.save_pending(pending_file, acq_info=offered, deferred=["b"])
+        util.commit_aoi_watermarks(pending_file)
+        acqs.append(acq("n%d" % run, T0 + 1000 * (run + 1), "N%d" % run))
+
+    with open(watermark_file) as f:
+        mark = json.load(f)["aoi/%s" % PLATFORM]
+    assert mark["time"] == T0 + 99
+    assert "held" not in mark
+    assert "failed" not in mark
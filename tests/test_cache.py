@@ -0,0 +1,126 @@
+import hashlib
+import os
+import time
+
+import pytest
+
+import cache
+from cache import DownloadCache
+
+
+URL = "https://datapool.asf.alaska.edu/SLC/SA/S1A.zip"
+
+
+@pytest.fixture(autouse=True)
+def job_dir(tmp_path, monkeypatch):
+    # staging records its strategies in ./pge_metrics.json
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def download(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+    return {"sha256": hashlib.sha256(data).hexdigest(),
+            "md5": hashlib.md5(data).hexdigest()}
+
+
+def test_miss_then_hit(tmp_path):
+    c = DownloadCache(str(tmp_path / "cache"))
+    assert c.lookup(URL, "S1A.zip") is None
+    checksums = download("S1A.zip", b"slc")
+    c.insert(URL, "S1A.zip", checksums)
+    os.unlink("S1A.zip")
+
+    assert c.lookup(URL, "S1A.zip") == checksums
+    with open("S1A.zip", 'rb') as f:
+        assert f.read() == b"slc"
+    assert c.stats["hits"] == 1
+    assert c.stats["misses"] == 1
+    assert c.stats["bytes_saved"] == 3
+    assert os.listdir(c.hold_dir) == []
+
+
+def test_hit_replaces_partial_download(tmp_path):
+    c = DownloadCache(str(tmp_path / "cache"))
+    checksums = download("S1A.zip", b"slc")
+    c.insert(URL, "S1A.zip", checksums)
+
+    # left behind by an interrupted attempt
+    os.unlink("S1A.zip")
+    with open("S1A.zip", 'wb') as f:
+        f.write(b"sl")
+    assert c.lookup(URL, "S1A.zip") == checksums
+    with open("S1A.zip", 'rb') as f:
+        assert f.read() == b"slc"
+    assert sorted(os.listdir(".")) == ["S1A.zip", "cache", "pge_metrics.json",
+                                       "pge_metrics.json.lock"]
+
+
+def test_failed_link_is_not_a_hit(tmp_path, monkeypatch):
+    c = DownloadCache(str(tmp_path / "cache"))
+    c.insert(URL, "S1A.zip", download("S1A.zip", b"slc"))
+
+    def fail(src, dst):
+        raise OSError("disk full")
+    monkeypatch.setattr(cache, "link_or_copy", fail)
+    with pytest.raises(OSError):
+        c.lookup(URL, "S1A.zip")
+    assert c.stats["hits"] == 0
+    assert c.stats["bytes_saved"] == 0
+    assert os.listdir(c.hold_dir) == []
+
+
+def test_stale_entry_is_a_miss(tmp_path):
+    c = DownloadCache(str(tmp_path / "cache"))
+    checksums = download("S1A.zip", b"slc")
+    c.insert(URL, "S1A.zip", checksums)
+    os.unlink(c.blob_path(checksums["sha256"]))
+    assert c.lookup(URL, "S1A.zip") is None
+    assert c.stats["misses"] == 1
+
+
+def test_evict_least_recently_used(tmp_path):
+    c = DownloadCache(str(tmp_path / "cache"), max_bytes=8)
+    urls = ["%s.%d" % (URL, i) for i in range(3)]
+    digests = []
+    for i, url in enumerate(urls):
+        checksums = download("f%d" % i, b"%d" % i * 4)
+        digests.append(checksums["sha256"])
+        c.insert(url, "f%d" % i, checksums)
+        if i == 1:
+            # the first blob is used again and the second becomes oldest
+            c.lookup(urls[0], "f0")
+    assert c.stats["evictions"] == 1
+    assert c.stats["bytes_evicted"] == 4
+    assert c.lookup(urls[1], "f1") is None
+    assert not os.path.exists(c.blob_path(digests[1]))
+    assert c.lookup(urls[0], "f0")["sha256"] == digests[0]
+    assert c.lookup(urls[2], "f2")["sha256"] == digests[2]
+
+
+def test_held_blob_survives_eviction(tmp_path):
+    c = DownloadCache(str(tmp_path / "cache"), max_bytes=4)
+    checksums = download("f0", b"0000")
+    c.insert(URL, "f0", checksums)
+
+    # a hold taken by a lookup in progress in another job
+    hold_path = "%s.%d" % (c._private_path(c.hold_dir, checksums["sha256"]),
+                           time.time())
+    os.link(c.blob_path(checksums["sha256"]), hold_path)
+    c.insert(URL + ".1", "f1", download("f1", b"1111"))
+
+    assert not os.path.exists(c.blob_path(checksums["sha256"]))
+    with open(hold_path, 'rb') as f:
+        assert f.read() == b"0000"
+
+
+def test_remove_stale_holds(tmp_path):
+    c = DownloadCache(str(tmp_path / "cache"))
+    now = time.time()
+    stale = "%s.1.1.%d" % ("a" * 64, now - cache.HOLD_MAX_AGE - 60)
+    fresh = "%s.1.1.%d" % ("b" * 64, now)
+    for name in (stale, fresh):
+        open(os.path.join(c.hold_dir, name), 'w').close()
+    c.insert(URL, "S1A.zip", download("S1A.zip", b"slc"))
+    assert os.listdir(c.hold_dir) == [fresh]
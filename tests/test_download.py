@@ -0,0 +1,101 @@
+import json
+import os
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import download
+from download import RangedDownload, RangesNotSupported
+
+
+CHUNK_SIZE = 64 * 1024
+
+SIZE = 10 * CHUNK_SIZE + 123
+
+
+@pytest.fixture
+def source(bench_path, tmp_path, monkeypatch):
+    """Serve a file with range support; yield its url and content."""
+
+    from file_server import FileServer
+
+    data = os.urandom(SIZE)
+    os.makedirs(str(tmp_path / "files"))
+    with open(str(tmp_path / "files" / "S1A.zip"), 'wb') as f:
+        f.write(data)
+    monkeypatch.chdir(tmp_path)
+    with FileServer(str(tmp_path / "files")) as fs:
+        yield fs, fs.url + "/S1A.zip", data
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_download(source):
+    fs, url, data = source
+    assert download.get(url, "S1A.zip", 3, CHUNK_SIZE) == SIZE
+    assert read("S1A.zip") == data
+    assert not os.path.exists(download.part_file("S1A.zip"))
+    assert not os.path.exists(download.state_file("S1A.zip"))
+
+
+def test_resume_fetches_missing_ranges(source, monkeypatch):
+    fs, url, data = source
+
+    # interrupt the download at the fourth range
+    fetch_range = RangedDownload._fetch_range
+
+    def fail(self, fd, index, start, end):
+        if index == 3:
+            raise IOError("connection reset")
+        return fetch_range(self, fd, index, start, end)
+    monkeypatch.setattr(RangedDownload, "_fetch_range", fail)
+    with pytest.raises(IOError):
+        download.get(url, "S1A.zip", 1, CHUNK_SIZE)
+    with open(download.state_file("S1A.zip")) as f:
+        done = json.load(f)["done"]
+    # ranges already running when range 3 failed may have completed
+    assert done[:3] == [0, 1, 2] and 3 not in done
+    missing = SIZE - len(done) * CHUNK_SIZE
+
+    monkeypatch.setattr(RangedDownload, "_fetch_range", fetch_range)
+    sent = fs.bytes_sent
+    assert download.get(url, "S1A.zip", 2, CHUNK_SIZE) == missing
+    # the missing ranges and the one byte range probe
+    assert fs.bytes_sent - sent == missing + 1
+    assert read("S1A.zip") == data
+
+
+def test_mismatched_state_restarts(source):
+    fs, url, data = source
+    with open(download.part_file("S1A.zip"), 'wb') as f:
+        f.truncate(SIZE)
+    with open(download.state_file("S1A.zip"), 'w') as f:
+        json.dump({"url": url, "size": SIZE, "chunk_size": CHUNK_SIZE * 2,
+                   "done": [0, 1, 2]}, f)
+    assert download.get(url, "S1A.zip", 2, CHUNK_SIZE) == SIZE
+    assert read("S1A.zip") == data
+
+
+def test_ranges_not_supported(tmp_path, monkeypatch):
+    with open(str(tmp_path / "S1A.zip"), 'wb') as f:
+        f.write(b"slc" * 100)
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("job")
+    open(os.path.join("job", download.part_file("S1A.zip")), 'w').close()
+    handler = partial(SimpleHTTPRequestHandler, directory=str(tmp_path))
+    handler.log_message = lambda *args: None
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = "http://127.0.0.1:%d/S1A.zip" % server.server_port
+        with pytest.raises(RangesNotSupported):
+            download.get(url, os.path.join("job", "S1A.zip"), 2, CHUNK_SIZE)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert os.listdir("job") == []
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import sys
+import types
+
+import util
+
+
+# job-spyddder-extract job spec params by destination
+EXTRACT_JOB_SPEC = {
+    "command": "/home/ops/verdi/ops/spyddder-man/extract.py",
+    "disk_usage": "50GB",
+    "params": [
+        {"name": "localize_url", "destination": "localize"},
+        {"name": "file", "destination": "positional"},
+        {"name": "prod_name", "destination": "positional"},
+        {"name": "prod_date", "destination": "positional"},
+        {"name": "aoi", "destination": "context"},
+    ],
+}
+
+
+def resolve_hysds_job(job_type=None, queue=None, priority=None, tags=None,
+                      params=None, job_name=None, payload_hash=None,
+                      enable_dedup=True, username=None):
+    """Job in the shape hysds_commons.job_utils.resolve_hysds_job() builds
+       from EXTRACT_JOB_SPEC."""
+
+    positional, localize = [], []
+    payload = {"_disk_usage": EXTRACT_JOB_SPEC["disk_usage"]}
+    for param in EXTRACT_JOB_SPEC["params"]:
+        value = params[param["name"]]
+        if param["destination"] == "positional":
+            positional.append(value)
+        elif param["destination"] == "localize":
+            localize.append({"url": value})
+        else:
+            payload[param["name"]] = value
+    payload["_command"] = " ".join([EXTRACT_JOB_SPEC["command"]] + positional)
+    payload["localize_urls"] = localize
+    job = {
+        "job_type": "job:%s" % job_type,
+        "job_queue": queue,
+        "priority": priority,
+        "container_mappings": {},
+        "soft_time_limit": 86400,
+        "time_limit": 86700,
+        "payload": payload,
+        "enable_dedup": enable_dedup,
+        "job_name": job_name,
+        "username": username,
+    }
+    if payload_hash is not None:
+        job["payload_hash"] = payload_hash
+    return job
+
+
+def install(monkeypatch, resolve):
+    job_utils = types.ModuleType("hysds_commons.job_utils")
+    job_utils.resolve_hysds_job = resolve
+    monkeypatch.setitem(sys.modules, "hysds_commons", types.ModuleType("hysds_commons"))
+    monkeypatch.setitem(sys.modules, "hysds_commons.job_utils", job_utils)
+    monkeypatch.setattr(util, "_extract_job_templates", {})
+
+
+def extract_args(n, queue="factotum-job_worker-asf_throttled"):
+    acqs = [("v1.0", queue, "https://datapool.asf.alaska.edu/SLC/S%d.zip" % i,
+             "S%d.zip" % i, "S%d" % i, "2019-01-%02d" % (i + 1), 5, "aoi_%d" % (i % 2))
+            for i in range(n)]
+    return tuple(list(arg) for arg in zip(*acqs))
+
+
+def build_jobs(args, templates_file):
+    return [util.extract_job(*acq, templates_file=templates_file,
+                             wuid="wuid", job_num=i)
+            for i, acq in enumerate(zip(*args))]
+
+
+def direct_jobs(args):
+    return [util.extract_job(*acq, wuid="wuid", job_num=i)
+            for i, acq in enumerate(zip(*args))]
+
+
+def test_stamped_jobs_match_resolved_jobs(tmp_path, monkeypatch):
+    calls = []
+
+    def resolve(*args, **kwargs):
+        calls.append(kwargs["params"])
+        return resolve_hysds_job(*args, **kwargs)
+
+    install(monkeypatch, resolve)
+    args = extract_args(20)
+    templates_file = str(tmp_path / util.EXTRACT_TEMPLATES_FILE)
+    util.save_extract_templates(util.resolve_extract_templates(args), templates_file)
+
+    # one template plus the first and last job of the key
+    assert len(calls) == 3
+    jobs = build_jobs(args, templates_file)
+    assert len(calls) == 3
+    assert jobs == direct_jobs(args)
+    assert jobs[3]["payload"]["_command"].endswith("S3.zip S3 2019-01-04")
+    assert jobs[3]["job_name"] == "job-spyddder-extract:v1.0-aoi_1-S3"
+
+
+def test_small_keys_resolved_per_job(tmp_path, monkeypatch):
+    calls = []
+
+    def resolve(*args, **kwargs):
+        calls.append(kwargs["params"])
+        return resolve_hysds_job(*args, **kwargs)
+
+    install(monkeypatch, resolve)
+    args = extract_args(util.EXTRACT_TEMPLATE_MIN_JOBS)
+    templates_file = str(tmp_path / util.EXTRACT_TEMPLATES_FILE)
+    util.save_extract_templates(util.resolve_extract_templates(args), templates_file)
+    assert calls == []
+    build_jobs(args, templates_file)
+    assert len(calls) == util.EXTRACT_TEMPLATE_MIN_JOBS
+
+
+def test_per_call_values_disable_template(tmp_path, monkeypatch):
+    def resolve(*args, **kwargs):
+        kwargs["payload_hash"] = hashlib.md5(json.dumps(
+            kwargs["params"], sort_keys=True).encode()).hexdigest()
+        return resolve_hysds_job(*args, **kwargs)
+
+    install(monkeypatch, resolve)
+    args = extract_args(10)
+    templates_file = str(tmp_path / util.EXTRACT_TEMPLATES_FILE)
+    templates = util.resolve_extract_templates(args)
+    assert templates == {}
+    util.save_extract_templates(templates, templates_file)
+    assert build_jobs(args, templates_file) == direct_jobs(args)
@@ -0,0 +1,100 @@
+import importlib.metadata
+import json
+import os
+import sys
+
+import pytest
+
+import extract
+
+
+PLUGIN = '''
+def extract(prod_path):
+    return {"prod_path": prod_path}
+
+
+def write_met(prod_path):
+    return None
+'''
+
+
+@pytest.fixture
+def plugin_module(tmp_path, monkeypatch):
+    with open(str(tmp_path / "spyddder_test_plugin.py"), 'w') as f:
+        f.write(PLUGIN)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(extract, "_extractors", {})
+    yield "spyddder_test_plugin"
+    sys.modules.pop("spyddder_test_plugin", None)
+
+
+class EntryPoints(list):
+    def select(self, group):
+        return [ep for ep in self if ep.group == group]
+
+
+def test_load_python_extractor(plugin_module):
+    func = extract.load_extractor("python:%s.extract" % plugin_module)
+    assert func("/data/S1A") == {"prod_path": "/data/S1A"}
+    assert extract.load_extractor("python:%s:extract" % plugin_module) is func
+    # cached by reference
+    assert extract._extractors["python:%s.extract" % plugin_module] is func
+
+
+def test_load_entry_point_extractor(plugin_module, monkeypatch):
+    eps = EntryPoints([
+        importlib.metadata.EntryPoint("s1", "%s:extract" % plugin_module,
+                                      extract.EXTRACTOR_GROUP),
+        importlib.metadata.EntryPoint("s1", "%s:write_met" % plugin_module,
+                                      "other.group"),
+    ])
+    monkeypatch.setattr(importlib.metadata, "entry_points", lambda: eps)
+    func = extract.load_extractor("entry_point:s1")
+    assert func("/data/S1A") == {"prod_path": "/data/S1A"}
+    with pytest.raises(RuntimeError):
+        extract.load_extractor("entry_point:s2")
+
+
+def test_load_script_extractor_is_not_python():
+    assert extract.load_extractor("/path/to/extractor.py") is None
+
+
+def test_load_missing_python_extractor(plugin_module):
+    with pytest.raises(AttributeError):
+        extract.load_extractor("python:%s.missing" % plugin_module)
+    with pytest.raises(ImportError):
+        extract.load_extractor("python:spyddder_no_such_module.extract")
+
+
+@pytest.mark.parametrize("output, expected", [
+    (b'{"starttime": "2019-01-01T00:00:00"}', {"starttime": "2019-01-01T00:00:00"}),
+    (b'', {}),
+    (b'Extracting metadata...\n{"a": 1}', {}),
+    (b'[1, 2]', {}),
+    (b'"text"', {}),
+    (b'\xff\xfe', {}),
+])
+def test_parse_extractor_output(output, expected):
+    assert extract.parse_extractor_output(output) == expected
+
+
+def test_run_extractor_with_malformed_script_output(bench_path, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    script = str(tmp_path / "extractor.sh")
+    with open(script, 'w') as f:
+        f.write('#!/bin/sh\necho "not json"\n'
+                'echo \'{"label": "x"}\' > "$1/$(basename "$1").met.json"\n')
+    os.chmod(script, 0o755)
+    dsets_file = str(tmp_path / "datasets.json")
+    with open(dsets_file, 'w') as f:
+        json.dump([{"match": ".*", "extractor": "script:%s" % script}], f)
+    prod_path = str(tmp_path / "S1A")
+    os.makedirs(prod_path)
+
+    extract.run_extractor(dsets_file, prod_path, {
+        "localize_urls": [{"url": "https://example.com/S1A.zip"}]})
+    with open(os.path.join(prod_path, "S1A.met.json")) as f:
+        assert json.load(f) == {"label": "x", "data_product_name": "S1A",
+                                "download_url": "https://example.com/S1A.zip"}
+    with open(os.path.join(prod_path, "S1A.dataset.json")) as f:
+        assert json.load(f) == {"version": "v0.1"}
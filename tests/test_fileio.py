@@ -0,0 +1,25 @@
+import json
+import os
+
+import pytest
+
+from fileio import write_json_atomic
+
+
+def test_write_json_atomic_replaces_file(tmp_path):
+    path = str(tmp_path / "state.json")
+    write_json_atomic(path, {"a": 1})
+    write_json_atomic(path, {"b": 2}, indent=2)
+    with open(path) as f:
+        assert json.load(f) == {"b": 2}
+    assert os.listdir(str(tmp_path)) == ["state.json"]
+
+
+def test_write_json_atomic_keeps_old_content_on_error(tmp_path):
+    path = str(tmp_path / "state.json")
+    write_json_atomic(path, {"a": 1})
+    with pytest.raises(TypeError):
+        write_json_atomic(path, {"b": object()})
+    with open(path) as f:
+        assert json.load(f) == {"a": 1}
+    assert os.listdir(str(tmp_path)) == ["state.json"]
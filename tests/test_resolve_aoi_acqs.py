@@ -0,0 +1,36 @@
+import json
+
+import util
+
+
+def resolve(**params):
+    from synthetic import window, PLATFORM
+
+    starttime, endtime = window()
+    ctx = {"starttime": starttime, "endtime": endtime, "platform": PLATFORM,
+           "project": "grfn", "spyddder_extract_version": "v1.0"}
+    ctx.update(params)
+    with open("_context.json", 'w') as f:
+        json.dump(ctx, f)
+    util._slc_resolver = None
+    return util.resolve_aoi_acqs("_context.json")
+
+
+# resolution paths checked against one scroll per AOI, resolved stage by
+# stage
+PATHS = [
+    {"resolve_pipeline": "async"},
+    {"resolve_pipeline": "serial", "aoi_batch_size": "5"},
+    {"resolve_pipeline": "async", "aoi_batch_size": 50},
+    {"resolve_pipeline": "serial", "es_slices": "4"},
+    {"resolve_pipeline": "async", "es_slices": 3, "aoi_batch_size": 4},
+    {"resolve_pipeline": "serial", "aoi_match": "local"},
+    {"resolve_pipeline": "async", "aoi_match": "local", "es_slices": 2},
+]
+
+
+def test_resolution_paths_match_serial_per_aoi(grq):
+    expected = resolve(resolve_pipeline="serial", aoi_batch_size=1, es_slices=1)
+    assert len(expected[0]) > 100
+    for params in PATHS:
+        assert resolve(**params) == expected, params
@@ -0,0 +1,51 @@
+import util
+
+
+GiB = 1024 ** 3
+
+ASF = "factotum-job_worker-asf_throttled"
+ESA = "factotum-job_worker-scihub_throttled"
+
+
+def resolved_acq(id, priority, size, queue):
+    acq = {"id": id, "identifier": id, "metadata": {}}
+    if size is not None:
+        acq['metadata']['archive_size'] = size
+    args = ("v1.0", queue, "https://example.com/%s.zip" % id, "%s.zip" % id, id,
+            "2019-01-01", priority, "aoi")
+    return acq, args
+
+
+def ids(items):
+    return [acq['id'] for acq, args in items]
+
+
+def test_order_by_priority_size_queue():
+    resolved = [resolved_acq("a", 0, 1 * GiB, ASF),
+                resolved_acq("b", 5, 4 * GiB, ASF),
+                resolved_acq("c", 5, 2 * GiB, ESA),
+                resolved_acq("d", 5, None, ASF),
+                resolved_acq("e", 5, 2 * GiB, ASF),
+                resolved_acq("f", 1, 9 * GiB, ESA)]
+    scheduled, deferred = util.schedule(resolved)
+    # unknown sizes are taken to be UNKNOWN_ARCHIVE_SIZE
+    assert ids(scheduled) == ["e", "c", "b", "d", "f", "a"]
+    assert deferred == []
+
+
+def test_queue_caps_defer_lowest_ranked():
+    resolved = [resolved_acq("a%d" % i, i % 3, (10 - i) * GiB, ASF) for i in range(6)] + \
+        [resolved_acq("e%d" % i, 1, i * GiB, ESA) for i in range(3)] + \
+        [resolved_acq("o%d" % i, 0, i * GiB, "other") for i in range(3)]
+    scheduled, deferred = util.schedule(resolved, {ASF: 3, "default": 2})
+
+    assert ids(scheduled) == ["a5", "a2", "e0", "e1", "a4", "o0", "o1"]
+    # spillover keeps the submission order for the next run
+    assert ids(deferred) == ["e2", "a1", "o2", "a3", "a0"]
+
+
+def test_zero_cap_defers_queue():
+    resolved = [resolved_acq("a", 5, GiB, ASF), resolved_acq("e", 0, GiB, ESA)]
+    scheduled, deferred = util.schedule(resolved, {ESA: 0})
+    assert ids(scheduled) == ["a"]
+    assert ids(deferred) == ["e"]
@@ -0,0 +1,107 @@
+import threading
+import time
+
+import pytest
+
+import throttle
+from throttle import Scheduler, TokenBucket
+
+
+class Clock(object):
+    """Monotonic clock advanced only by sleep()."""
+
+    def __init__(self):
+        self.now = 1000.
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(throttle, "time", clock)
+    return clock
+
+
+def test_match_host():
+    s = Scheduler({"scihub.copernicus.eu": {"max_connections": 2},
+                   "default": {"max_connections": 8}})
+    assert s._match("scihub.copernicus.eu") == "scihub.copernicus.eu"
+    assert s._match("apihub.scihub.copernicus.eu") == "scihub.copernicus.eu"
+    assert s._match("copernicus.eu") == "default"
+    assert s._match("otherscihub.copernicus.eu") == "default"
+    assert s._match("datapool.asf.alaska.edu") == "default"
+
+    # subdomains share the limit of their key
+    assert s.limit("https://scihub.copernicus.eu/apihub") is \
+        s.limit("https://apihub.scihub.copernicus.eu/odata")
+    assert s.limit("https://scihub.copernicus.eu/").max_connections == 2
+    assert s.limit("https://datapool.asf.alaska.edu/").max_connections == 8
+
+
+def test_unlimited_host():
+    s = Scheduler({"scihub.copernicus.eu": {"max_connections": 2}})
+    limit = s.limit("https://datapool.asf.alaska.edu/")
+    assert limit.max_connections is None
+    assert s.throttle("https://datapool.asf.alaska.edu/", 1 << 30) == 0.
+
+
+def max_concurrency(schedulers, url, threads=8, hold=0.02):
+    """Return the most connections to url held at once by threads spread
+       over schedulers."""
+
+    lock = threading.Lock()
+    active = [0, 0]
+
+    def connect(scheduler):
+        with scheduler.connection(url):
+            with lock:
+                active[0] += 1
+                active[1] = max(active)
+            time.sleep(hold)
+            with lock:
+                active[0] -= 1
+
+    workers = [threading.Thread(target=connect, args=(schedulers[i % len(schedulers)],))
+               for i in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return active[1]
+
+
+def test_connections_limited_across_threads():
+    s = Scheduler({"scihub.copernicus.eu": {"max_connections": 2}})
+    assert max_concurrency([s], "https://scihub.copernicus.eu/x") == 2
+
+
+def test_connections_limited_across_slot_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(throttle, "SLOT_POLL_INTERVAL", 0.005)
+    config = {"scihub.copernicus.eu": {"max_connections": 2}}
+
+    # schedulers of separate jobs sharing HOST_LIMITS_DIR
+    schedulers = [Scheduler(config, str(tmp_path)) for i in range(3)]
+    assert max_concurrency(schedulers, "https://scihub.copernicus.eu/x",
+                           threads=9) == 2
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "scihub.copernicus.eu.0.slot", "scihub.copernicus.eu.1.slot"]
+
+
+def test_token_bucket_debt(clock):
+    bucket = TokenBucket(1000)
+    assert bucket.consume(1000) == 0.
+
+    # a request larger than the bucket goes into debt
+    assert bucket.consume(3000) == pytest.approx(3.)
+    assert clock.now == pytest.approx(1003.)
+
+    # and later consumers wait for the debt to be paid back
+    assert bucket.consume(500) == pytest.approx(0.5)
+    clock.sleep(10)
+    assert bucket.consume(1000) == 0.
+    assert bucket.consume(1) == pytest.approx(0.001)
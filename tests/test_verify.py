@@ -0,0 +1,110 @@
+import hashlib
+import io
+import os
+import random
+import tarfile
+import zipfile
+
+import pytest
+
+import sling
+
+
+MEMBER_SIZE = 256 * 1024
+
+
+def make_members(seed=0):
+    rnd = random.Random(seed)
+    # compressible but not uniform, so corruption breaks the stream
+    return {"S1A/measurement/%d.tiff" % i: rnd.randbytes(MEMBER_SIZE).translate(
+        bytes(b & 0x0f for b in range(256))) for i in range(3)}
+
+
+MEMBERS = make_members()
+
+
+def make_zip(path):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr("S1A/", "")
+        for name, data in MEMBERS.items():
+            z.writestr(name, data)
+    return path
+
+
+def make_tar(path, mode):
+    with tarfile.open(path, mode) as t:
+        for name, data in MEMBERS.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            t.addfile(info, io.BytesIO(data))
+    return path
+
+
+@pytest.fixture
+def archives(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return {"zip": make_zip("S1A.zip"), "tgz": make_tar("S1A.tgz", "w:gz"),
+            "tbz2": make_tar("S1A.tbz2", "w:bz2")}
+
+
+def truncate(path):
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) // 2)
+
+
+def corrupt(path):
+    # flip bytes in the middle of the compressed member data
+    with open(path, 'r+b') as f:
+        f.seek(os.path.getsize(path) // 2)
+        data = f.read(16)
+        f.seek(-len(data), os.SEEK_CUR)
+        f.write(bytes(b ^ 0xff for b in data))
+
+
+@pytest.mark.parametrize("file_type", ["zip", "tgz", "tbz2"])
+def test_verify_good_archive(archives, file_type):
+    before = sorted(os.listdir("."))
+    sling.verify(archives[file_type], file_type)
+    # nothing is extracted to disk
+    assert sorted(os.listdir(".")) == before
+
+
+@pytest.mark.parametrize("file_type", ["zip", "tgz", "tbz2"])
+@pytest.mark.parametrize("damage", [truncate, corrupt])
+def test_verify_rejects_damaged_archive(archives, file_type, damage):
+    damage(archives[file_type])
+    with pytest.raises(Exception):
+        sling.verify(archives[file_type], file_type)
+
+
+def test_verify_rejects_wrong_type(archives):
+    with pytest.raises(RuntimeError):
+        sling.verify(archives["tgz"], "zip")
+    with pytest.raises(RuntimeError):
+        sling.verify(archives["zip"], "tgz")
+    with pytest.raises(NotImplementedError):
+        sling.verify(archives["zip"], "rar")
+
+
+def hashlib_digests(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return {"md5": hashlib.md5(data).hexdigest(),
+            "sha256": hashlib.sha256(data).hexdigest()}
+
+
+@pytest.mark.parametrize("mode", sling.VERIFY_MODES)
+@pytest.mark.parametrize("file_type", ["zip", "tgz", "tbz2"])
+def test_verify_digests(archives, file_type, mode):
+    assert sling.verify(archives[file_type], file_type, mode) == \
+        hashlib_digests(archives[file_type])
+
+
+def test_digests_of_partly_read_file(archives):
+    # zip reads the central directory at the end before the members
+    with sling.DigestReader(archives["zip"]) as f:
+        f.seek(-100, os.SEEK_END)
+        f.read()
+        f.seek(0)
+        f.read(1000)
+        assert f.finish() == hashlib_digests(archives["zip"])
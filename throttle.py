@@ -0,0 +1,188 @@
+"""
+Per-host download scheduling: bound the number of concurrent connections
+to each source host and limit the bandwidth drawn from it with a token
+bucket. Limits are configured in settings.json, e.g.:
+
+  "HOST_LIMITS": {
+    "scihub.copernicus.eu": {"max_connections": 2,
+                             "max_bytes_per_sec": 20971520},
+    "default": {"max_connections": 8}
+  }
+
+Hosts match a key exactly or as a subdomain of it; "default" applies to
+all other hosts. Omitted limits are unbounded. Limits are shared by all
+downloads within a process, e.g. all acquisitions of a batch sling job.
+With HOST_LIMITS_DIR set to a directory shared by the jobs on a worker,
+connection slots are also shared by all of its processes through locked
+slot files; bandwidth is still limited per process.
+"""
+
+import os
+import time
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket refilled at rate tokens per second."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.timestamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, n):
+        """Take n tokens, sleeping until the bucket has refilled enough.
+           Requests larger than the bucket put it into debt, which later
+           consumers wait out in turn."""
+
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.timestamp) * self.rate)
+            self.timestamp = now
+            self.tokens -= n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+# seconds between attempts to take a slot file held by other processes
+SLOT_POLL_INTERVAL = 0.5
+
+
+class HostLimit(object):
+    """Connection and bandwidth limit of one host. If slot_prefix is set,
+       each connection also holds an exclusive lock on one of the
+       max_connections files <slot_prefix>.<n>.slot."""
+
+    def __init__(self, max_connections=None, max_bytes_per_sec=None,
+                 slot_prefix=None):
+        self.max_connections = max_connections
+        self.max_bytes_per_sec = max_bytes_per_sec
+        self.slot_prefix = slot_prefix if max_connections else None
+        self._sem = threading.BoundedSemaphore(max_connections) \
+            if max_connections else None
+        self._bucket = TokenBucket(max_bytes_per_sec) \
+            if max_bytes_per_sec else None
+
+    def _lock_slot(self):
+        """Return the first slot file locked or None if all are held."""
+
+        for n in range(self.max_connections):
+            slot = open("%s.%d.slot" % (self.slot_prefix, n), 'a')
+            try:
+                fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return slot
+            except BlockingIOError:
+                slot.close()
+        return None
+
+    def acquire(self):
+        """Take a connection slot. Return the locked slot file, if any, to
+           be passed to release()."""
+
+        if self._sem is not None:
+            self._sem.acquire()
+        if self.slot_prefix is None:
+            return None
+        try:
+            while True:
+                slot = self._lock_slot()
+                if slot is not None:
+                    return slot
+                time.sleep(SLOT_POLL_INTERVAL)
+        except BaseException:
+            self._sem.release()
+            raise
+
+    def release(self, slot=None):
+        if slot is not None:
+            fcntl.flock(slot, fcntl.LOCK_UN)
+            slot.close()
+        if self._sem is not None:
+            self._sem.release()
+
+    def consume(self, nbytes):
+        if self._bucket is not None:
+            return self._bucket.consume(nbytes)
+        return 0.
+
+
+class Scheduler(object):
+    """Dispatch connection slots and bandwidth by source host."""
+
+    def __init__(self, host_limits=None, slot_dir=None):
+        self.config = dict(host_limits or {})
+        self.slot_dir = slot_dir
+        self._limits = {}
+        self._lock = threading.Lock()
+
+    def _match(self, host):
+        """Return config key for host: exact match, then closest parent
+           domain, then "default"."""
+
+        parts = host.split('.')
+        for i in range(len(parts)):
+            key = '.'.join(parts[i:])
+            if key in self.config:
+                return key
+        return "default"
+
+    def limit(self, url):
+        """Return the HostLimit shared by all hosts matching url."""
+
+        key = self._match(urlparse(url).hostname or "")
+        with self._lock:
+            if key not in self._limits:
+                slot_prefix = os.path.join(self.slot_dir, key) \
+                    if self.slot_dir else None
+                self._limits[key] = HostLimit(slot_prefix=slot_prefix,
+                                              **self.config.get(key, {}))
+            return self._limits[key]
+
+    @contextmanager
+    def connection(self, url):
+        """Hold one connection slot for the host of url."""
+
+        limit = self.limit(url)
+        t0 = time.monotonic()
+        slot = limit.acquire()
+        waited = time.monotonic() - t0
+        if waited > 1.:
+            logging.info("Waited {:.1f}s for a connection slot to {}.".format(
+                waited, urlparse(url).hostname))
+        try:
+            yield limit
+        finally:
+            limit.release(slot)
+
+    def throttle(self, url, nbytes):
+        """Account nbytes transferred from the host of url, sleeping as
+           needed to stay within its bandwidth limit."""
+
+        return self.limit(url).consume(nbytes)
+
+
+# scheduler shared by all downloads of this process
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler(settings):
+    """Return the process-wide scheduler configured from settings."""
+
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            slot_dir = settings.get("HOST_LIMITS_DIR") or None
+            if slot_dir:
+                os.makedirs(slot_dir, exist_ok=True)
+            _scheduler = Scheduler(settings.get("HOST_LIMITS", {}), slot_dir)
+        return _scheduler
@@ -1,13 +1,23 @@
 #!/usr/bin/env python
 import os
+import re
 import sys
 import time
 import json
-import requests
+import queue
 import logging
+import threading
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
 
-from hysds_commons.job_utils import resolve_hysds_job
-from hysds.celery import app
+import spatial
+from metrics import span, flush_spans
+from settings import get_settings
+from fileio import write_json_atomic
+from resolver import SlcResolver, ESA_FALLBACK_QUEUE, RESOLVE_WORKERS, \
+    RESOLVE_CACHE_TTL, RESOLVE_CACHE_MISS_TTL
+from watermarks import AoiWatermarks, WATERMARK_OVERLAP, WATERMARK_MAX_HOLDS, \
+    creation_filter, parse_timestamp, format_timestamp
 
 
 # set logger
@@ -30,67 +40,272 @@ logger.addFilter(LogFilter())
 BASE_PATH = os.path.dirname(__file__)
 
 
-def dataset_exists(id, index_suffix):
-    """Query for existence of dataset by ID."""
+# number of ids looked up by a single existence query
+EXISTS_CHUNK_SIZE = 500
+
+
+def datasets_exist(ids, index_suffix, chunk_size=EXISTS_CHUNK_SIZE):
+    """Query for existence of datasets by ID. Return the set of IDs that
+       exist, looking up chunk_size IDs per query."""
+
+    from hysds.celery import app
 
     # es_url and es_index
     es_url = app.conf.GRQ_ES_URL
     es_index = f"grq_*_{index_suffix.lower()}"
-
-    # query
-    query = {
-        "query": {
-            "bool": {
-                "must": [
-                    {"term": {"_id": id}},
-                ]
-            }
-        },
-        "fields": [],
-    }
-
     if es_url.endswith('/'):
         search_url = '{}{}/_search'.format(es_url, es_index)
     else:
         search_url = '{}/{}/_search'.format(es_url, es_index)
-    r = requests.post(search_url, data=json.dumps(query))
-    if r.status_code == 200:
-        result = r.json()
-        total = result['hits']['total']
+
+    ids = sorted(set(ids))
+    found = set()
+    with span("exists_check", index=es_index) as s:
+        for i in range(0, len(ids), chunk_size):
+            chunk = ids[i:i + chunk_size]
+
+            # an id indexed in more than one grq_<version>_ index has a hit
+            # in each, so page until all hits of the chunk are consumed
+            offset = 0
+            while True:
+                query = {
+                    "query": {
+                        "ids": {
+                            "values": chunk
+                        }
+                    },
+                    "_source": False,
+                    "from": offset,
+                    "size": len(chunk),
+                }
+                r = get_es_session().post(search_url, data=json.dumps(query),
+                                          headers={'Content-Type': 'application/json'})
+                if r.status_code != 200:
+                    print("Failed to query {}:\n{}".format(es_url, r.text))
+                    print("query: ids query for {} ids, e.g. {}".format(len(chunk), chunk[0]))
+                    print("returned: %s" % r.text)
+                    if r.status_code != 404:
+                        r.raise_for_status()
+                    break
+                res = r.json()
+                hits = res['hits']['hits']
+                found.update(hit['_id'] for hit in hits)
+                total = res['hits']['total']
+                if isinstance(total, dict):
+                    total = total['value']
+                offset += len(hits)
+                if not hits or offset >= total:
+                    break
+        s.add(items=len(ids))
+        s.set(found=len(found))
+    return found
+
+
+def dataset_exists(id, index_suffix):
+    """Query for existence of dataset by ID."""
+
+    return id in datasets_exist([id], index_suffix)
+
+
+# number of hits per scroll page
+ES_PAGE_SIZE = 100
+
+# keep-alive of scroll contexts between pages
+ES_SCROLL = "10m"
+
+# number of slices scrolled concurrently by iter_query_es_sliced()
+ES_SLICES = 1
+
+# max number of pooled connections to ES
+ES_POOL_SIZE = 32
+
+
+# session reused for all ES requests of this process
+_es_session = None
+
+# ES version by url
+_es_versions = {}
+
+
+def get_es_session():
+    """Return pooled requests session for ES queries."""
+
+    global _es_session
+    if _es_session is None:
+        import requests
+        _es_session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=ES_POOL_SIZE,
+                                                pool_maxsize=ES_POOL_SIZE)
+        _es_session.mount('http://', adapter)
+        _es_session.mount('https://', adapter)
+    return _es_session
+
+
+def get_es_rest_url():
+    """Return GRQ ES url without trailing slash."""
+
+    from hysds.celery import app
+
+    es_url = app.conf.GRQ_ES_URL
+    return es_url[:-1] if es_url.endswith('/') else es_url
+
+
+def get_es_version(rest_url):
+    """Return version of ES cluster as a tuple of ints."""
+
+    if rest_url not in _es_versions:
+        r = get_es_session().get(rest_url)
+        r.raise_for_status()
+        number = r.json()['version']['number']
+        _es_versions[rest_url] = tuple(int(i) for i in re.findall(r'\d+', number)[:3])
+    return _es_versions[rest_url]
+
+
+def _scroll_pages(query, es_index, size=ES_PAGE_SIZE):
+    """Query ES and yield scroll pages of hits. The scroll context is
+       cleared once iteration ends or is abandoned."""
+
+    session = get_es_session()
+    rest_url = get_es_rest_url()
+    scan = get_es_version(rest_url) < (5,)
+    if scan:
+        url = "{}/{}/_search?search_type=scan&scroll={}&size={}".format(
+            rest_url, es_index, ES_SCROLL, size)
     else:
-        print("Failed to query {}:\n{}".format(es_url, r.text))
-        print("query: %s" % json.dumps(query, indent=2))
-        print("returned: %s" % r.text)
-        if r.status_code == 404:
-            total = 0
-        else:
+        url = "{}/{}/_search?scroll={}&size={}".format(
+            rest_url, es_index, ES_SCROLL, size)
+        query = dict(query, sort=["_doc"])
+    r = session.post(url, data=json.dumps(query),
+                     headers={'Content-Type': 'application/json'})
+    r.raise_for_status()
+    res = r.json()
+    count = res['hits']['total']
+    if isinstance(count, dict):
+        count = count['value']
+    scroll_id = res['_scroll_id']
+    logger.info("Scrolling {} hits from {}.".format(count, es_index))
+    seen = 0
+    try:
+        # scan only returns hits on subsequent scroll requests
+        hits = [] if scan else res['hits']['hits']
+        while True:
+            if hits:
+                seen += len(hits)
+                yield hits
+            # totals past 10000 are only a lower bound on ES 7, so outside
+            # of scan mode paging stops at the first empty page
+            if (scan and seen >= count) or (not scan and not hits):
+                break
+            if scan:
+                r = session.post('%s/_search/scroll?scroll=%s' %
+                                 (rest_url, ES_SCROLL), data=scroll_id)
+            else:
+                r = session.post('%s/_search/scroll' % rest_url,
+                                 data=json.dumps({"scroll": ES_SCROLL,
+                                                  "scroll_id": scroll_id}),
+                                 headers={'Content-Type': 'application/json'})
             r.raise_for_status()
-    return False if total == 0 else True
+            res = r.json()
+            scroll_id = res['_scroll_id']
+            hits = res['hits']['hits']
+            if len(hits) == 0:
+                break
+    finally:
+        try:
+            if scan:
+                session.delete('%s/_search/scroll' % rest_url, data=scroll_id)
+            else:
+                session.delete('%s/_search/scroll' % rest_url,
+                               data=json.dumps({"scroll_id": [scroll_id]}),
+                               headers={'Content-Type': 'application/json'})
+        except Exception as e:
+            logger.warning("Failed to clear scroll {}: {}".format(scroll_id, e))
+
+
+def iter_query_es(query, es_index, size=ES_PAGE_SIZE):
+    """Query ES and yield hits, fetching one scroll page at a time. The
+       scroll context is cleared once iteration ends or is abandoned."""
+
+    for hits in _scroll_pages(query, es_index, size):
+        for hit in hits:
+            yield hit
+
+
+def iter_query_es_sliced(query, es_index, slices=ES_SLICES, size=ES_PAGE_SIZE,
+                         partitions=None):
+    """Query ES and yield hits, scrolling parts of the query concurrently.
+
+       If partitions, a list of disjoint filters that together cover the
+       query (see time_partitions()), has more than one filter, each part
+       is the query restricted to one filter; this works on any ES
+       version. Otherwise sliced scroll is used on ES 5 and later. On
+       older clusters without partitions or with a single slice this is
+       the same as iter_query_es(). Hits of the parts are interleaved in
+       no particular order. Each part buffers at most a couple of pages
+       ahead of the consumer."""
+
+    if partitions is not None and len(partitions) > 1:
+        base = query.get('query', {"match_all": {}})
+        if get_es_version(get_es_rest_url()) < (5,):
+            queries = [dict(query, query={"filtered": {"query": base, "filter": f}})
+                       for f in partitions]
+        else:
+            queries = [dict(query, query={"bool": {"must": base, "filter": f}})
+                       for f in partitions]
+    elif slices > 1 and get_es_version(get_es_rest_url()) >= (5,):
+        queries = [dict(query, slice={"id": i, "max": slices})
+                   for i in range(slices)]
+    else:
+        for hit in iter_query_es(query, es_index, size):
+            yield hit
+        return
+    slices = len(queries)
+
+    pages = queue.Queue(maxsize=2 * slices)
+    stop = threading.Event()
+    done = object()
+
+    def scroll_slice(i):
+        try:
+            for hits in _scroll_pages(queries[i], es_index, size):
+                if stop.is_set():
+                    break
+                pages.put(hits)
+            pages.put(done)
+        except BaseException as e:
+            pages.put(e)
+
+    threads = [threading.Thread(target=scroll_slice, args=(i,), daemon=True,
+                                name="es-slice-%d" % i) for i in range(slices)]
+    for t in threads:
+        t.start()
+    try:
+        running = slices
+        while running > 0:
+            item = pages.get()
+            if item is done:
+                running -= 1
+            elif isinstance(item, BaseException):
+                raise item
+            else:
+                for hit in item:
+                    yield hit
+    finally:
+        # unblock and stop slices if the consumer stopped early
+        stop.set()
+        while any(t.is_alive() for t in threads):
+            try:
+                pages.get(timeout=0.1)
+            except queue.Empty:
+                pass
 
 
 def query_es(query, es_index):
     """Query ES."""
 
-    es_url = app.conf.GRQ_ES_URL
-    rest_url = es_url[:-1] if es_url.endswith('/') else es_url
-    url = "{}/{}/_search?search_type=scan&scroll=60&size=100".format(
-        rest_url, es_index)
-    #logger.info("url: {}".format(url))
-    r = requests.post(url, data=json.dumps(query))
-    r.raise_for_status()
-    scan_result = r.json()
-    #logger.info("scan_result: {}".format(json.dumps(scan_result, indent=2)))
-    count = scan_result['hits']['total']
-    scroll_id = scan_result['_scroll_id']
-    hits = []
-    while True:
-        r = requests.post('%s/_search/scroll?scroll=60m' %
-                          rest_url, data=scroll_id)
-        res = r.json()
-        scroll_id = res['_scroll_id']
-        if len(res['hits']['hits']) == 0:
-            break
-        hits.extend(res['hits']['hits'])
+    with span("es_query", index=es_index) as s:
+        hits = list(iter_query_es(query, es_index))
+        s.add(items=len(hits))
     return hits
 
 
@@ -166,102 +381,479 @@ def query_aois(starttime, endtime):
     }
 
     # filter inactive
-    hits = [i['fields']['partial'][0] for i in query_es(query, es_index)
-            if 'inactive' not in i['fields']['partial'][0].get('metadata', {}).get('user_tags', [])]
-    #logger.info("hits: {}".format(json.dumps(hits, indent=2)))
-    logger.info("aois: {}".format(json.dumps([i['id'] for i in hits])))
+    hits = []
+    with span("es_query", index=es_index) as s:
+        for i in iter_query_es(query, es_index):
+            aoi = i['fields']['partial'][0]
+            if 'inactive' not in aoi.get('metadata', {}).get('user_tags', []):
+                hits.append(aoi)
+        s.add(items=len(hits))
+    logger.info("aois: {}".format(summarize_ids([i['id'] for i in hits])))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("hits: {}".format(json.dumps(hits, indent=2)))
     return hits
 
 
-def query_aoi_acquisitions(starttime, endtime, platform):
-    """Query ES for active AOIs that intersect starttime and endtime and 
-       find acquisitions that intersect the AOI polygon for the platform."""
+# number of AOIs matched by a single acquisition query
+AOI_BATCH_SIZE = 50
 
-    acq_info = {}
-    es_index = "grq_*_*acquisition*"
-    for aoi in query_aois(starttime, endtime):
-        logger.info("aoi: {}".format(aoi['id']))
-        query = {
-            "query": {
-                "filtered": {
-                    "query": {
-                        "bool": {
-                            "must": [
-                                {
-                                    "term": {
-                                        "dataset_type.raw": "acquisition"
-                                    }
-                                },
-                                {
-                                    "term": {
-                                        "metadata.platform.raw": platform
-                                    }
-                                },
-                                {
-                                    "range": {
-                                        "starttime": {
-                                            "lte": endtime
-                                        }
+
+def assign_aoi(acq_info, acq, aoi):
+    """Assign AOI to acquisition in acq_info unless an AOI of higher
+       priority already resolved it."""
+
+    aoi_priority = aoi.get('metadata', {}).get('priority', 0)
+    # ensure highest priority is assigned if multiple AOIs resolve the acquisition
+    if acq['id'] in acq_info and acq_info[acq['id']].get('priority', 0) > aoi_priority:
+        return
+    acq['aoi'] = aoi['id']
+    acq['priority'] = aoi_priority
+    acq_info[acq['id']] = acq
+
+
+# watermarks of an incremental run waiting for its extract jobs, written
+# next to the context file
+PENDING_WATERMARKS_FILE = "aoi_watermarks.pending.json"
+
+
+def commit_aoi_watermarks(pending_file):
+    """Advance the AOI watermarks saved to pending_file by
+       resolve_aoi_acqs() once the workflow has submitted the extract jobs.
+
+       Extract jobs run asynchronously, so only acquisitions whose datasets
+       exist advance the watermarks. The others, whether failed or still
+       running, hold them back to just before the earliest of them so that
+       later runs query them again; jobs still in flight are deduplicated
+       by HySDS. After max_holds runs without a dataset a submitted
+       acquisition is recorded as failed in the watermark file and no
+       longer holds it. Acquisitions deferred by QUEUE_CAPS were not
+       submitted; they hold the watermarks back until a run submits them
+       and never count as failed."""
+
+    with open(pending_file) as f:
+        pending = json.load(f)
+    watermarks = AoiWatermarks(pending['watermark_file'], pending['platform'],
+                               pending['overlap'],
+                               pending.get('max_holds', WATERMARK_MAX_HOLDS))
+    watermarks._seen = pending['seen']
+    exclude = set(pending['exclude'])
+    deferred = set(pending.get('deferred', []))
+    acqs = {id: acq for id, acq in pending['acquisitions'].items()
+            if id not in deferred}
+    dset_map = get_settings()['ACQ_TO_DSET_MAP']
+    existing = filter_existing(acqs.values())
+    missing = [id for id, acq in acqs.items() if acq['dataset'] in dset_map and
+               acq['identifier'] not in existing]
+    if deferred:
+        logger.info("Holding back watermarks for {} deferred acquisitions: {}".format(
+            len(deferred), summarize_ids(sorted(deferred))))
+    if missing:
+        logger.info("Holding back watermarks for {} acquisitions without datasets: {}".format(
+            len(missing), summarize_ids(missing)))
+    exclude.update(missing)
+    failed = watermarks.save(exclude, deferred)
+    if failed:
+        logger.warning("Gave up on {} acquisitions holding back watermarks for {} runs: {}".format(
+            len(failed), watermarks.max_holds, summarize_ids(failed)))
+    os.remove(pending_file)
+
+
+def ctx_int(ctx, name, default):
+    """Return integer context param, which job submission may pass as a
+       string, or default if it is unset."""
+
+    value = ctx.get(name)
+    if value is None or value == "":
+        return default
+    return int(value)
+
+
+def get_aoi_watermarks(ctx):
+    """Return AoiWatermarks for the context platform if the context asks
+       for incremental localization, else None."""
+
+    incremental = ctx.get('incremental', False)
+    if isinstance(incremental, str):
+        incremental = incremental.lower() == "true"
+    if not incremental:
+        return None
+    settings = get_settings()
+    watermark_file = settings.get('AOI_WATERMARK_FILE')
+    if not watermark_file:
+        logger.warning("Incremental localization requested but " +
+                       "AOI_WATERMARK_FILE is not set; querying full window.")
+        return None
+    return AoiWatermarks(watermark_file, ctx['platform'],
+                         settings.get('AOI_WATERMARK_OVERLAP', WATERMARK_OVERLAP),
+                         settings.get('AOI_WATERMARK_MAX_HOLDS', WATERMARK_MAX_HOLDS))
+
+
+def aoi_filter(aoi, watermarks=None):
+    """Return filter named after AOI matching acquisitions intersecting
+       its polygon, restricted to those since its watermark if any."""
+
+    geo_filter = {
+        "geo_shape": {
+            "location": {
+                "shape": aoi['location']
+            },
+            "_name": aoi['id']
+        }
+    }
+    range_filter = watermarks.query_filter(aoi['id']) if watermarks else None
+    if range_filter is None:
+        return geo_filter
+    del geo_filter['geo_shape']['_name']
+    return {
+        "bool": {
+            "must": [geo_filter, range_filter],
+            "_name": aoi['id']
+        }
+    }
+
+
+# fields of acquisitions needed to resolve them; the full metadata of an
+# acquisition is much larger and is not fetched
+ACQ_FIELDS = ["id", "dataset_type", "dataset", "creation_timestamp",
+              "metadata.identifier", "metadata.download_url",
+              "metadata.archive_filename", "metadata.archive_size",
+              "metadata.platform"]
+
+# number of ids included in log summaries
+LOG_SAMPLE_SIZE = 5
+
+
+def summarize_ids(ids, sample_size=LOG_SAMPLE_SIZE):
+    """Return log summary of a list of ids with a sample of them."""
+
+    ids = list(ids)
+    if len(ids) <= sample_size:
+        return "{} {}".format(len(ids), json.dumps(ids))
+    return "{} {} and {} more".format(len(ids), json.dumps(ids[:sample_size]),
+                                      len(ids) - sample_size)
+
+
+def log_acq_info(acq_info):
+    """Log summary of acquisitions to localize; full dump at debug level."""
+
+    logger.info("Acquisitions to localize: {}".format(summarize_ids(sorted(acq_info))))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Acquisitions to localize: {}".format(
+            json.dumps(acq_info, indent=2)))
+
+
+def time_partitions(field, starttime, endtime, n):
+    """Return n range filters on date field splitting starttime to endtime
+       into equal windows. The first and last windows are open-ended, so
+       every document matches exactly one filter and the query can be
+       scrolled in n concurrent parts on any ES version."""
+
+    t0 = parse_timestamp(starttime)
+    t1 = parse_timestamp(endtime)
+    bounds = [format_timestamp(t0 + (t1 - t0) * i // n) for i in range(1, n)]
+    filters = []
+    for i in range(n):
+        cond = {}
+        if i > 0:
+            cond['gte'] = bounds[i - 1]
+        if i < n - 1:
+            cond['lt'] = bounds[i]
+        filters.append({"range": {field: cond}} if cond else {"match_all": {}})
+    return filters
+
+
+def starttime_partitions(starttime, endtime, slices):
+    """Return time_partitions() of acquisition starttimes for slices > 1,
+       otherwise or if the dates are not in a format time_partitions()
+       parses None, leaving the query to iter_query_es_sliced()."""
+
+    if slices <= 1:
+        return None
+    try:
+        return time_partitions("starttime", starttime, endtime, slices)
+    except ValueError as e:
+        logger.warning("Not partitioning query from {} to {}: {}".format(
+            starttime, endtime, e))
+        return None
+
+
+def acquisitions_query(starttime, endtime, platform, acq_filter=None,
+                       fields=None):
+    """Return query for acquisitions of platform that intersect starttime
+       and endtime, filtered by acq_filter if set. Only fields (ACQ_FIELDS
+       by default) are returned."""
+
+    query = {
+        "query": {
+            "filtered": {
+                "query": {
+                    "bool": {
+                        "must": [
+                            {
+                                "term": {
+                                    "dataset_type.raw": "acquisition"
+                                }
+                            },
+                            {
+                                "term": {
+                                    "metadata.platform.raw": platform
+                                }
+                            },
+                            {
+                                "range": {
+                                    "starttime": {
+                                        "lte": endtime
                                     }
-                                },
-                                {
-                                    "range": {
-                                        "endtime": {
-                                            "gte": starttime
-                                        }
+                                }
+                            },
+                            {
+                                "range": {
+                                    "endtime": {
+                                        "gte": starttime
                                     }
                                 }
-                            ]
-                        }
-                    },
-                    "filter": {
-                        "geo_shape": {
-                            "location": {
-                                "shape": aoi['location']
                             }
-                        }
+                        ]
                     }
                 }
-            },
-            "partial_fields": {
-                "partial": {
-                    "include": ["id", "dataset_type", "dataset", "metadata"]
-                }
+            }
+        },
+        "partial_fields": {
+            "partial": {
+                "include": fields or ACQ_FIELDS
             }
         }
-        acqs = [i['fields']['partial'][0] for i in query_es(query, es_index)]
-        logger.info("Found {} acqs for {}: {}".format(len(acqs), aoi['id'],
-                                                      json.dumps([i['id'] for i in acqs], indent=2)))
-        for acq in acqs:
-            aoi_priority = aoi.get('metadata', {}).get('priority', 0)
-            # ensure highest priority is assigned if multiple AOIs resolve the acquisition
-            if acq['id'] in acq_info and acq_info[acq['id']].get('priority', 0) > aoi_priority:
-                continue
-            acq['aoi'] = aoi['id']
-            acq['priority'] = aoi_priority
-            acq_info[acq['id']] = acq
-    logger.info("Acquistions to localize: {}".format(
-        json.dumps(acq_info, indent=2)))
+    }
+    if acq_filter is not None:
+        query['query']['filtered']['filter'] = acq_filter
+    return query
+
+
+# size of grid cells in degrees for local AOI matching
+AOI_GRID_CELL_SIZE = 5.
+
+
+def iter_aoi_acquisitions_local(starttime, endtime, platform, slices=ES_SLICES,
+                                size=ES_PAGE_SIZE, watermarks=None,
+                                cell_size=AOI_GRID_CELL_SIZE):
+    """Query ES once for acquisitions of the platform that intersect
+       starttime and endtime with their footprints and yield those that
+       intersect active AOIs, each with the list of AOIs it intersects in
+       query_aois() order.
+
+       AOI polygons are indexed in a grid and matched in process by
+       bounding box and exact polygon intersection, so the cluster runs a
+       single query instead of a geo_shape filter per AOI. AOIs and
+       acquisition footprints of shape types spatial does not support are
+       matched by geo_shape filters in ES instead."""
+
+    es_index = "grq_*_*acquisition*"
+    aois = query_aois(starttime, endtime)
+    if not aois:
+        return
+    index = spatial.GridIndex(cell_size)
+    es_aois = []
+    local_aois = []
+    for aoi in aois:
+        try:
+            index.insert(aoi['id'], aoi['location'])
+        except NotImplementedError as e:
+            logger.warning("Matching {} in ES: {}".format(aoi['id'], e))
+            es_aois.append(aoi)
+        else:
+            local_aois.append(aoi)
+    order = {aoi['id']: j for j, aoi in enumerate(aois)}
+
+    # acquisitions of AOIs that cannot be matched locally, merged into the
+    # local matches of the same acquisitions below
+    es_matched = {}
+    if es_aois:
+        for acq, matched_aois in _iter_aoi_acquisitions_es(
+                es_aois, starttime, endtime, platform, slices, size,
+                AOI_BATCH_SIZE, watermarks):
+            es_matched.setdefault(acq['id'], (acq, []))[1].extend(
+                aoi['id'] for aoi in matched_aois)
+
+    acq_filter = None
+    since = {}
+    if watermarks is not None:
+        since = {aoi['id']: watermarks.since(aoi['id']) for aoi in aois}
+        if None not in since.values():
+            acq_filter = creation_filter(min(since.values()))
+
+    # acquisitions whose footprints cannot be matched locally, matched
+    # against the locally indexed AOIs in ES after the query
+    es_acqs = {}
+
+    counts = {aoi['id']: 0 for aoi in aois}
+    query = acquisitions_query(starttime, endtime, platform, acq_filter,
+                               ACQ_FIELDS + ["location"])
+    partitions = starttime_partitions(starttime, endtime, slices)
+    for hit in iter_query_es_sliced(query, es_index, slices, size, partitions):
+        acq = hit['fields']['partial'][0]
+        location = acq.pop('location', None)
+        es_ids = es_matched.pop(acq['id'], (None, []))[1]
+        if location is None and not es_ids:
+            continue
+        try:
+            matched = index.query(location) if location is not None else []
+        except NotImplementedError as e:
+            logger.warning("Matching {} in ES: {}".format(acq['id'], e))
+            es_acqs[acq['id']] = (acq, es_ids)
+            continue
+        if watermarks is not None:
+            # like the range filter in ES, an acquisition without a
+            # creation_timestamp matches no AOI with a watermark
+            created = acq.get('creation_timestamp')
+            if created is not None:
+                created = parse_timestamp(created)
+            matched = [aoi_id for aoi_id in matched
+                       if (since[aoi_id] is None or
+                           created is not None and created >= since[aoi_id])
+                       and watermarks.is_new(aoi_id, acq)]
+        matched = sorted(matched + es_ids, key=order.get)
+        if not matched:
+            continue
+        for aoi_id in matched:
+            counts[aoi_id] += 1
+        yield acq, [aois[order[aoi_id]] for aoi_id in matched]
+    if es_acqs and local_aois:
+        for acq, matched_aois in _iter_aoi_acquisitions_es(
+                local_aois, starttime, endtime, platform, slices, size,
+                AOI_BATCH_SIZE, watermarks, list(es_acqs)):
+            es_acqs[acq['id']][1].extend(aoi['id'] for aoi in matched_aois)
+    es_matched.update((id, item) for id, item in es_acqs.items() if item[1])
+    for acq, es_ids in es_matched.values():
+        es_ids = sorted(es_ids, key=order.get)
+        for aoi_id in es_ids:
+            counts[aoi_id] += 1
+        yield acq, [aois[order[aoi_id]] for aoi_id in es_ids]
+    for aoi_id in counts:
+        logger.info("Found {} acqs for {}.".format(counts[aoi_id], aoi_id))
+
+
+def _iter_aoi_acquisitions_es(aois, starttime, endtime, platform, slices,
+                              size, aoi_batch_size, watermarks, acq_ids=None):
+    """Yield acquisitions intersecting aois by geo_shape filters in ES,
+       restricted to the acquisitions in acq_ids if set; see
+       iter_aoi_acquisitions()."""
+
+    es_index = "grq_*_*acquisition*"
+    aoi_batch_size = max(1, aoi_batch_size)
+    partitions = starttime_partitions(starttime, endtime, slices)
+    for i in range(0, len(aois), aoi_batch_size):
+        batch = aois[i:i + aoi_batch_size]
+        order = {aoi['id']: j for j, aoi in enumerate(batch)}
+        logger.info("aois: {}".format(summarize_ids([aoi['id'] for aoi in batch])))
+        acq_filter = {
+            "bool": {
+                "should": [aoi_filter(aoi, watermarks) for aoi in batch]
+            }
+        }
+        if acq_ids is not None:
+            acq_filter['bool']['must'] = [{"ids": {"values": acq_ids}}]
+        query = acquisitions_query(starttime, endtime, platform, acq_filter)
+        counts = {aoi['id']: 0 for aoi in batch}
+        for hit in iter_query_es_sliced(query, es_index, slices, size, partitions):
+            acq = hit['fields']['partial'][0]
+            if len(batch) == 1:
+                matched = [batch[0]['id']]
+            else:
+                matched = sorted(set(hit.get('matched_queries', [])) & set(order),
+                                 key=order.get)
+            if not matched:
+                raise RuntimeError("No matching AOI reported for {}; ".format(acq['id']) +
+                                   "set aoi_batch_size to 1 if the cluster does " +
+                                   "not support named filters.")
+            if watermarks is not None:
+                matched = [aoi_id for aoi_id in matched
+                           if watermarks.is_new(aoi_id, acq)]
+                if not matched:
+                    continue
+            for aoi_id in matched:
+                counts[aoi_id] += 1
+            yield acq, [batch[order[aoi_id]] for aoi_id in matched]
+        if acq_ids is not None:
+            # counted with the local matches by the caller
+            continue
+        for aoi_id in counts:
+            logger.info("Found {} acqs for {}.".format(counts[aoi_id], aoi_id))
+
+
+def iter_aoi_acquisitions(starttime, endtime, platform, slices=ES_SLICES,
+                          size=ES_PAGE_SIZE, aoi_batch_size=AOI_BATCH_SIZE,
+                          watermarks=None, match="es"):
+    """Query ES for active AOIs that intersect starttime and endtime and
+       yield acquisitions that intersect the AOI polygon for the platform,
+       each with the list of AOIs it intersects.
+
+       AOIs are matched aoi_batch_size at a time by one query with a named
+       geo_shape filter per AOI so that each hit reports the AOIs it
+       intersects. The AOIs of a hit are in query_aois() order, so applying
+       them in turn with assign_aoi() keeps the highest-priority-wins
+       assignment of one query per AOI.
+
+       If watermarks is set, each AOI only matches acquisitions created
+       since its watermark that earlier runs did not localize.
+
+       If match is "local", acquisitions are matched against the AOIs in
+       process instead; see iter_aoi_acquisitions_local()."""
+
+    if match == "local":
+        for item in iter_aoi_acquisitions_local(starttime, endtime, platform,
+                                                slices, size, watermarks):
+            yield item
+        return
+    elif match != "es":
+        raise RuntimeError("Unknown AOI match mode: {}".format(match))
+
+    aois = query_aois(starttime, endtime)
+    for item in _iter_aoi_acquisitions_es(aois, starttime, endtime, platform,
+                                          slices, size, aoi_batch_size,
+                                          watermarks):
+        yield item
+
+
+def query_aoi_acquisitions(starttime, endtime, platform, slices=ES_SLICES,
+                           size=ES_PAGE_SIZE, aoi_batch_size=AOI_BATCH_SIZE,
+                           watermarks=None, match="es"):
+    """Query ES for active AOIs that intersect starttime and endtime and 
+       find acquisitions that intersect the AOI polygon for the platform."""
+
+    acq_info = {}
+    with span("aoi_acquisitions", platform=platform, match=match) as s:
+        for acq, aois in iter_aoi_acquisitions(starttime, endtime, platform, slices,
+                                               size, aoi_batch_size, watermarks,
+                                               match):
+            for aoi in aois:
+                assign_aoi(acq_info, acq, aoi)
+        s.add(items=len(acq_info))
+    log_acq_info(acq_info)
     return acq_info
 
 
-def resolve_s1_slc(identifier, download_url, project):
+# resolver shared within the process
+_slc_resolver = None
+
+
+def get_slc_resolver():
+    """Return the process-wide S1 SLC resolver configured in settings."""
+
+    global _slc_resolver
+    if _slc_resolver is None:
+        settings = get_settings()
+        _slc_resolver = SlcResolver(
+            settings.get('SLC_RESOLVE_CACHE') or None,
+            settings.get('SLC_RESOLVE_CACHE_TTL', RESOLVE_CACHE_TTL),
+            settings.get('SLC_RESOLVE_CACHE_MISS_TTL', RESOLVE_CACHE_MISS_TTL),
+            settings.get('SLC_RESOLVE_WORKERS', RESOLVE_WORKERS))
+    return _slc_resolver
+
+
+def resolve_s1_slc(identifier, download_url, project, esa_queue=ESA_FALLBACK_QUEUE):
     """Resolve S1 SLC using ASF datapool (ASF or NGAP). Fallback to ESA."""
 
-    # determine best url and corresponding queue
-    vertex_url = "https://datapool.asf.alaska.edu/SLC/SA/{}.zip".format(
-        identifier)
-    r = requests.head(vertex_url, allow_redirects=True)
-    if r.status_code == 403:
-        url = r.url
-        queue = f"{project}-job_worker-small"
-    elif r.status_code == 404:
-        url = download_url
-        queue = "factotum-job_worker-scihub_throttled"
-    else:
-        raise RuntimeError("Got status code {} from {}: {}".format(
-            r.status_code, vertex_url, r.url))
-    return url, queue
+    return get_slc_resolver().resolve(identifier, download_url, project, esa_queue)
 
 
 class DatasetExists(Exception):
@@ -269,14 +861,13 @@ class DatasetExists(Exception):
     pass
 
 
-def resolve_source(ctx):
-    """Resolve best URL from acquisition."""
+def resolve_source(ctx, check_exists=True):
+    """Resolve best URL from acquisition. Existence of the dataset is
+       not checked if check_exists is False, e.g. when it was already
+       checked in bulk."""
 
     # get settings
-    settings_file = os.path.join(os.path.dirname(
-        os.path.realpath(__file__)), 'settings.json')
-    with open(settings_file) as f:
-        settings = json.load(f)
+    settings = get_settings()
 
     # ensure acquisition
     if ctx['dataset_type'] != "acquisition":
@@ -285,11 +876,13 @@ def resolve_source(ctx):
 
     # route resolver and return url and queue
     if ctx['dataset'] == "acquisition-S1-IW_SLC":
-        if dataset_exists(ctx['identifier'], settings['ACQ_TO_DSET_MAP'][ctx['dataset']]):
+        if check_exists and dataset_exists(ctx['identifier'],
+                                           settings['ACQ_TO_DSET_MAP'][ctx['dataset']]):
             raise DatasetExists(
                 "Dataset {} already exists.".format(ctx['identifier']))
         url, queue = resolve_s1_slc(
-            ctx['identifier'], ctx['download_url'], ctx['project'])
+            ctx['identifier'], ctx['download_url'], ctx['project'],
+            settings.get('ESA_FALLBACK_QUEUE', ESA_FALLBACK_QUEUE))
     else:
         raise NotImplementedError(
             "Unknown acquisition dataset: {}".format(ctx['dataset']))
@@ -304,59 +897,428 @@ def resolve_source_from_ctx_file(ctx_file):
     """Resolve best URL from acquisition."""
 
     with open(ctx_file) as f:
-        return resolve_source(json.load(f))
+        ctx = json.load(f)
+    with span("url_resolution", identifier=ctx.get('identifier')) as s:
+        result = resolve_source(ctx)
+        s.add(items=1)
+    get_slc_resolver().save()
+    flush_spans()
+    return result
 
 
-def resolve_aoi_acqs(ctx_file):
-    """Resolve best URL from acquisitions from AOIs."""
+def filter_existing(acqs):
+    """Return identifiers of acquisitions whose datasets already exist,
+       querying each target dataset index once for all its candidates."""
 
-    # read in context
-    with open(ctx_file) as f:
-        ctx = json.load(f)
+    dset_map = get_settings()['ACQ_TO_DSET_MAP']
+    by_suffix = {}
+    for acq in acqs:
+        if acq['dataset'] in dset_map:
+            by_suffix.setdefault(dset_map[acq['dataset']], []).append(
+                acq['identifier'])
+    existing = set()
+    for index_suffix, ids in by_suffix.items():
+        found = datasets_exist(ids, index_suffix)
+        logger.info("{} of {} {} datasets already exist.".format(
+            len(found), len(ids), index_suffix))
+        existing.update(found)
+    return existing
+
+
+def set_resolution_context(acq, ctx):
+    """Set fields resolve_source() needs on acquisition from context."""
+
+    acq['spyddder_extract_version'] = ctx['spyddder_extract_version']
+    acq['project'] = ctx['project']
+    acq['identifier'] = acq['metadata']['identifier']
+    acq['download_url'] = acq['metadata']['download_url']
+    acq['archive_filename'] = acq['metadata']['archive_filename']
+    acq['job_priority'] = acq['priority']
+
+
+# assumed size of acquisitions without a known archive size
+UNKNOWN_ARCHIVE_SIZE = 8 * 1024 ** 3
+
+
+def schedule(resolved, queue_caps=None):
+    """Order resolved acquisitions for job submission and cap the number
+       of jobs per queue.
+
+       resolved is a list of (acq, args) where args is the tuple returned by
+       resolve_source(). Acquisitions are ordered by descending priority,
+       then by ascending archive size so that cheap transfers go first,
+       then by queue and id. queue_caps maps queue names, or "default" for
+       all other queues, to the maximum number of jobs submitted to them in
+       one run. Return (scheduled, deferred) lists of (acq, args)."""
+
+    queue_caps = queue_caps or {}
 
-    # get acq_info
-    acq_info = query_aoi_acquisitions(
-        ctx['starttime'], ctx['endtime'], ctx['platform'])
-
-    # build args
-    spyddder_extract_versions = []
-    queues = []
-    urls = []
-    archive_filenames = []
-    identifiers = []
-    prod_dates = []
-    priorities = []
-    aois = []
+    def key(item):
+        acq, args = item
+        size = acq.get('metadata', {}).get('archive_size')
+        return (-args[6], UNKNOWN_ARCHIVE_SIZE if size is None else size,
+                args[1], acq['id'])
+
+    scheduled = []
+    deferred = []
+    counts = {}
+    for acq, args in sorted(resolved, key=key):
+        queue = args[1]
+        cap = queue_caps.get(queue, queue_caps.get('default'))
+        if cap is not None and counts.get(queue, 0) >= cap:
+            deferred.append((acq, args))
+            continue
+        counts[queue] = counts.get(queue, 0) + 1
+        scheduled.append((acq, args))
+    for queue in sorted(counts):
+        logger.info("Scheduled {} jobs for {}.".format(counts[queue], queue))
+    if deferred:
+        logger.info("Deferred {} acquisitions over queue caps: {}".format(
+            len(deferred), summarize_ids([acq['identifier'] for acq, args in deferred])))
+    return scheduled, deferred
+
+
+def build_resolved_args(acq_info, existing, queue_caps=None):
+    """Resolve acquisitions whose datasets do not exist, schedule them and
+       return the parallel argument lists of the extract map step and the
+       ids of acquisitions deferred to a later run."""
+
+    resolved = []
     for id in sorted(acq_info):
         acq = acq_info[id]
-        acq['spyddder_extract_version'] = ctx['spyddder_extract_version']
-        acq['project'] = ctx['project']
-        acq['identifier'] = acq['metadata']['identifier']
-        acq['download_url'] = acq['metadata']['download_url']
-        acq['archive_filename'] = acq['metadata']['archive_filename']
-        acq['aoi'] = acq['aoi']
-        acq['job_priority'] = acq['priority']
-        try:
-            (spyddder_extract_version, queue, url, archive_filename,
-             identifier, prod_date, priority, aoi) = resolve_source(acq)
-        except DatasetExists as e:
-            logger.warning(e)
+        if acq['identifier'] in existing:
+            logger.warning("Dataset {} already exists.".format(acq['identifier']))
             logger.warning("Skipping {}".format(acq['identifier']))
             continue
-        spyddder_extract_versions.append(spyddder_extract_version)
-        queues.append(queue)
-        urls.append(url)
-        archive_filenames.append(archive_filename)
-        identifiers.append(identifier)
-        prod_dates.append(prod_date)
-        priorities.append(priority)
-        aois.append(aoi)
-    return (spyddder_extract_versions, queues, urls, archive_filenames,
-            identifiers, prod_dates, priorities, aois)
+        resolved.append((acq, resolve_source(acq, check_exists=False)))
+    scheduled, deferred = schedule(resolved, queue_caps)
+    args = tuple(list(arg) for arg in zip(*[args for acq, args in scheduled])) \
+        if scheduled else tuple([] for i in range(8))
+    return args, [acq['id'] for acq, args in deferred]
+
+
+# max number of items buffered between stages of the resolution pipeline
+PIPELINE_QUEUE_SIZE = 1000
+
+# seconds to wait for more acquisitions before checking existence of a
+# partial chunk in the resolution pipeline
+PIPELINE_FLUSH_INTERVAL = 0.5
+
+
+async def resolve_aoi_acqs_pipeline(ctx, watermarks=None):
+    """Query, existence check and ASF resolution of AOI acquisitions run
+       as concurrent stages connected by bounded queues, so that ASF HEADs
+       of early acquisitions overlap with ES paging for later ones.
+
+       Return acq_info with resolution context set and the set of
+       identifiers whose datasets already exist."""
+
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    resolver = get_slc_resolver()
+    dset_map = get_settings()['ACQ_TO_DSET_MAP']
+    acq_q = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+    head_q = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+    done = object()
+    stop = threading.Event()
+    acq_info = {}
+    existing = set()
+    counts = {"acqs": 0, "checked": 0, "resolved": 0}
+    executor = ThreadPoolExecutor(max_workers=resolver.workers + 2,
+                                  thread_name_prefix="resolve")
+
+    def put(item):
+        # block producer thread until the queue has room or pipeline stops
+        while not stop.is_set():
+            future = asyncio.run_coroutine_threadsafe(acq_q.put(item), loop)
+            try:
+                future.result(timeout=1)
+                return
+            except concurrent.futures.TimeoutError:
+                future.cancel()
+
+    def produce():
+        try:
+            for item in iter_aoi_acquisitions(
+                    ctx['starttime'], ctx['endtime'], ctx['platform'],
+                    ctx_int(ctx, 'es_slices', ES_SLICES),
+                    ctx_int(ctx, 'es_page_size', ES_PAGE_SIZE),
+                    ctx_int(ctx, 'aoi_batch_size', AOI_BATCH_SIZE), watermarks,
+                    ctx.get('aoi_match', "es")):
+                if stop.is_set():
+                    break
+                put(item)
+        finally:
+            put(done)
+
+    async def check_exists(batch):
+        by_suffix = {}
+        for acq in batch:
+            if acq['dataset'] in dset_map:
+                by_suffix.setdefault(dset_map[acq['dataset']], []).append(
+                    acq['metadata']['identifier'])
+        for index_suffix, ids in by_suffix.items():
+            existing.update(await loop.run_in_executor(
+                executor, datasets_exist, ids, index_suffix))
+        counts['checked'] += len(batch)
+        for acq in batch:
+            identifier = acq['metadata']['identifier']
+            if acq['dataset'] == "acquisition-S1-IW_SLC" and identifier not in existing:
+                await head_q.put(identifier)
+
+    async def collect():
+        batch = []
+        while True:
+            if batch:
+                try:
+                    item = await asyncio.wait_for(acq_q.get(), PIPELINE_FLUSH_INTERVAL)
+                except asyncio.TimeoutError:
+                    await check_exists(batch)
+                    batch = []
+                    continue
+            else:
+                item = await acq_q.get()
+            if item is done:
+                break
+            acq, aois = item
+            if acq['id'] not in acq_info:
+                batch.append(acq)
+                counts['acqs'] += 1
+            for aoi in aois:
+                assign_aoi(acq_info, acq, aoi)
+            if len(batch) >= EXISTS_CHUNK_SIZE:
+                await check_exists(batch)
+                batch = []
+        if batch:
+            await check_exists(batch)
+        for i in range(resolver.workers):
+            await head_q.put(done)
+
+    async def resolve():
+        while True:
+            identifier = await head_q.get()
+            if identifier is done:
+                break
+            await loop.run_in_executor(executor, resolver._lookup, identifier)
+            counts['resolved'] += 1
+
+    hits, misses = resolver.hits, resolver.misses
+    t0 = time.time()
+    with span("resolve_pipeline", platform=ctx['platform']) as s:
+        try:
+            await asyncio.gather(loop.run_in_executor(executor, produce), collect(),
+                                 *[resolve() for i in range(resolver.workers)])
+        finally:
+            stop.set()
+            executor.shutdown(wait=False)
+        s.add(items=counts['acqs'])
+        s.set(checked=counts['checked'], existing=len(existing),
+              resolved=counts['resolved'], cache_hits=resolver.hits - hits,
+              cache_misses=resolver.misses - misses)
+    logger.info("Pipeline found {} acquisitions, checked {}, {} exist, resolved {}.".format(
+        counts['acqs'], counts['checked'], len(existing), counts['resolved']))
+    resolver.log_stats(hits, misses, time.time() - t0)
+
+    log_acq_info(acq_info)
+    for acq in acq_info.values():
+        set_resolution_context(acq, ctx)
+    return acq_info, existing
+
+
+def resolve_aoi_acqs(ctx_file):
+    """Resolve best URL from acquisitions from AOIs.
+
+       By default the resolution stages run as an asyncio pipeline; set
+       resolve_pipeline to "serial" in the context to run them one after
+       the other. If incremental is set in the context, only acquisitions
+       created since the AOI watermarks in AOI_WATERMARK_FILE are resolved;
+       the watermarks are saved as pending next to ctx_file and advanced by
+       commit_aoi_watermarks() past the acquisitions whose datasets exist
+       once the workflow has submitted the extract jobs. Extract job
+       templates are saved next to ctx_file and its path is passed to each
+       extract_job() call."""
+
+    # read in context
+    with open(ctx_file) as f:
+        ctx = json.load(f)
+
+    resolver = get_slc_resolver()
+    watermarks = get_aoi_watermarks(ctx)
+    if ctx.get('resolve_pipeline', "async") == "async":
+        import asyncio
+        acq_info, existing = asyncio.run(resolve_aoi_acqs_pipeline(ctx, watermarks))
+    else:
+        # get acq_info
+        acq_info = query_aoi_acquisitions(
+            ctx['starttime'], ctx['endtime'], ctx['platform'],
+            ctx_int(ctx, 'es_slices', ES_SLICES), ctx_int(ctx, 'es_page_size', ES_PAGE_SIZE),
+            ctx_int(ctx, 'aoi_batch_size', AOI_BATCH_SIZE), watermarks,
+            ctx.get('aoi_match', "es"))
+
+        # set resolution context
+        for acq in acq_info.values():
+            set_resolution_context(acq, ctx)
+
+        # filter out acquisitions whose datasets already exist
+        existing = filter_existing(acq_info.values())
+
+        # resolve S1 SLCs concurrently ahead of building args
+        resolver.resolve_many([acq['identifier'] for acq in acq_info.values()
+                               if acq['dataset'] == "acquisition-S1-IW_SLC" and
+                               acq['identifier'] not in existing])
+
+    # build args in scheduled order
+    args, deferred = build_resolved_args(
+        acq_info, existing, get_settings().get('QUEUE_CAPS'))
+    resolver.save()
+    ctx_dir = os.path.dirname(os.path.abspath(ctx_file))
+    if watermarks is not None:
+        # advanced by run_sciflo.py once the extract jobs have run
+        watermarks.save_pending(os.path.join(ctx_dir, PENDING_WATERMARKS_FILE),
+                                acq_info=acq_info, deferred=deferred)
+
+    # resolve extract job templates once for the map step
+    templates_file = os.path.join(ctx_dir, EXTRACT_TEMPLATES_FILE)
+    save_extract_templates(resolve_extract_templates(args), templates_file)
+    args += ([templates_file] * len(args[0]),)
+    flush_spans()
+    return args
+
+
+# params of the extract job that vary per acquisition
+EXTRACT_JOB_PARAMS = ["localize_url", "file", "prod_name", "prod_date", "aoi"]
+
+# extract job templates of a localizer run, written next to the context
+# file for the extract map step
+EXTRACT_TEMPLATES_FILE = "extract_job_templates.json"
+
+# keys with no more jobs than this are resolved per job; stamping them
+# would cost as many resolutions as it saves
+EXTRACT_TEMPLATE_MIN_JOBS = 3
+
+# templates loaded by the extract map step by templates file
+_extract_job_templates = {}
+_extract_job_lock = threading.Lock()
+
+
+def _sentinel(name):
+    return "@@spyddder_extract_{}@@".format(name)
+
+
+def _stamp(obj, values):
+    """Return copy of obj with sentinels replaced by values."""
+
+    if isinstance(obj, dict):
+        return {k: _stamp(v, values) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_stamp(v, values) for v in obj]
+    if isinstance(obj, str) and "@@spyddder_extract_" in obj:
+        for name, value in values.items():
+            sentinel = _sentinel(name)
+            if obj == sentinel:
+                return value
+            obj = obj.replace(sentinel, str(value))
+    return obj
+
+
+def _template_key(job_type, queue, priority):
+    return "{}|{}|{}".format(job_type, queue, priority)
+
+
+def _resolve_extract_job(job_type, queue, priority, params):
+    from hysds_commons.job_utils import resolve_hysds_job
+
+    return resolve_hysds_job(job_type, queue, priority=priority, params=params,
+                             job_name="{}-{}-{}".format(job_type, params['aoi'],
+                                                        params['prod_name']))
+
+
+def resolve_extract_templates(args, min_jobs=EXTRACT_TEMPLATE_MIN_JOBS):
+    """Resolve an extract job template for each job type, queue and
+       priority of the extract map step args with more than min_jobs jobs.
+
+       A template is resolved with sentinel param values and kept only if
+       stamping it reproduces the directly resolved first and last jobs of
+       its key, i.e. the job spec neither derives values from params nor
+       adds per-call values. Return templates by key."""
+
+    jobs = {}
+    for version, queue, localize_url, file, prod_name, prod_date, priority, aoi \
+            in zip(*args):
+        key = (f"job-spyddder-extract:{version}", queue, priority)
+        jobs.setdefault(key, []).append({
+            "localize_url": localize_url,
+            "file": file,
+            "prod_name": prod_name,
+            "prod_date": prod_date,
+            "aoi": aoi,
+        })
+
+    templates = {}
+    with span("resolve_extract_templates") as s:
+        for (job_type, queue, priority), params in jobs.items():
+            if len(params) <= min_jobs:
+                continue
+            try:
+                template = _resolve_extract_job(
+                    job_type, queue, priority,
+                    {name: _sentinel(name) for name in EXTRACT_JOB_PARAMS})
+                stampable = all(
+                    _stamp(template, p) == _resolve_extract_job(job_type, queue, priority, p)
+                    for p in (params[0], params[-1]))
+            except Exception as e:
+                logger.warning("Failed to resolve {} template for queue {}: {}".format(
+                    job_type, queue, e))
+                continue
+            if not stampable:
+                logger.warning("Cannot stamp {} jobs for queue {} from a template; ".format(
+                    job_type, queue) + "resolving each job.")
+                continue
+            templates[_template_key(job_type, queue, priority)] = template
+        s.add(items=len(jobs))
+        s.set(templates=len(templates))
+    logger.info("Resolved extract job templates for {} of {} job types, queues and priorities.".format(
+        len(templates), len(jobs)))
+    return templates
+
+
+def save_extract_templates(templates, templates_file):
+    write_json_atomic(templates_file, templates)
+
+
+def load_extract_templates(templates_file):
+    """Return the templates saved to templates_file, loaded once per
+       process."""
+
+    with _extract_job_lock:
+        if templates_file not in _extract_job_templates:
+            try:
+                with open(templates_file) as f:
+                    _extract_job_templates[templates_file] = json.load(f)
+            except (IOError, ValueError) as e:
+                logger.warning("Failed to load extract job templates from {}: {}".format(
+                    templates_file, e))
+                _extract_job_templates[templates_file] = {}
+        return _extract_job_templates[templates_file]
+
+
+def resolve_extract_job(job_type, queue, priority, params, templates_file=None):
+    """Resolve extract job, stamping it from the template of its job type,
+       queue and priority in templates_file if there is one."""
+
+    template = None
+    if templates_file:
+        template = load_extract_templates(templates_file).get(
+            _template_key(job_type, queue, priority))
+    if template is None:
+        return _resolve_extract_job(job_type, queue, priority, params)
+    return _stamp(template, params)
 
 
 def extract_job(spyddder_extract_version, queue, localize_url, file, prod_name,
-                prod_date, priority, aoi, wuid=None, job_num=None):
+                prod_date, priority, aoi, templates_file=None, wuid=None,
+                job_num=None):
     """Map function for spyddder-man extract job."""
 
     if wuid is None or job_num is None:
@@ -373,8 +1335,7 @@ def extract_job(spyddder_extract_version, queue, localize_url, file, prod_name,
         "prod_date": prod_date,
         "aoi": aoi,
     }
-    job = resolve_hysds_job(job_type, queue, priority=priority, params=params,
-                            job_name="{}-{}-{}".format(job_type, aoi, prod_name))
+    job = resolve_extract_job(job_type, queue, priority, params, templates_file)
 
     # save to archive_filename if it doesn't match url basename
     if os.path.basename(localize_url) != file:
@@ -383,6 +1344,9 @@ def extract_job(spyddder_extract_version, queue, localize_url, file, prod_name,
     # add workflow info
     job['payload']['_sciflo_wuid'] = wuid
     job['payload']['_sciflo_job_num'] = job_num
-    print(f"job: {json.dumps(job, indent=2)}")
+    logger.info("Built {} job {} for {}.".format(job_type, job_num, prod_name))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("job: {}".format(json.dumps(job, indent=2)))
 
     return job
+
@@ -0,0 +1,231 @@
+"""
+Per-AOI high-water marks of the acquisitions localized by incremental
+AOI runs, kept in the JSON file set by AOI_WATERMARK_FILE in settings.json.
+
+An AOI run reads the watermarks when it queries acquisitions, records
+the acquisitions it resolves in a pending file next to its context file,
+and merges them into the watermark file once the workflow has submitted
+the extract jobs (see util.commit_aoi_watermarks()). Updates from runs
+on different workers are serialized by an exclusive lock on
+<watermark file>.lock.
+"""
+
+import os
+import json
+import time
+import calendar
+import logging
+import threading
+
+from fileio import write_json_atomic, locked
+
+
+# seconds before a watermark within which acquisitions are queried again,
+# allowing for documents that become searchable after later ones
+WATERMARK_OVERLAP = 300
+
+# runs an acquisition without a dataset may hold its AOI watermark back
+# before it is recorded as failed and no longer queried again
+WATERMARK_MAX_HOLDS = 5
+
+
+def parse_timestamp(ts):
+    """Parse the date and time of an ISO 8601 timestamp to epoch seconds."""
+
+    return calendar.timegm(time.strptime(ts[:19], "%Y-%m-%dT%H:%M:%S"))
+
+
+def format_timestamp(t):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(t))
+
+
+def creation_filter(since):
+    """Return range filter on creation_timestamp from epoch seconds."""
+
+    return {
+        "range": {
+            "creation_timestamp": {
+                "gte": format_timestamp(since)
+            }
+        }
+    }
+
+
+class AoiWatermarks(object):
+    """Per-AOI and per-platform high-water marks of localized acquisitions.
+
+       Each entry records the latest acquisition creation_timestamp seen
+       for an AOI and the ids and creation times of acquisitions created
+       within overlap seconds of it or later. Queries for the AOI start overlap seconds before the
+       watermark and acquisitions whose ids were recorded are dropped, so
+       each acquisition is localized once while late-indexed documents are
+       still found. Observations are only persisted by save(), after the
+       run has resolved them. Acquisitions excluded by save() hold the
+       watermark back for up to max_holds runs and are then listed under
+       failed so that the watermark keeps advancing. Acquisitions deferred
+       to a later run hold it back for as long as they are deferred."""
+
+    def __init__(self, watermark_file, platform, overlap=WATERMARK_OVERLAP,
+                 max_holds=WATERMARK_MAX_HOLDS):
+        self.watermark_file = watermark_file
+        self.platform = platform
+        self.overlap = overlap
+        self.max_holds = max_holds
+        self._marks = self._load()
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def _key(self, aoi_id):
+        return "{}/{}".format(aoi_id, self.platform)
+
+    def _load(self):
+        if not os.path.exists(self.watermark_file):
+            return {}
+        try:
+            with open(self.watermark_file) as f:
+                marks = json.load(f)
+        except ValueError:
+            logging.warning("Ignoring corrupt watermark file {}.".format(
+                self.watermark_file))
+            return {}
+
+        # earlier versions saved ids as a list without creation times
+        for mark in marks.values():
+            if isinstance(mark.get('ids'), list):
+                mark['ids'] = dict.fromkeys(mark['ids'], mark['time'])
+        return marks
+
+    def since(self, aoi_id):
+        """Return epoch seconds from which acquisitions are queried for AOI
+           or None if the AOI has no watermark."""
+
+        mark = self._marks.get(self._key(aoi_id))
+        if mark is None:
+            return None
+        return mark['time'] - self.overlap
+
+    def query_filter(self, aoi_id):
+        """Return range filter on creation_timestamp for AOI or None if the
+           AOI has no watermark."""
+
+        since = self.since(aoi_id)
+        if since is None:
+            return None
+        return creation_filter(since)
+
+    def is_new(self, aoi_id, acq):
+        """Return True if acq was not localized for AOI by an earlier run
+           and record it as seen."""
+
+        mark = self._marks.get(self._key(aoi_id))
+        if mark is not None and acq['id'] in mark['ids']:
+            return False
+        ts = acq.get('creation_timestamp')
+        if ts is not None:
+            with self._lock:
+                self._seen.setdefault(aoi_id, {})[acq['id']] = parse_timestamp(ts)
+        return True
+
+    def _advance(self, marks, exclude, deferred=()):
+        """Advance marks past the acquisitions seen in this run and return
+           the ids given up on. Ids in exclude hold their mark back for at
+           most max_holds runs, after which they are recorded as failed and
+           treated as localized. Ids in deferred were not submitted by this
+           run and hold their mark back without counting towards
+           max_holds."""
+
+        failed_ids = []
+        for aoi_id, seen in self._seen.items():
+            key = self._key(aoi_id)
+            pinned = {k: v for k, v in seen.items() if k in deferred}
+            excluded = {k: v for k, v in seen.items()
+                        if k in exclude and k not in deferred}
+            seen = {k: v for k, v in seen.items()
+                    if k not in exclude and k not in deferred}
+            mark = marks.get(key)
+            if mark is None and not seen and not excluded and not pinned:
+                continue
+
+            # count the runs each excluded id has held the mark back; ids
+            # not excluded again were localized or are out of reach
+            prev_held = mark.get('held', {}) if mark else {}
+            failed = dict(mark.get('failed', {})) if mark else {}
+            held = {id: prev_held[id] for id in pinned if id in prev_held}
+            for id, t in excluded.items():
+                holds = prev_held.get(id, {}).get('holds', 0) + 1
+                if holds >= self.max_holds:
+                    failed[id] = t
+                    seen[id] = t
+                    failed_ids.append(id)
+                else:
+                    held[id] = {"time": t, "holds": holds}
+
+            ids = dict(mark['ids']) if mark else {}
+            ids.update(seen)
+            times = list(seen.values())
+            if mark:
+                times.append(mark['time'])
+            latest = max(times) if times else None
+            pins = list(pinned.values()) + [h['time'] for h in held.values()]
+            if pins:
+                # keep held and deferred acquisitions within reach of the
+                # next query; ids of those localized after them are kept
+                # instead
+                pin = min(pins) - 1
+                latest = pin if latest is None else min(latest, pin)
+            marks[key] = {
+                "time": latest,
+                "ids": {k: v for k, v in ids.items()
+                        if v >= latest - self.overlap}
+            }
+            if held:
+                marks[key]['held'] = held
+            if failed:
+                marks[key]['failed'] = failed
+        return failed_ids
+
+    def save_pending(self, pending_file, exclude=(), acq_info=None,
+                     deferred=()):
+        """Write the acquisitions seen in this run, the ids in exclude and
+           deferred and the identifiers and datasets of acq_info to
+           pending_file, for commit_aoi_watermarks() to advance the
+           watermarks once the extract jobs have been submitted."""
+
+        acq_info = acq_info or {}
+        pending = {
+            "watermark_file": self.watermark_file,
+            "platform": self.platform,
+            "overlap": self.overlap,
+            "max_holds": self.max_holds,
+            "seen": self._seen,
+            "exclude": sorted(set(exclude)),
+            "deferred": sorted(set(deferred)),
+            "acquisitions": {id: {"identifier": acq['identifier'],
+                                  "dataset": acq['dataset']}
+                             for id, acq in acq_info.items()},
+        }
+        write_json_atomic(pending_file, pending, indent=2, sort_keys=True)
+        logging.info("Saved pending watermarks of {} AOIs to {}.".format(
+            len(self._seen), pending_file))
+
+    def save(self, exclude=(), deferred=()):
+        """Advance watermarks past the acquisitions seen in this run,
+           except for the acquisition ids in exclude and deferred, and
+           merge them into the watermark file. Return the ids recorded as
+           failed."""
+
+        exclude = set(exclude)
+        deferred = set(deferred)
+        watermark_dir = os.path.dirname(os.path.abspath(self.watermark_file))
+        os.makedirs(watermark_dir, exist_ok=True)
+        with locked("%s.lock" % self.watermark_file):
+            marks = self._load()
+            failed = self._advance(marks, exclude, deferred)
+            write_json_atomic(self.watermark_file, marks, indent=2,
+                              sort_keys=True)
+        self._marks = marks
+        self._seen = {}
+        logging.info("Saved watermarks of {} AOIs for {} to {}.".format(
+            len([k for k in marks if k.endswith("/%s" % self.platform)]),
+            self.platform, self.watermark_file))
+        return failed